@@ -0,0 +1,136 @@
+#
+# checkall - Regenerate the outputs of sps_read in memory and compare them with the checked-in files
+#            Usage: python3 checkall.py [--bless] [-q] [-d lines] [--no-cache] [--jobs N] [list ...]
+#
+# The peak lists are read once, and then the land and elevation stats, the
+# combined json, and the html, json, json index, and check outputs of every
+# peak list (or just the outputs of the given lists) are generated and compared
+# with misc/landstats.txt, misc/elevstats.txt, json/peaks/all.json, <list>.html,
+# json/peaks/<list>.json, json/peaks/index/<list>.json, and data/check/<list>.out.
+# The exit status is 0 only if the peak lists could be read and everything matches
+# (or was blessed).
+#
+import argparse
+import difflib
+import sys
+import time
+
+import sps_read
+
+def log(message, *args, **kwargs):
+	print(message.format(*args, **kwargs), file=sys.stderr)
+
+def getArtifacts(lists):
+	artifacts = []
+
+	if len(lists) == len(sps_read.peakListsOrdered):
+		artifacts.append(('misc/landstats.txt', sps_read.printLandManagementAreas))
+		artifacts.append(('misc/elevstats.txt', sps_read.printElevationStats))
+		artifacts.append(('json/peaks/all.json', sps_read.writeAllJSON))
+
+	for pl in lists:
+		for target, fileNameFormat, writeFunction in sps_read.buildTargets:
+			artifacts.append((fileNameFormat.format(pl.id.lower()), writeFunction, pl))
+
+	return artifacts
+
+def readGolden(fileName):
+	try:
+		with open(fileName) as f:
+			return f.read()
+	except FileNotFoundError:
+		return None
+
+def printDiff(fileName, golden, output, maxLines):
+	diff = difflib.unified_diff(golden.splitlines(True), output.splitlines(True),
+		fileName, fileName + ' (new)')
+
+	for i, line in enumerate(diff):
+		if maxLines and i == maxLines:
+			print("... (diff truncated after {} lines)".format(maxLines))
+			break
+		sys.stdout.write(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n')
+
+def checkArtifact(fileName, writeFunction, *args, bless=False, quiet=False, maxLines=0):
+	startTime = time.perf_counter()
+	try:
+		output = sps_read.captureOutput(writeFunction, *args)
+	except (Exception, SystemExit) as e:
+		status, info = 'failed', str(e) or type(e).__name__
+	else:
+		golden = readGolden(fileName)
+		if golden == output:
+			status, info = 'matches', ''
+		elif bless:
+			status, info = sps_read.writeIfChanged(fileName, output), 'blessed'
+		elif golden is None:
+			status, info = 'missing', ''
+		else:
+			status, info = 'differs', ''
+	seconds = time.perf_counter() - startTime
+
+	print("{:28} {:9} {:8.1f} ms {}".format(fileName, status, seconds * 1000, info).rstrip())
+	if status == 'differs' and not quiet:
+		printDiff(fileName, golden, output, maxLines)
+
+	return status
+
+def checkAll(lists, bless=False, quiet=False, maxLines=0, jobs=None):
+	startTime = time.perf_counter()
+	try:
+		sps_read.readAllHTML(jobs)
+	except SystemExit:
+		# A format error in one of the HTML files (which err() already logged with the
+		# file name and line number). err() exits with status 0, so return False instead.
+		print("Couldn't read the peak lists, so no files were checked")
+		return False
+	readSeconds = time.perf_counter() - startTime
+
+	summary = {}
+	for fileName, writeFunction, *args in getArtifacts(lists):
+		status = checkArtifact(fileName, writeFunction, *args,
+			bless=bless, quiet=quiet, maxLines=maxLines)
+		summary[status] = summary.get(status, 0) + 1
+
+	print("Checked {} files in {:.2f} seconds (read {:.2f} seconds; {})".format(
+		sum(summary.values()), time.perf_counter() - startTime, readSeconds,
+		", ".join(["{} {}".format(n, status) for status, n in sorted(summary.items())])))
+
+	return all(status in ('matches', 'created', 'updated') for status in summary)
+
+def main():
+	sps_read.initPeakLists()
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('lists', nargs='*', metavar='list',
+		help='only check the outputs of these peak lists (and skip the stats and all.json)')
+	parser.add_argument('--bless', action='store_true',
+		help='replace the files that are missing or differ with the new output')
+	parser.add_argument('-q', '--quiet', action='store_true',
+		help="don't print the diffs")
+	parser.add_argument('-d', '--diff-lines', type=int, default=200, metavar='lines',
+		help='print at most this many lines of each diff (0 for no limit, default 200)')
+	parser.add_argument('--no-cache', action='store_true',
+		help="don't use the snapshot cache")
+	parser.add_argument('--jobs', type=int,
+		help='read the peak lists with this many worker processes')
+	args = parser.parse_args()
+
+	if args.no_cache:
+		sps_read.Snapshot.enabled = False
+	if args.jobs is not None and args.jobs < 1:
+		parser.error("Please specify a positive number of jobs.")
+
+	lists = []
+	for listId in args.lists:
+		pl = sps_read.peakLists.get(listId)
+		if pl is None:
+			parser.error("Please specify a valid peak list abbreviation ({}).".format(listId))
+		if pl not in lists:
+			lists.append(pl)
+
+	if not checkAll(lists or sps_read.peakListsOrdered, args.bless, args.quiet, args.diff_lines, args.jobs):
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
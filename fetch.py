@@ -0,0 +1,398 @@
+#
+# fetch - Download URLs to files with persistent connections and per-host rate limits
+#
+# Each host gets its own worker threads (one per connection, one by default), which
+# keep their HTTP connection open between requests. The requests to a host are spaced
+# out by a token bucket (one request every 3 seconds by default, i.e. about 3.5 times
+# as fast as the 7 to 14 seconds that loadURLs used to sleep between rounds), so adding
+# connections lets requests overlap without making more of them per second.
+#
+# Requests that fail with a connection error, a timeout, 429, or 5xx are retried with
+# exponential backoff (honoring Retry-After). The URLs that haven't been downloaded yet
+# (except those that failed with another status, like 404) are kept in
+# data/cache/fetch-queue.json, so that an interrupted run is resumed by the next one.
+# Downloaded files are made read-only (mode 444), as before.
+#
+# The URL, fetch time, ETag, Last-Modified, SHA-256 digest, and HTTP status of every
+# downloaded file are kept in data/cache/pages.json, and a file that's downloaded again
+# is requested with If-None-Match and If-Modified-Since, so that an unchanged page costs
+# a 304 response instead of the whole page. A file whose content didn't change isn't
+# rewritten (so its mtime still shows when it last changed).
+#
+import email.utils
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+def log(message, *args, **kwargs):
+	print(message.format(*args, **kwargs), file=sys.stderr)
+
+mode444 = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+mode644 = stat.S_IWUSR | mode444
+
+class FetchError(Exception):
+	def __init__(self, message, *formatArgs, retryAfter=None):
+		self.message = message.format(*formatArgs)
+		self.retryAfter = retryAfter
+
+class TokenBucket(object):
+	def __init__(self, interval, burst=1):
+		self.rate = 1.0 / interval
+		self.burst = burst
+		self.tokens = burst
+		self.time = time.monotonic()
+		self.lock = threading.Lock()
+
+	def take(self):
+		# Take a token, waiting for one if there are none. The tokens may go negative,
+		# which reserves the next ones for the threads that are already waiting.
+
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate) - 1
+			self.time = now
+			wait = -self.tokens / self.rate
+		if wait > 0:
+			time.sleep(wait)
+
+	def pause(self, seconds):
+		# Hold off all the requests to the host (e.g. after a 429 or 503 response).
+
+		with self.lock:
+			self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class WorkQueue(object):
+	# The (url, fileName) pairs that haven't been downloaded yet, saved after every
+	# change, so that a run that was interrupted (or had failures) can be resumed.
+
+	fileName = 'data/cache/fetch-queue.json'
+
+	def __init__(self, items):
+		self.lock = threading.Lock()
+		self.items = []
+		try:
+			with open(self.fileName) as f:
+				self.items = [tuple(item) for item in json.load(f)]
+		except FileNotFoundError:
+			pass
+		except (ValueError, TypeError) as e:
+			log("Ignoring corrupt fetch queue {}: {}", self.fileName, e)
+
+		if self.items:
+			log("Resuming {} download{} from {}", len(self.items),
+				'' if len(self.items) == 1 else 's', self.fileName)
+
+		fileNames = {fileName for url, fileName in self.items}
+		self.items.extend([item for item in items if item[1] not in fileNames])
+		self.save()
+
+	def save(self):
+		if not self.items:
+			try:
+				os.remove(self.fileName)
+			except FileNotFoundError:
+				pass
+			return
+
+		os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+		tmpName = self.fileName + '.tmp'
+		with open(tmpName, 'w') as f:
+			json.dump(self.items, f, indent='\t')
+		os.replace(tmpName, self.fileName)
+
+	def remove(self, item):
+		with self.lock:
+			self.items.remove(item)
+			self.save()
+
+class PageMetadata(object):
+	fileName = 'data/cache/pages.json'
+	version = 1
+
+	def __init__(self):
+		self.pages = {}
+		self.lock = threading.Lock()
+		self.modified = False
+		try:
+			with open(self.fileName) as f:
+				metadata = json.load(f)
+			if metadata.get('version') == self.version:
+				self.pages = metadata['pages']
+		except FileNotFoundError:
+			pass
+		except (ValueError, KeyError, AttributeError) as e:
+			log("Ignoring corrupt page metadata {}: {}", self.fileName, e)
+
+	def get(self, fileName):
+		with self.lock:
+			return self.pages.get(fileName)
+
+	def set(self, fileName, info):
+		with self.lock:
+			self.pages[fileName] = info
+			self.modified = True
+
+	def save(self):
+		with self.lock:
+			if not self.modified:
+				return
+			os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+			tmpName = self.fileName + '.tmp'
+			with open(tmpName, 'w') as f:
+				json.dump({'version': self.version, 'pages': self.pages}, f, indent='\t', sort_keys=True)
+			os.replace(tmpName, self.fileName)
+			self.modified = False
+
+def fileDigest(fileName):
+	with open(fileName, 'rb') as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+def saveFile(fileName, content):
+	dirName = os.path.dirname(fileName)
+	if dirName:
+		os.makedirs(dirName, exist_ok=True)
+
+	tmpName = fileName + '.tmp'
+	with open(tmpName, 'wb') as f:
+		f.write(content)
+	os.chmod(tmpName, mode444)
+	if os.path.exists(fileName):
+		os.chmod(fileName, mode644)
+	os.replace(tmpName, fileName)
+
+class Host(object):
+	def __init__(self, scheme, netloc, interval, burst):
+		self.scheme = scheme
+		self.netloc = netloc
+		self.bucket = TokenBucket(interval, burst)
+		self.items = []
+		self.lock = threading.Lock()
+
+	def nextItem(self):
+		with self.lock:
+			return self.items.pop(0) if self.items else None
+
+	def connect(self, timeout):
+		if self.scheme == 'https':
+			return http.client.HTTPSConnection(self.netloc, timeout=timeout)
+		return http.client.HTTPConnection(self.netloc, timeout=timeout)
+
+class Fetcher(object):
+	userAgent = 'Mozilla/5.0 (compatible; sps_create.py)'
+	timeout = 60
+	maxAttempts = 5
+	backoff = 10
+
+	def __init__(self, connections=1, interval=3.0, burst=1):
+		self.connections = connections
+		self.interval = interval
+		self.burst = burst
+		self.lock = threading.Lock()
+
+	def request(self, host, connection, url, info):
+		# Return the response, with its (decompressed) content, or with None if the
+		# page wasn't modified since it was last downloaded.
+
+		parts = urllib.parse.urlsplit(url)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+
+		headers = {
+			'User-Agent': self.userAgent,
+			'Accept-Encoding': 'gzip',
+		}
+		if info is not None:
+			if info.get('etag'):
+				headers['If-None-Match'] = info['etag']
+			if info.get('lastModified'):
+				headers['If-Modified-Since'] = info['lastModified']
+
+		connection.request('GET', path, headers=headers)
+		response = connection.getresponse()
+		content = response.read()
+		with self.lock:
+			self.numBytes += len(content)
+
+		if response.status == 304 and info is not None:
+			return response, None
+		if response.status == 200:
+			if response.getheader('Content-Encoding') == 'gzip':
+				content = gzip.decompress(content)
+			return response, content
+
+		retryAfter = response.getheader('Retry-After')
+		if response.status == 429 or response.status >= 500:
+			raise FetchError("HTTP status {}", response.status,
+				retryAfter=int(retryAfter) if retryAfter and retryAfter.isdigit() else self.backoff)
+		raise FetchError("HTTP status {}", response.status)
+
+	def fetchItem(self, host, connection, item):
+		# Return the connection to use for the next request (None if it was closed).
+
+		url, fileName = item
+		info = None
+		oldDigest = None
+		if os.path.exists(fileName):
+			info = self.metadata.get(fileName)
+			oldDigest = fileDigest(fileName)
+			if info is not None and info.get('sha256') != oldDigest:
+				# The file was replaced since it was downloaded (e.g. restored from git),
+				# so the validators recorded for it don't apply to it.
+				info = None
+			if info is None or info['url'] != url:
+				# The file was downloaded before its metadata was kept (or from another
+				# URL), so the best we can do is to ask if it changed since its mtime.
+				info = {'lastModified': email.utils.formatdate(os.stat(fileName).st_mtime, usegmt=True)}
+
+		for attempt in range(self.maxAttempts):
+			host.bucket.take()
+			startTime = time.perf_counter()
+			try:
+				if connection is None:
+					connection = host.connect(self.timeout)
+				response, content = self.request(host, connection, url, info)
+			except FetchError as e:
+				error = e.message
+				wait = e.retryAfter
+				if wait is None:
+					break
+			except (OSError, http.client.HTTPException) as e:
+				# The server may have closed the persistent connection.
+				connection.close()
+				connection = None
+				error = str(e) or type(e).__name__
+				wait = self.backoff
+			else:
+				status = self.savePage(url, fileName, info, oldDigest, response, content)
+				self.queue.remove(item)
+				self.reportProgress(status, fileName, "{:.0f} ms".format(
+					(time.perf_counter() - startTime) * 1000))
+				return connection
+
+			if attempt + 1 < self.maxAttempts:
+				# Back off from the host for all of its connections, not just this one.
+				wait *= 2 ** attempt
+				log("{} {} (retrying in {} seconds)", url, error, wait)
+				host.bucket.pause(wait)
+
+		# Keep the URL in the queue for the next run, unless the error wasn't temporary.
+		if wait is None:
+			self.queue.remove(item)
+		with self.lock:
+			self.failed.append((url, error))
+		self.reportProgress('FAILED', fileName, error)
+		return connection
+
+	def savePage(self, url, fileName, info, oldDigest, response, content):
+		# Save the page if it differs from the file (whose digest is oldDigest, or None
+		# if there's no file), update its metadata, and return its status.
+
+		if content is None:
+			status = 'not modified'
+			digest = oldDigest
+		else:
+			digest = hashlib.sha256(content).hexdigest()
+			if digest == oldDigest:
+				status = 'unchanged'
+			else:
+				status = 'new' if oldDigest is None else 'changed'
+				saveFile(fileName, content)
+
+		# A 304 response doesn't have to repeat the validators.
+		validators = info if content is None else {}
+		self.metadata.set(fileName, {
+			'url': url,
+			'fetchTime': int(time.time()),
+			'etag': response.getheader('ETag') or validators.get('etag'),
+			'lastModified': response.getheader('Last-Modified') or validators.get('lastModified'),
+			'sha256': digest,
+			'status': response.status,
+			'size': os.path.getsize(fileName),
+		})
+		with self.lock:
+			self.results.setdefault(status, []).append(fileName)
+		return status
+
+	def reportProgress(self, status, fileName, info):
+		with self.lock:
+			self.numDone += 1
+			elapsed = time.monotonic() - self.startTime
+			remaining = (self.numItems - self.numDone) * elapsed / self.numDone
+			log("{}/{} {} {} ({}) ETA {}:{:02}", self.numDone, self.numItems, status, fileName, info,
+				*divmod(int(remaining + 0.5), 60))
+
+	def worker(self, host):
+		connection = None
+		while not self.stopped:
+			item = host.nextItem()
+			if item is None:
+				break
+			connection = self.fetchItem(host, connection, item)
+		if connection is not None:
+			connection.close()
+
+	def fetch(self, items):
+		# Download each (url, fileName) pair, plus any left over from a previous run.
+		# Return the list of (url, error) pairs for the URLs that couldn't be downloaded.
+
+		self.queue = WorkQueue(items)
+		self.metadata = PageMetadata()
+		self.failed = []
+		self.results = {}
+		self.numBytes = 0
+		self.numItems = len(self.queue.items)
+		self.numDone = 0
+		self.stopped = False
+		if not self.numItems:
+			return self.failed
+
+		hosts = {}
+		for item in self.queue.items:
+			parts = urllib.parse.urlsplit(item[0])
+			host = hosts.get((parts.scheme, parts.netloc))
+			if host is None:
+				host = hosts[parts.scheme, parts.netloc] = Host(parts.scheme, parts.netloc,
+					self.interval, self.burst)
+			host.items.append(item)
+
+		log("Downloading {} file{} from {} with {} connection{} per host, {} seconds apart",
+			self.numItems, '' if self.numItems == 1 else 's', ", ".join(sorted([netloc for scheme, netloc in hosts])),
+			self.connections, '' if self.connections == 1 else 's', self.interval)
+
+		self.startTime = time.monotonic()
+		threads = [threading.Thread(target=self.worker, args=(host,), daemon=True)
+			for host in hosts.values() for i in range(min(self.connections, len(host.items)))]
+		for thread in threads:
+			thread.start()
+		try:
+			for thread in threads:
+				while thread.is_alive():
+					thread.join(0.5)
+		except KeyboardInterrupt:
+			self.stopped = True
+			log("Interrupted, {} download{} left in {}", len(self.queue.items),
+				'' if len(self.queue.items) == 1 else 's', self.queue.fileName)
+			raise
+		finally:
+			self.metadata.save()
+
+		self.report()
+		return self.failed
+
+	def report(self):
+		log("Downloaded {} of {} files ({:,} bytes) in {:.1f} seconds: {}", self.numItems - len(self.failed),
+			self.numItems, self.numBytes, time.monotonic() - self.startTime,
+			", ".join(["{} {}".format(len(fileNames), status) for status, fileNames in sorted(self.results.items())]))
+		for status in ('new', 'changed'):
+			for fileName in sorted(self.results.get(status, [])):
+				log("{:7} {}", status, fileName)
+		for url, error in self.failed:
+			log("Failed to download {}: {}", url, error)
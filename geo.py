@@ -19,6 +19,68 @@ class Spheroid(object):
 		self.ee = self.f * (2 - self.f)
 		self.e = math.sqrt(self.ee)
 
+		# https://en.wikipedia.org/wiki/Earth_radius#Arithmetic_mean_radius
+		self.meanRadius = (2*self.a + self.b) / 3
+
+	def sphericalDistance(self, lat1, lng1, lat2, lng2):
+		#
+		# Haversine formula on a sphere with the mean radius - within about 0.5%
+		# of the distance on the ellipsoid, and several times faster
+		#
+		lat1 *= radiansPerDegree
+		lat2 *= radiansPerDegree
+		sinLat = math.sin((lat2 - lat1) / 2)
+		sinLng = math.sin((lng2 - lng1) * radiansPerDegree / 2)
+		h = sinLat*sinLat + math.cos(lat1) * math.cos(lat2) * sinLng*sinLng
+
+		return 2 * self.meanRadius * math.asin(min(1, math.sqrt(h)))
+
+	def distance(self, lat1, lng1, lat2, lng2):
+		#
+		# Geodesic distance in meters using Vincenty's inverse formula
+		# https://en.wikipedia.org/wiki/Vincenty%27s_formulae#Inverse_problem
+		# Falls back to the spherical distance for nearly antipodal points,
+		# where the iteration doesn't converge.
+		#
+		a, b, f = self.a, self.b, self.f
+		sin = math.sin
+		cos = math.cos
+
+		U1 = math.atan((1 - f) * math.tan(lat1 * radiansPerDegree))
+		U2 = math.atan((1 - f) * math.tan(lat2 * radiansPerDegree))
+		sinU1, cosU1 = sin(U1), cos(U1)
+		sinU2, cosU2 = sin(U2), cos(U2)
+
+		L = (lng2 - lng1) * radiansPerDegree
+		lam = L
+
+		for i in range(100):
+			sinLam, cosLam = sin(lam), cos(lam)
+			sinSigma = math.hypot(cosU2 * sinLam, cosU1*sinU2 - sinU1*cosU2*cosLam)
+			if sinSigma == 0:
+				return 0.0
+			cosSigma = sinU1*sinU2 + cosU1*cosU2*cosLam
+			sigma = math.atan2(sinSigma, cosSigma)
+			sinAlpha = cosU1 * cosU2 * sinLam / sinSigma
+			cosSqAlpha = 1 - sinAlpha*sinAlpha
+			cos2SigmaM = cosSigma - 2*sinU1*sinU2/cosSqAlpha if cosSqAlpha else 0
+			C = f/16 * cosSqAlpha * (4 + f*(4 - 3*cosSqAlpha))
+			prevLam = lam
+			lam = L + (1 - C) * f * sinAlpha * (sigma + C*sinSigma*(cos2SigmaM +
+				C*cosSigma*(-1 + 2*cos2SigmaM*cos2SigmaM)))
+			if abs(lam - prevLam) < 1e-12:
+				break
+		else:
+			return self.sphericalDistance(lat1, lng1, lat2, lng2)
+
+		uu = cosSqAlpha * (a*a - b*b) / (b*b)
+		A = 1 + uu/16384 * (4096 + uu*(-768 + uu*(320 - 175*uu)))
+		B = uu/1024 * (256 + uu*(-128 + uu*(74 - 47*uu)))
+		deltaSigma = B*sinSigma*(cos2SigmaM + B/4*(cosSigma*(-1 + 2*cos2SigmaM*cos2SigmaM) -
+			B/6*cos2SigmaM*(-3 + 4*sinSigma*sinSigma)*(-3 + 4*cos2SigmaM*cos2SigmaM)))
+
+		return b * A * (sigma - deltaSigma)
+
 Clarke_1866_Ellipsoid = Spheroid(6_378_206.4, 294.9786982) # https://en.wikipedia.org/wiki/North_American_Datum
 GRS_1980_Ellipsoid = Spheroid(6_378_137, 298.257222101) # https://en.wikipedia.org/wiki/Geodetic_Reference_System_1980
 WGS_84_Ellipsoid = Spheroid(6_378_137, 298.257223563) # https://en.wikipedia.org/wiki/World_Geodetic_System
@@ -402,6 +464,24 @@ def ll2utm(args, config):
 	east, north, zone = UTM(config.spheroid).project(lng, lat)
 	print(f'{zone} {north:,.3f} {east:,.3f}')
 
+def dist(args, config):
+	if len(args) < 4:
+		return 'Please specify two latitude and longitude pairs!'
+	values = args[:4]
+	args[:4] = []
+
+	pattern = re.compile('-?[0-9]{1,3}(?:\\.[0-9]{1,14})?')
+	if not all(pattern.fullmatch(v) for v in values):
+		return 'Please specify valid latitudes and longitudes!'
+	lat1, lng1, lat2, lng2 = map(float, values)
+	if not (-90 <= lat1 <= 90 and -90 <= lat2 <= 90):
+		return 'Please specify latitudes between -90 and 90!'
+	if not (-180 <= lng1 <= 180 and -180 <= lng2 <= 180):
+		return 'Please specify longitudes between -180 and 180!'
+
+	meters = config.spheroid.distance(lat1, lng1, lat2, lng2)
+	print(f'{meters:,.3f} meters ({meters / 1609.344:,.3f} miles)')
+
 def utm2ll(args, config):
 	if len(args) < 3:
 		return 'Please specify the UTM zone, northing, and easting!'
@@ -445,6 +525,7 @@ Usage:
 Commands:
 {t}ll2utm <latitude> <longitude>         Convert latitude and longitude to UTM zone, northing, and easting
 {t}utm2ll <zone> <northing> <easting>    Convert UTM zone, northing, and easting to latitude and longitude
+{t}dist <lat1> <lng1> <lat2> <lng2>      Geodesic distance between two points
 {t}grs80                                 Use the GRS 80 ellipsoid for conversions/projections
 {t}wgs84                                 Use the WGS 84 ellipsoid for conversions/projections
 """)
@@ -457,6 +538,7 @@ def main(args):
 		'help': help,
 		'll2utm': ll2utm,
 		'utm2ll': utm2ll,
+		'dist': dist,
 		'grs80': set_grs80,
 		'wgs84': set_wgs84,
 		'test1': test1,
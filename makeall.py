@@ -0,0 +1,329 @@
+#
+# makeall - Rebuild the generated files whose inputs have changed
+#           Usage: python3 makeall.py [-n] [-v] [pattern ...]
+#
+# Every target records the SHA-256 digests of its inputs and of its output in
+# data/cache/manifest.json. A target is rebuilt only if it has no record, if
+# its recipe changed, if its output is missing or was modified, or if one of
+# its inputs changed. The inputs of the sps_read targets depend on the peak
+# lists (data-from/data-also links and peak ids), so they're recorded when the
+# target is built.
+#
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import lcd2json
+import sps_read
+
+def log(message, *args, **kwargs):
+	print(message.format(*args, **kwargs), file=sys.stderr)
+
+class Manifest(object):
+	fileName = 'data/cache/manifest.json'
+	version = 1
+
+	def __init__(self):
+		self.files = {}
+		self.targets = {}
+		try:
+			with open(self.fileName) as f:
+				manifest = json.load(f)
+			if manifest.get('version') == self.version:
+				self.files = manifest['files']
+				self.targets = manifest['targets']
+		except FileNotFoundError:
+			pass
+		except (ValueError, KeyError, AttributeError) as e:
+			log("Ignoring corrupt manifest {}: {}", self.fileName, e)
+
+	def digest(self, fileName):
+		try:
+			stat = os.stat(fileName)
+		except FileNotFoundError:
+			self.files.pop(fileName, None)
+			return None
+
+		info = self.files.get(fileName)
+		if info is not None and info[:2] == [stat.st_size, stat.st_mtime_ns]:
+			return info[2]
+
+		digest = sps_read.fileDigest(fileName)
+		self.files[fileName] = [stat.st_size, stat.st_mtime_ns, digest]
+		return digest
+
+	def save(self):
+		manifest = {'version': self.version, 'files': self.files, 'targets': self.targets}
+		sps_read.writeIfChanged(self.fileName, json.dumps(manifest, indent='\t', sort_keys=True))
+
+class Target(object):
+	def __init__(self, fileName, recipe, build, *args, inputs=None, getInputs=None):
+		self.fileName = fileName
+		self.recipe = recipe
+		self.build = build
+		self.args = args
+		self.inputs = inputs
+		self.getInputs = getInputs
+
+	def staleReason(self, manifest):
+		record = manifest.targets.get(self.fileName)
+		if record is None:
+			return "no previous build"
+		if record['recipe'] != self.recipe:
+			return "recipe changed"
+
+		output = manifest.digest(self.fileName)
+		if output is None:
+			return "output is missing"
+		if output != record['output']:
+			return "output was modified"
+
+		inputs = record['inputs']
+		if self.inputs is not None and sorted(self.inputs) != sorted(inputs):
+			return "list of inputs changed"
+
+		changed = [fileName for fileName in sorted(inputs) if manifest.digest(fileName) != inputs[fileName]]
+		if changed:
+			if len(changed) > 3:
+				changed[2:] = ["{} other files".format(len(changed) - 2)]
+			return "changed: " + ", ".join(changed)
+
+		return None
+
+	def make(self, manifest):
+		status, info = self.build(self.fileName, *self.args)
+		if status != 'failed':
+			inputs = self.inputs
+			if inputs is None:
+				inputs = self.getInputs(*self.args)
+			manifest.targets[self.fileName] = {
+				'recipe': self.recipe,
+				'inputs': {fileName: manifest.digest(fileName) for fileName in inputs},
+				'output': manifest.digest(self.fileName),
+			}
+		return status, info
+
+peakListIds = [params[0] for params in sps_read.peakListsOrdered]
+modelLoaded = False
+
+def loadPeakLists():
+	global modelLoaded
+	if not modelLoaded:
+		sps_read.initPeakLists()
+		sps_read.readAllHTML()
+		modelLoaded = True
+
+def getLinkedLists(pl):
+	lists = [pl]
+	for pl in lists:
+		for listId in sorted(sps_read.getLinkedListIds(pl)):
+			linked = sps_read.peakLists.get(listId)
+			if linked is not None and linked not in lists:
+				lists.append(linked)
+	return lists
+
+def getJSONInputs(listId):
+	pl = sps_read.peakLists[listId]
+	inputs = [pl.htmlFilename for pl in getLinkedLists(pl)]
+	inputs.extend(['sps_read.py', 'topoview.py', 'topoview.txt'])
+	return inputs
+
+def getIndexInputs(listId):
+	return [sps_read.peakLists[listId].htmlFilename, 'sps_read.py']
+
+def getAllJSONInputs():
+	return getStatsInputs() + ['topoview.py', 'topoview.txt']
+
+def getCheckInputs(listId):
+	import sps_create
+
+	pl = sps_read.peakLists[listId]
+	inputs = [pl.htmlFilename for pl in getLinkedLists(pl)]
+	inputs.extend(['sps_read.py', 'sps_create.py', 'vertcon.py'])
+
+	listDirs = [listId]
+	if pl.id in ('SPS', 'OSP'):
+		listDirs.append('vr')
+	for listDir in listDirs:
+		inputs.extend(sorted(glob.glob('data/peaklists/{}/*'.format(listDir))))
+	inputs.extend(sorted(glob.glob('data/vertcon/*')))
+
+	for peakClass in (sps_create.PeakLoJ, sps_create.PeakPb):
+		for section in pl.sections:
+			for peak in section.peaks:
+				peakId = getattr(peak, peakClass.classAttrId, None)
+				if peakId is not None and peakId[0] != '-':
+					inputs.append(peakClass.getPeakFileName(peakId))
+	return inputs
+
+def getStatsInputs():
+	return [pl.htmlFilename for pl in sps_read.peakListsOrdered] + ['sps_read.py']
+
+def buildJSON(fileName, listId):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.writeJSON, sps_read.peakLists[listId])
+
+def buildIndex(fileName, listId):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.writeJSONIndex, sps_read.peakLists[listId])
+
+def buildAllJSON(fileName):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.writeAllJSON)
+
+def buildCheck(fileName, listId):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.checkData, sps_read.peakLists[listId])
+
+def buildLandStats(fileName):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.printLandManagementAreas)
+
+def buildElevStats(fileName):
+	loadPeakLists()
+	return sps_read.buildOutput(fileName, sps_read.printElevationStats)
+
+def scanLCD(lcdFileName):
+	inputs = [lcdFileName, 'lcd2json.py']
+	path = []
+	with open(lcdFileName) as lcdFile:
+		for line in lcdFile:
+			m = lcd2json.linePattern.match(line)
+			if m is None:
+				continue
+			indent, name, idType, id = m.groups()[:4]
+			level = len(indent)
+			del path[level:]
+			path.append(id)
+			if idType == ':':
+				fileName = 'json/' + '/'.join(path) + '.json'
+				inputs.extend([fileName + '.gz', fileName])
+	return inputs
+
+def buildLCD(fileName, lcdFileName):
+	lcd2json.lineNumber = 0
+	try:
+		with open(lcdFileName) as lcdFile:
+			content = json.dumps(lcd2json.parseLCD(lcdFile), separators=(',', ':'))
+	except (Exception, SystemExit) as e:
+		return 'failed', str(e) or "see above"
+
+	return sps_read.writeIfChanged(fileName, content), sps_read.int2str(len(content)) + ' bytes'
+
+compressors = {
+	'br': ['/usr/local/bin/brotli', '--best', '--stdout'],
+	'gz': ['/usr/local/bin/zopfli', '-c'],
+}
+
+def compress(fileName, command, inputFileName):
+	try:
+		content = subprocess.run(command + [inputFileName], stdout=subprocess.PIPE, check=True).stdout
+	except (OSError, subprocess.CalledProcessError) as e:
+		return 'failed', str(e)
+
+	return sps_read.writeIfChanged(fileName, content), sps_read.int2str(len(content)) + ' bytes'
+
+def getTargets():
+	targets = []
+
+	for listId in peakListIds:
+		targets.append(Target('json/peaks/{}.json'.format(listId), 'sps_read json',
+			buildJSON, listId, getInputs=getJSONInputs))
+		targets.append(Target('json/peaks/index/{}.json'.format(listId), 'sps_read jsonindex',
+			buildIndex, listId, getInputs=getIndexInputs))
+		targets.append(Target('data/check/{}.out'.format(listId), 'sps_read check',
+			buildCheck, listId, getInputs=getCheckInputs))
+
+	targets.append(Target('json/peaks/all.json', 'sps_read jsonall',
+		buildAllJSON, getInputs=getAllJSONInputs))
+	targets.append(Target('misc/landstats.txt', 'sps_read land',
+		buildLandStats, getInputs=getStatsInputs))
+	targets.append(Target('misc/elevstats.txt', 'sps_read elev',
+		buildElevStats, getInputs=getStatsInputs))
+
+	targets.append(Target('json/pmap/lcd.json', 'lcd2json',
+		buildLCD, 'pmap.lcd', inputs=scanLCD('pmap.lcd')))
+
+	generated = set(target.fileName for target in targets)
+
+	htmlFiles = [listId + '.html' for listId in peakListIds] + ['SierraPasses.html']
+	codeFiles = ['MapServer.js', 'peakTable.css', 'peakTable.js',
+		'pmap.html', 'pmapgl.html', 'pmapmb.html', 'pmap-lc.js']
+	jsonFiles = ['json/blm/ca/{}.json'.format(name) for name in ('aa', 'nm', 'w', 'wsa', 'wsar')]
+	for pattern in ('json/nps/*.json', 'json/peaks/*.json', 'json/peaks/index/*.json', 'json/pmap/*.json'):
+		jsonFiles.extend(sorted(set(glob.glob(pattern)) |
+			set(fnmatch.filter(generated, pattern))))
+
+	for prefix, fileNames in (('zipped/', htmlFiles + codeFiles), ('', jsonFiles)):
+		for inputFileName in fileNames:
+			if inputFileName not in generated and not os.path.exists(inputFileName):
+				continue
+			for suffix, command in sorted(compressors.items()):
+				targets.append(Target('{}{}.{}'.format(prefix, inputFileName, suffix),
+					' '.join(command), compress, command, inputFileName, inputs=[inputFileName]))
+
+	return targets
+
+def make(targets, patterns, dryRun=False, verbose=False):
+	startTime = time.perf_counter()
+	targetMap = {target.fileName: target for target in targets}
+	manifest = Manifest()
+	summary = {}
+	visited = set()
+
+	def makeTarget(target):
+		if target.fileName in visited:
+			return
+		visited.add(target.fileName)
+
+		for fileName in target.inputs or ():
+			if fileName in targetMap:
+				makeTarget(targetMap[fileName])
+
+		reason = target.staleReason(manifest)
+		if reason is None:
+			status = 'current'
+			if verbose:
+				print("{:32} {:9}".format(target.fileName, status))
+		elif dryRun:
+			status = 'stale'
+			print("{:32} {:9} {}".format(target.fileName, status, reason))
+		else:
+			status, info = target.make(manifest)
+			print("{:32} {:9} {} ({})".format(target.fileName, status, info, reason))
+		summary[status] = summary.get(status, 0) + 1
+
+	try:
+		for target in targets:
+			if not patterns or any(fnmatch.fnmatch(target.fileName, p) for p in patterns):
+				makeTarget(target)
+	finally:
+		if not dryRun:
+			manifest.save()
+
+	print("Checked {} targets in {:.2f} seconds ({})".format(sum(summary.values()),
+		time.perf_counter() - startTime,
+		", ".join(["{} {}".format(n, status) for status, n in sorted(summary.items())])))
+
+	if 'failed' in summary:
+		sys.exit(1)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('patterns', nargs='*',
+		help='only make the targets matching these glob patterns (and what they depend on)')
+	parser.add_argument('-n', '--dry-run', action='store_true',
+		help="print the targets that are out of date and why, but don't rebuild them")
+	parser.add_argument('-v', '--verbose', action='store_true',
+		help='also print the targets that are up to date')
+	args = parser.parse_args()
+
+	make(getTargets(), args.patterns, args.dry_run, args.verbose)
+
+if __name__ == '__main__':
+	main()
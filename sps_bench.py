@@ -0,0 +1,832 @@
+#
+# sps_bench - Benchmarks for the peak list reader and writer
+#             Usage: python3 sps_bench.py memory
+#                    python3 sps_bench.py access [repeat]
+#                    python3 sps_bench.py rows [repeat]
+#                    python3 sps_bench.py json [repeat]
+#                    python3 sps_bench.py alljson
+#                    python3 sps_bench.py generate numPeaks fileName
+#                    python3 sps_bench.py scale [numPeaks ...]
+#                    python3 sps_bench.py near [numPeaks ...]
+#                    python3 sps_bench.py isolation [numPeaks ...]
+#                    python3 sps_bench.py stats [numPeaks ...]
+#                    python3 sps_bench.py serve [repeat]
+#                    python3 sps_bench.py peakfiles [numFiles ...]
+#                    python3 sps_bench.py tableparser [kilobytes ...]
+#
+import contextlib
+import copy
+import io
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sps_read
+
+def log(message, *args, **kwargs):
+	print(message.format(*args, **kwargs), file=sys.stderr)
+
+def err(*args, **kwargs):
+	log(*args, **kwargs)
+	sys.exit()
+
+listParams = sps_read.peakListParams
+
+def readAllHTML():
+	sps_read.Snapshot.enabled = False
+	sps_read.resetPeakLists()
+	sps_read.readAllHTML()
+
+def allPeaks():
+	for pl in sps_read.peakListsOrdered:
+		for section in pl.sections:
+			for peak in section.peaks:
+				yield peak
+
+def instanceSize(obj):
+	size = sys.getsizeof(obj)
+	if hasattr(obj, '__dict__'):
+		size += sys.getsizeof(obj.__dict__)
+	return size
+
+def getInstances():
+	instances = {}
+
+	def add(obj):
+		instances.setdefault(type(obj).__name__, {})[id(obj)] = obj
+
+	for pl in sps_read.peakListsOrdered:
+		for section in pl.sections:
+			add(section)
+			for peak in section.peaks:
+				add(peak)
+				for e in peak.elevations:
+					add(e)
+				for prom in peak.prominences:
+					if not isinstance(prom, int):
+						add(prom)
+						add(prom.peakElev)
+						add(prom.saddleElev)
+				if peak.column12 is not None:
+					add(peak.column12)
+
+	for area in sps_read.LandMgmtArea.name2area.values():
+		add(area)
+	for src in sps_read.USGSTopo.sources.values():
+		add(src)
+	for src in sps_read.NGSDataSheet.sources.values():
+		add(src)
+
+	return instances
+
+def benchMemory():
+	tracemalloc.start()
+	readAllHTML()
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	print("Traced memory after readAllHTML: {:.2f} MB (peak {:.2f} MB)".format(
+		current / 1048576, peak / 1048576))
+	print()
+	print("{:16} {:>6} {:>14} {:>10}".format("Class", "Count", "Bytes/instance", "Bytes"))
+
+	total = 0
+	for name, objects in sorted(getInstances().items()):
+		size = sum([instanceSize(obj) for obj in objects.values()])
+		total += size
+		print("{:16} {:6} {:14.1f} {:10}".format(name, len(objects), size / len(objects), size))
+	print("{:16} {:6} {:14} {:10}".format("Total", "", "", total))
+
+def bestTime(function, repeat):
+	times = []
+	for i in range(repeat):
+		startTime = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - startTime)
+	return min(times)
+
+def benchAccess(repeat):
+	readAllHTML()
+	peaks = list(allPeaks())
+
+	def readAttributes():
+		for peak in peaks:
+			peak.id, peak.name, peak.latitude, peak.longitude, peak.dataFrom
+			peak.isClimbed, peak.landClass, peak.delisted, peak.suspended, peak.countryUS
+			for e in peak.elevations:
+				e.elevationFeet, e.isRange, e.source
+
+	def writeHTML():
+		for pl in sps_read.peakListsOrdered:
+			sps_read.writeHTML(pl, io.StringIO())
+
+	for name, function in (('Attribute access', readAttributes), ('writeHTML', writeHTML)):
+		seconds = bestTime(function, repeat)
+		print("{:16} {:8.2f} ms ({:.2f} us/peak, best of {})".format(name,
+			seconds * 1000, seconds * 1e6 / len(peaks), repeat))
+
+def getRowLines():
+	rows = []
+	for pl in sps_read.peakListsOrdered:
+		with open(pl.htmlFilename) as f:
+			lines = f.readlines()
+		for section in pl.sections:
+			for peak in section.peaks:
+				firstLine, lastLine = peak.lineSpan
+				rows.append((peak, lines[firstLine - 1:lastLine]))
+	return rows
+
+def benchRows(repeat):
+	readAllHTML()
+	rows = getRowLines()
+
+	def readAll():
+		for pl in sps_read.peakListsOrdered:
+			sps_read.readHTML(sps_read.PeakList(pl.id.lower(), pl.name, pl.numPeaks, pl.numSections))
+
+	seconds = bestTime(readAll, repeat)
+	print("{:24} {:8.2f} ms ({:.2f} us/row, best of {})".format("readHTML",
+		seconds * 1000, seconds * 1e6 / len(rows), repeat))
+
+	# Compare matching the peak name and the SP, W, BB, LoJ, and Pb columns one
+	# pattern at a time (as readHTML used to) against RE.peakName and RE.linkColumns.
+
+	RE = sps_read.RE
+	emptyCell = '<td>&nbsp;</td>\n'
+	peakNames = [re.compile('^' + pattern + '$') for pattern in RE.peakNames]
+	columns = (RE.summitpost, RE.wikipedia, RE.bobBurd, RE.listsOfJohn, RE.peakbagger)
+
+	samples = []
+	for peak, lines in rows:
+		for i in range(len(lines) - 4):
+			linkLines = lines[i:i + 5]
+			if RE.linkColumns.match(''.join(linkLines)):
+				samples.append((peak.name, linkLines))
+				break
+
+	def matchOld():
+		for name, lines in samples:
+			for pattern in peakNames:
+				if pattern.match(name):
+					break
+			for line, pattern in zip(lines, columns):
+				if line != emptyCell:
+					pattern.match(line)
+
+	def matchNew():
+		for name, lines in samples:
+			RE.peakName.match(name)
+			RE.linkColumns.match(''.join(lines))
+
+	for name, function in (('Separate patterns', matchOld), ('Combined patterns', matchNew)):
+		seconds = bestTime(function, repeat)
+		print("{:24} {:8.2f} ms ({:.2f} us/row, best of {})".format(name,
+			seconds * 1000, seconds * 1e6 / len(samples), repeat))
+
+jsonModes = ('pretty', 'minify', 'ndjson')
+
+def benchJSON(repeat):
+	readAllHTML()
+
+	print("{:6}".format("List") + "".join(["{:>20}".format(mode) for mode in jsonModes]))
+	totals = {mode: [0, 0] for mode in jsonModes}
+
+	for pl in sps_read.peakListsOrdered:
+		line = "{:6}".format(pl.id)
+		for mode in jsonModes:
+			size = len(sps_read.captureOutput(sps_read.writeJSON, pl, mode).encode())
+			seconds = bestTime(lambda: sps_read.captureOutput(sps_read.writeJSON, pl, mode), repeat)
+			totals[mode][0] += seconds
+			totals[mode][1] += size
+			line += "{:8.2f} ms {:>8}".format(seconds * 1000, sps_read.int2str(size))
+		print(line)
+
+	print("{:6}".format("Total") + "".join(["{:8.2f} ms {:>8}".format(seconds * 1000,
+		sps_read.int2str(size)) for seconds, size in [totals[mode] for mode in jsonModes]]))
+
+def benchAllJSON():
+	readAllHTML()
+
+	def size(function, *args):
+		return len(sps_read.captureOutput(function, *args).encode())
+
+	print("{:16} {:>8} {:>10} {:>10}".format("", "Features", "Pretty", "Minified"))
+
+	numFeatures = 0
+	listSizes = [0, 0]
+	indexSize = 0
+	for pl in sps_read.peakListsOrdered:
+		numFeatures += len(sps_read.peakListJSON(pl)['features'])
+		listSizes[0] += size(sps_read.writeJSON, pl)
+		listSizes[1] += size(sps_read.writeJSON, pl, 'minify')
+		indexSize += size(sps_read.writeJSONIndex, pl)
+
+	allSizes = [size(sps_read.writeAllJSON), size(sps_read.writeAllJSON, 'minify')]
+	allFeatures = len(sps_read.allPeaksJSON()['features'])
+
+	print("{:16} {:8} {:>10} {:>10}".format("Per-list files", numFeatures, *map(sps_read.int2str, listSizes)))
+	print("{:16} {:8} {:>10} {:>10}".format("all.json", allFeatures, *map(sps_read.int2str, allSizes)))
+	print("{:16} {:8} {:>10} {:>10}".format("Index files", "", *[sps_read.int2str(indexSize)] * 2))
+	print("{:16} {:8} {:>10} {:>10}".format("all.json + index", allFeatures,
+		*[sps_read.int2str(n + indexSize) for n in allSizes]))
+	print("{:16} {:8} {:>10} {:>10}".format("Saved", numFeatures - allFeatures,
+		*["{:.1%}".format(1 - (n + indexSize) / total) for n, total in zip(allSizes, listSizes)]))
+
+# A synthetic peak list is made by cloning the sections of the real peak lists
+# (in order, over and over) until it has the requested number of peaks. Each
+# clone is moved a little, gets its own NGS data sheet IDs (since a data sheet
+# may only be referenced by one peak), and isn't a high point. The first clone
+# of every 20th real peak uses data-from to refer to that peak instead.
+# Sections with peaks that readHTML allows (by list and peak ID) to have no BB,
+# LoJ, or Pb link are left out, since the clones would get different IDs.
+
+class SyntheticList(object):
+	listId = 'syn'
+	name = 'Synthetic Peaks'
+	template = 'dps'
+	dataFromInterval = 20
+	doNotCopy = {'id', 'peakList', 'column12', 'dataFrom', 'dataFromInfo', 'dataFromPeak',
+		'dataAlso', 'dataAlsoPeaks', 'idTuple', 'lineSpan'}
+
+	def __init__(self, numPeaks, seed=1):
+		self.random = random.Random(seed)
+		self.ngsNumber = 0
+		self.dataFromSources = set()
+
+		template = sps_read.peakLists[self.template]
+		realSections = [section for pl in listParams
+			for section in sps_read.peakLists[pl[0]].sections
+			if section.peaks and all(map(self.hasAllLinks, section.peaks))]
+
+		pl = self.pl = self.newPeakList(numPeaks, 0)
+		pl.prologue = template.prologue
+		pl.epilogue = template.epilogue
+		pl.country = template.country
+		pl.state = template.state
+		pl.flags = template.flags
+
+		numCloned = 0
+		while numCloned < numPeaks:
+			realSection = realSections[len(pl.sections) % len(realSections)]
+			section = sps_read.Section(pl, realSection.name)
+			section.country = realSection.country
+			section.state = realSection.state
+			section.flags = realSection.flags
+			pl.sections.append(section)
+
+			for peak in realSection.peaks[:numPeaks - numCloned]:
+				section.peaks.append(self.clonePeak(section, peak, numCloned))
+				numCloned += 1
+
+		pl.numSections = len(pl.sections)
+
+	def newPeakList(self, numPeaks, numSections):
+		pl = sps_read.PeakList(self.listId, self.name, numPeaks, numSections)
+		pl.sortkey = len(listParams)
+		return pl
+
+	def hasAllLinks(self, peak):
+		return (peak.bobBurdId is not None and peak.peakbaggerId is not None and
+			(peak.listsOfJohnId is not None or not peak.countryUS))
+
+	def clonePeak(self, section, peak, cloneNumber):
+		clone = sps_read.Peak(section)
+
+		for k in sps_read.Peak.__slots__:
+			if k not in self.doNotCopy and hasattr(peak, k):
+				setattr(clone, k, getattr(peak, k))
+
+		clone.id = '{}.{}'.format(len(section.peakList.sections), peak.id.split('.')[1])
+
+		if (peak.dataFrom is None and peak not in self.dataFromSources
+				and cloneNumber % self.dataFromInterval == 0):
+			self.dataFromSources.add(peak)
+			clone.dataFrom = peak.fromId()
+			clone.dataFromPeak = peak
+			clone.dataAlsoPeaks = peak.dataAlsoPeaks
+			return clone
+
+		clone.latitude = self.jitter(peak.latitude)
+		clone.longitude = self.jitter(peak.longitude)
+		latlng = float(clone.latitude), float(clone.longitude)
+
+		clone.elevations = []
+		dataSheets = []
+		for e in peak.elevations:
+			e = copy.copy(e)
+			e.latlng = latlng
+			if isinstance(e.source, sps_read.NGSDataSheet):
+				e.source = copy.copy(e.source)
+				e.source.peak = clone
+				dataSheets.append(e.source)
+			clone.elevations.append(e)
+
+		# The elevations are sorted by data sheet ID, so keep the new IDs in the same order.
+		for src in sorted(dataSheets, key=lambda src: src.id):
+			src.id = src.linkSuffix = self.nextDataSheetId()
+
+		return clone
+
+	def jitter(self, degrees):
+		decimals = len(degrees) - degrees.index('.') - 1
+		return '{:.{}f}'.format(float(degrees) + self.random.uniform(-0.01, 0.01), decimals)
+
+	def nextDataSheetId(self):
+		while True:
+			letters, number = divmod(self.ngsNumber, 10000)
+			self.ngsNumber += 1
+			prefix = chr(ord('A') + letters // 26) + chr(ord('A') + letters % 26)
+			stationID = '{}{:04}'.format(prefix, number)
+			if stationID not in sps_read.NGSDataSheet.sources:
+				return stationID
+
+	def html(self):
+		output = io.StringIO()
+		sps_read.writeHTML(self.pl, output)
+		return output.getvalue()
+
+	def read(self, fileName):
+		pl = self.newPeakList(self.pl.numPeaks, self.pl.numSections)
+		pl.htmlFilename = fileName
+		pl.readHTML()
+		return pl
+
+def generate(numPeaks, fileName):
+	readAllHTML()
+	syn = SyntheticList(numPeaks)
+	with open(fileName, 'w') as f:
+		f.write(syn.html())
+	log("Wrote {} peaks in {} sections to {}", sps_read.int2str(numPeaks),
+		syn.pl.numSections, fileName)
+
+def timeCommand(function, *args):
+	with contextlib.redirect_stdout(io.StringIO()) as output:
+		startTime = time.perf_counter()
+		function(*args)
+		seconds = time.perf_counter() - startTime
+	return seconds, output.getvalue()
+
+def printSummary(pl):
+	# printSummary goes through peakListsOrdered, so only let it see the synthetic list.
+	# The peak table is cleared so that each run builds it, rather than timing a cache hit.
+	lists = sps_read.peakListsOrdered[:]
+	sps_read.peakListsOrdered[:] = [pl]
+	sps_read.PeakTable.cached = None
+	try:
+		sps_read.printSummary(allPeaks=True)
+	finally:
+		sps_read.peakListsOrdered[:] = lists
+		sps_read.PeakTable.cached = None
+
+scaleCommands = ('readHTML', 'linkHTML', 'writeHTML', 'writeJSON', 'printSummary', 'checkData')
+
+def benchSize(numPeaks, tmpDir):
+	repeat = min(5, max(1, 10000 // numPeaks))
+	fileName = os.path.join(tmpDir, '{}.html'.format(numPeaks))
+
+	readAllHTML()
+	syn = SyntheticList(numPeaks)
+	html = syn.html()
+	with open(fileName, 'w') as f:
+		f.write(html)
+
+	# Reread the real lists so that nothing is left over from generating the list.
+	readAllHTML()
+
+	times = {}
+	def run(command, function, *args):
+		seconds, output = min([timeCommand(function, *args) for i in range(repeat)],
+			key=lambda result: result[0])
+		times[command] = seconds
+		return output
+
+	pl = None
+	def readHTML():
+		nonlocal pl
+		pl = syn.read(fileName)
+
+	run('readHTML', readHTML)
+	repeat, readRepeat = 1, repeat
+	run('linkHTML', pl.linkHTML)
+	repeat = readRepeat
+
+	if run('writeHTML', sps_read.writeHTML, pl) != html:
+		err("The synthetic list with {} peaks doesn't survive a round trip!", numPeaks)
+
+	run('writeJSON', sps_read.writeJSON, pl)
+	run('printSummary', printSummary, pl)
+	run('checkData', sps_read.checkData, pl)
+
+	log("{:>9} peaks in {:4} sections, {:6.1f} MB of HTML, best of {}", sps_read.int2str(numPeaks),
+		pl.numSections, len(html) / 1048576, repeat)
+	return times
+
+def benchScale(sizes):
+	tmpDir = tempfile.mkdtemp(prefix='sps_bench.')
+	try:
+		results = [benchSize(numPeaks, tmpDir) for numPeaks in sizes]
+	finally:
+		shutil.rmtree(tmpDir)
+
+	def printTable(title, format, value):
+		print()
+		print('{:14}'.format(title) + ''.join(['{:>11}'.format(sps_read.int2str(n)) for n in sizes])
+			+ ('   Exponent' if len(sizes) > 1 else ''))
+		for command in scaleCommands:
+			line = '{:14}'.format(command) + ''.join([format.format(value(times[command], n))
+				for n, times in zip(sizes, results)])
+			if len(sizes) > 1:
+				first, last = results[0][command], results[-1][command]
+				line += '{:11.2f}'.format(math.log(last / first) / math.log(sizes[-1] / sizes[0]))
+			print(line)
+
+	# The exponent is the slope on a log-log plot from the smallest to the largest
+	# size: 1.0 means the time grows linearly with the number of peaks.
+
+	printTable('Milliseconds', '{:11.1f}', lambda seconds, n: seconds * 1000)
+	printTable('Microsec/peak', '{:11.2f}', lambda seconds, n: seconds * 1e6 / n)
+
+def benchStats(sizes, repeat=5):
+	# Time building the peak table and running the stats commands on it, with and
+	# without NumPy (if it's available), using only the synthetic list.
+
+	readAllHTML()
+	lists = sps_read.peakListsOrdered[:]
+	useNumPy = sps_read.PeakTable.useNumPy
+	modes = [False]
+	try:
+		import numpy
+		modes.append(True)
+	except ImportError:
+		log("NumPy isn't available")
+
+	commands = (
+		('sum all', sps_read.printSummary, 3000, True, 100, True, True),
+		('groupstats', sps_read.printGroupStats, 'section', False, False, (10, 25, 50, 75, 90), 500),
+	)
+	print("{:>9} {:6} {:>10}".format("Peaks", "NumPy", "Table (ms)") +
+		"".join(["{:>16}".format(command[0] + " (ms)") for command in commands]))
+
+	try:
+		for numPeaks in sizes:
+			pl = SyntheticList(numPeaks).pl
+			sps_read.peakListsOrdered[:] = [pl]
+			outputs = {}
+			for numpyMode in modes:
+				sps_read.PeakTable.useNumPy = numpyMode
+				sps_read.PeakTable.cached = None
+				tableTime, output = timeCommand(sps_read.PeakTable.get)
+				times = []
+				for name, function, *args in commands:
+					seconds, output = min([timeCommand(function, *args) for i in range(repeat)],
+						key=lambda result: result[0])
+					if outputs.setdefault(name, output) != output:
+						err("The output of {} with NumPy differs!", name)
+					times.append(seconds)
+				print("{:>9} {:6} {:10.1f}".format(sps_read.int2str(numPeaks), 'yes' if numpyMode else 'no',
+					tableTime * 1000) + "".join(["{:16.1f}".format(t * 1000) for t in times]))
+	finally:
+		sps_read.peakListsOrdered[:] = lists
+		sps_read.PeakTable.useNumPy = useNumPy
+		sps_read.PeakTable.cached = None
+
+def benchServe(repeat):
+	# Compare running commands with sps_read.py, with sps_client.py (talking to a server
+	# started for the benchmark), and with requests sent from this process (i.e. without
+	# starting a Python interpreter for each command).
+
+	import sps_client
+
+	commands = (['sum'], ['json', 'dps'], ['near', '37.5,-118.5'], ['peak', 'SPS.4.7'])
+	tmpDir = tempfile.mkdtemp(prefix='sps_bench.')
+	socketPath = os.path.join(tmpDir, 'server.sock')
+	server = subprocess.Popen([sys.executable, 'sps_read.py', 'serve', '--socket', socketPath],
+		stderr=subprocess.DEVNULL)
+
+	def timeRuns(function):
+		times = []
+		for i in range(repeat):
+			startTime = time.perf_counter()
+			function()
+			times.append(time.perf_counter() - startTime)
+		return min(times)
+
+	def runScript(*args):
+		subprocess.run([sys.executable] + list(args), stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL, check=True)
+
+	try:
+		while not os.path.exists(socketPath):
+			if server.poll() is not None:
+				err("The server exited with status {}", server.returncode)
+			time.sleep(0.05)
+
+		print("{:20} {:>12} {:>12} {:>12} {:>8} {:>8}".format("Command", "sps_read", "sps_client",
+			"Request", "Client", "Request"))
+		for command in commands:
+			if command[0] == 'peak':
+				direct = None
+			else:
+				direct = timeRuns(lambda: runScript('sps_read.py', *command))
+			client = timeRuns(lambda: runScript('sps_client.py', '--socket', socketPath, *command))
+			request = timeRuns(lambda: sps_client.post(socketPath, '/run', {'args': command}))
+
+			speedups = ['-', '-'] if direct is None else ['{:.1f}x'.format(direct / t) for t in (client, request)]
+			print("{:20} {:>12} {:9.1f} ms {:9.2f} ms {:>8} {:>8}".format(' '.join(command),
+				'-' if direct is None else '{:9.1f} ms'.format(direct * 1000), client * 1000,
+				request * 1000, *speedups))
+
+		python = timeRuns(lambda: runScript('-c', 'pass'))
+		print("\nStarting Python takes {:.1f} ms (best of {}).".format(python * 1000, repeat))
+	finally:
+		server.terminate()
+		server.wait()
+		shutil.rmtree(tmpDir)
+
+def benchNear(sizes, numQueries=1000, numLinear=20, radius=5000):
+	readAllHTML()
+	rand = random.Random(1)
+	points = [(rand.uniform(33, 42), rand.uniform(-124, -114)) for i in range(numQueries)]
+
+	print("{:>9} {:>10} {:>12} {:>16} {:>12}".format("Peaks", "Build (ms)",
+		"Nearest (us)", "Within 5 km (us)", "Linear (us)"))
+
+	for numPeaks in sizes:
+		peaks = [peak for section in SyntheticList(numPeaks).pl.sections
+			for peak in section.peaks if peak.dataFrom is None]
+
+		startTime = time.perf_counter()
+		index = sps_read.PeakIndex(peaks)
+		buildTime = time.perf_counter() - startTime
+
+		startTime = time.perf_counter()
+		nearest = [index.nearest(lat, lng) for lat, lng in points]
+		nearestTime = (time.perf_counter() - startTime) / numQueries
+
+		startTime = time.perf_counter()
+		numNear = sum([len(index.near(lat, lng, radius)) for lat, lng in points])
+		nearTime = (time.perf_counter() - startTime) / numQueries
+
+		# Check the first few answers against a linear scan (using the same distance function).
+
+		coords = [(float(peak.latitude), float(peak.longitude)) for peak in peaks]
+		startTime = time.perf_counter()
+		for (lat, lng), result in zip(points[:numLinear], nearest):
+			d = min([index.distance(lat, lng, lat2, lng2) for lat2, lng2 in coords])
+			if d != result[0]:
+				err("The nearest peak to {},{} is {} m away, not {} m!", lat, lng, d, result[0])
+		linearTime = (time.perf_counter() - startTime) / numLinear
+
+		print("{:>9} {:10.1f} {:12.1f} {:16.1f} {:12.0f}   ({:.1f} peaks within 5 km)".format(
+			sps_read.int2str(len(peaks)), buildTime * 1000, nearestTime * 1e6, nearTime * 1e6,
+			linearTime * 1e6, numNear / numQueries))
+
+def benchIsolation(sizes, numLinear=20):
+	readAllHTML()
+
+	print("{:9} {:>9} {:>10} {:>14} {:>13} {:>19}".format("", "Peaks", "Build (ms)",
+		"Isolation (ms)", "Per peak (us)", "All pairs (s, est.)"))
+
+	rows = [('All lists', list(sps_read.allPeaksGenerator()))]
+	for numPeaks in sizes:
+		rows.append(('Synthetic', [peak for section in SyntheticList(numPeaks).pl.sections
+			for peak in section.peaks if peak.dataFrom is None]))
+
+	for name, peaks in rows:
+		startTime = time.perf_counter()
+		index = sps_read.PeakIndex(peaks)
+		buildTime = time.perf_counter() - startTime
+
+		startTime = time.perf_counter()
+		isolation = index.isolation()
+		isolationTime = time.perf_counter() - startTime
+
+		# Check a sample of the answers against a scan of all the peaks (using the
+		# same distance function), and estimate how long that would take for all pairs.
+
+		points = [(float(peak.latitude), float(peak.longitude), peak.getElevForStats()) for peak in peaks]
+		sample = points[::max(1, len(points) // numLinear)][:numLinear]
+		startTime = time.perf_counter()
+		for lat, lng, elev in sample:
+			d = min([index.distance(lat, lng, lat2, lng2)
+				for lat2, lng2, elev2 in points if elev2 > elev], default=None)
+			result = isolation[peaks[points.index((lat, lng, elev))]]
+			if d != (result and result[0]):
+				err("The nearest higher peak to {},{} is {} m away, not {}!", lat, lng, d, result)
+		linearTime = (time.perf_counter() - startTime) / len(sample) * len(peaks)
+
+		print("{:9} {:>9} {:10.1f} {:14.1f} {:13.1f} {:19.1f}".format(name, sps_read.int2str(len(peaks)),
+			buildTime * 1000, isolationTime * 1000, isolationTime * 1e6 / len(peaks), linearTime))
+
+def generatePeakFileLoJ(peakId, padding):
+	# A Lists of John peak page with the fields that PeakLoJ.parsePeakFile reads, after
+	# padding bytes of other markup (which HTMLParser has to get through, too). Every
+	# third peak gets a label that's skipped (logged to stderr), and every fifth peak a
+	# prominence that doesn't match (printed to stdout), to check that they're replayed.
+
+	elev = 8000 + peakId % 6000
+	saddle = elev - 300 - peakId % 2000
+	prom = elev - saddle + (1 if peakId % 5 == 0 else 0)
+	feet = lambda n: "{:,}'".format(n)
+
+	nav = '<div class="nav"><a href="/list/{0}">List {0}</a> <span>Item</span></div>\n'
+	lines = [
+		'<b>Peak {}</b> <b>CA</b>'.format(elev),
+		'Elevation: ' + feet(elev),
+		'Rise:' + feet(prom),
+		'Saddle:<a href="/qmap?lat=37.{0:05}&lon=-118.{0:05}&z=15">{1}</a>'.format(peakId % 100000, feet(saddle)),
+		'Coords:37.{0:05}N, 118.{0:05}W'.format(peakId % 100000),
+		'County:<a href="/county/12">Inyo</a>',
+		'Quad:<a href="/quad?q=123">Mount Morgan</a>',
+		'Line Parent:<a href="/peak/{}">Mount Tom</a>'.format(peakId + 1),
+		'Proximate Parent:<a href="/peak/{}">Mount Tom</a>'.format(peakId + 1),
+	]
+	if peakId % 3 == 0:
+		lines.append('Rank 2: 12')
+	lines.extend([
+		'Isolation:1.{:02} miles'.format(peakId % 100),
+		'Inyo National Forest',
+		'John Muir Wilderness',
+		'YDS Class: 2 <a href="/class?Id={}">Discussion</a>'.format(peakId),
+	])
+	return ''.join([nav.format(i) for i in range(padding // len(nav))]) + \
+		'<table><tr><td>' + '<br>'.join(lines) + '</td></tr></table>\n'
+
+def readPeakFiles(files, jobs):
+	# Read the peak files the way checkData does, with an empty cache that isn't saved.
+	# Return the time taken and what was printed.
+
+	import sps_create
+
+	sps_create.PeakFileCache.enabled = False
+	sps_create.PeakFileCache.cache = None
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+		startTime = time.perf_counter()
+		sps_create.PeakFileCache.get().prefetch(files, jobs)
+		for peakClass, peakId, fileName in files:
+			peak = peakClass()
+			peak.id = peakId
+			peak.fmtIdName = '{:5} {:24} {}'.format(peakId, 'Peak', peakClass.classId)
+			sps_create.PeakFileCache.get().read(peak, fileName, peak.parsePeakFile)
+		seconds = time.perf_counter() - startTime
+	return seconds, output.getvalue()
+
+def benchPeakFiles(sizes, padding=40000):
+	# Compare parsing synthetic peak files in this process (jobs=1) with parsing them
+	# in worker processes, and check that the output is the same.
+
+	import sps_create
+
+	jobsList = sorted({1, 2, 4, os.cpu_count() or 1})
+	cwd = os.getcwd()
+	tmpDir = tempfile.mkdtemp(prefix='sps_bench.')
+	try:
+		os.chdir(tmpDir)
+		log("{} CPU{}, {:,} bytes per peak file", os.cpu_count(), '' if os.cpu_count() == 1 else 's', padding)
+		print("{:>8}".format("Files") + "".join(["{:>16}".format("{} job{} (ms)".format(jobs,
+			'' if jobs == 1 else 's')) for jobs in jobsList]))
+
+		for numFiles in sizes:
+			files = []
+			for peakId in range(10001, 10001 + numFiles):
+				fileName = sps_create.PeakLoJ.getPeakFileName(str(peakId))
+				os.makedirs(os.path.dirname(fileName), exist_ok=True)
+				with open(fileName, 'w') as f:
+					f.write(generatePeakFileLoJ(peakId, padding))
+				files.append((sps_create.PeakLoJ, str(peakId), fileName))
+
+			results = [readPeakFiles(files, jobs) for jobs in jobsList]
+			serialSeconds, serialOutput = results[0]
+			for jobs, (seconds, output) in zip(jobsList, results):
+				if output != serialOutput:
+					err("The output with {} jobs doesn't match the output with 1 job!", jobs)
+
+			print("{:>8}".format(numFiles) + "".join(["{:>9.1f} {:>5.2f}x".format(seconds * 1000,
+				serialSeconds / seconds) for seconds, output in results]))
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(tmpDir)
+
+def generateTablePage(size, bigCell):
+	# A page like a Peakbagger peak page (an h1 heading followed by three tables of
+	# label/value rows) that's about size bytes long. With bigCell, most of the bytes
+	# are in the last cell of the third table. Otherwise, they're in a table after the
+	# three tables (like the ascents table), which TableParser doesn't need to read.
+
+	row = '<tr><td>Label {0}</td><td><a href="/peak.aspx?pid={0}">Value</a> <i>{0}</i><br/></td></tr>\n'
+	link = '<a href="/climber/ascent.aspx?aid={0}">Ascent {0}</a> <b>2001-01-01</b><br>\n'
+	padding = ''.join([link.format(i) for i in range(size // len(link.format(100000)))])
+	tables = ['<table>' + ''.join([row.format(i * 10 + j) for j in range(10)]) for i in range(3)]
+	if bigCell:
+		tables[2] += '<tr><td>Ascents</td><td>' + padding + '</td></tr>'
+		padding = ''
+	return ('<html><body><div><a href="/glossary">Glossary</a></div><h1>Peak</h1>\n' +
+		'</table>\n'.join(tables) + '</table>\n<table><tr><td>' + padding + '</td></tr></table></body></html>\n')
+
+def benchTableParser(sizes, repeat=5):
+	# Time TableParser on the largest saved peak files (if there are any) and on
+	# synthetic pages of the given sizes (in kilobytes).
+
+	import glob
+	import sps_create
+
+	pages = []
+	for peakClass, pattern in ((sps_create.PeakPb, 'pb'), (sps_create.PeakLoJ, 'loj')):
+		fileNames = glob.glob('data/peakfiles/{}/*/*.html'.format(pattern))
+		fileNames.sort(key=os.path.getsize, reverse=True)
+		for fileName in fileNames[:3]:
+			pages.append((fileName, fileName, peakClass is sps_create.PeakPb))
+
+	tmpDir = tempfile.mkdtemp(prefix='sps_bench.')
+	try:
+		for size in sizes:
+			for bigCell in (False, True):
+				fileName = os.path.join(tmpDir, '{}k{}.html'.format(size, '-cell' if bigCell else ''))
+				with open(fileName, 'w') as f:
+					f.write(generateTablePage(size * 1000, bigCell))
+				pages.append(('{:,} KB, {}'.format(size, 'big cell' if bigCell else 'trailing table'),
+					fileName, True))
+
+		print("{:40} {:>10} {:>10} {:>8}".format("Page", "Bytes", "ms", "MB/s"))
+		for name, fileName, isPb in pages:
+			if isPb:
+				parse = lambda: sps_create.TableParser(fileName, numTables=3, startTag="h1")
+			else:
+				parse = lambda: sps_create.TableParser(fileName)
+			numBytes = os.path.getsize(fileName)
+			seconds = bestTime(parse, repeat)
+			print("{:40} {:>10,} {:10.2f} {:8.1f}".format(name, numBytes,
+				seconds * 1000, numBytes / seconds / 1e6))
+	finally:
+		shutil.rmtree(tmpDir)
+
+def main():
+	args = sys.argv[1:]
+	if not args:
+		err("Please specify a benchmark: memory, access, rows, json, alljson, generate, scale, near, isolation,"
+			" stats, serve, peakfiles, or tableparser")
+
+	benchmark = args.pop(0)
+	if benchmark == 'memory' and not args:
+		benchMemory()
+	elif benchmark == 'alljson' and not args:
+		benchAllJSON()
+	elif benchmark in ('access', 'rows', 'json', 'serve') and len(args) <= 1:
+		try:
+			repeat = int(args[0]) if args else 20
+		except ValueError:
+			repeat = 0
+		if repeat < 1:
+			err("Please specify a positive repeat count.")
+		if benchmark == 'access':
+			benchAccess(repeat)
+		elif benchmark == 'serve':
+			benchServe(repeat)
+		elif benchmark == 'json':
+			benchJSON(repeat)
+		else:
+			benchRows(repeat)
+	elif benchmark == 'generate' and len(args) == 2:
+		try:
+			numPeaks = int(args[0])
+		except ValueError:
+			numPeaks = 0
+		if numPeaks < 1:
+			err("Please specify a positive number of peaks.")
+		generate(numPeaks, args[1])
+	elif benchmark in ('scale', 'near', 'isolation', 'stats', 'peakfiles', 'tableparser'):
+		try:
+			sizes = [int(arg) for arg in args] or {'peakfiles': [100, 400], 'tableparser': [100, 1000, 4000]}.get(
+				benchmark, [1000, 10000, 100000])
+		except ValueError:
+			sizes = [0]
+		if min(sizes) < 1:
+			err("Please specify positive numbers of peaks.")
+		if benchmark == 'scale':
+			benchScale(sorted(sizes))
+		elif benchmark == 'near':
+			benchNear(sorted(sizes))
+		elif benchmark == 'stats':
+			benchStats(sorted(sizes))
+		elif benchmark == 'peakfiles':
+			benchPeakFiles(sorted(sizes))
+		elif benchmark == 'tableparser':
+			benchTableParser(sorted(sizes))
+		else:
+			benchIsolation(sorted(sizes))
+	else:
+		err("Please specify 'memory', 'access [repeat]', 'rows [repeat]', 'json [repeat]', 'alljson',"
+			" 'generate numPeaks fileName', 'scale [numPeaks ...]', 'near [numPeaks ...]',"
+			" 'isolation [numPeaks ...]', 'stats [numPeaks ...]', 'serve [repeat]', 'peakfiles [numFiles ...]',"
+			" or 'tableparser [kilobytes ...]'.")
+
+if __name__ == '__main__':
+	main()
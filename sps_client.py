@@ -0,0 +1,83 @@
+#
+# sps_client - Run an sps_read command on a running "sps_read.py serve" server
+#              Usage: python3 sps_client.py [--port N | --socket path] command [args ...]
+#
+# The output and exit status are the same as for "python3 sps_read.py command [args ...]".
+# If there's no server, the command is run by sps_read.py instead. The request is
+# written directly to a socket (rather than with http.client, which takes longer to
+# import than the rest of the client takes to run), so that the client starts quickly.
+#
+import json
+import os
+import socket
+import sys
+
+def post(address, path, value):
+	# Send an HTTP/1.0 POST request with a JSON body, and return the status and the
+	# decoded JSON response. The server closes the connection after the response.
+
+	body = json.dumps(value).encode()
+	request = ('POST {} HTTP/1.0\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+		'Content-Length: {}\r\n\r\n').format(path, len(body)).encode() + body
+
+	family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+	with socket.socket(family, socket.SOCK_STREAM) as sock:
+		sock.connect(address)
+		sock.sendall(request)
+		chunks = []
+		while True:
+			chunk = sock.recv(65536)
+			if not chunk:
+				break
+			chunks.append(chunk)
+
+	try:
+		header, body = b''.join(chunks).split(b'\r\n\r\n', 1)
+		status = int(header.split(b' ', 2)[1])
+		result = json.loads(body)
+		if not isinstance(result, dict):
+			raise ValueError(result)
+	except (ValueError, IndexError):
+		notServer(address)
+	return status, result
+
+def notServer(address):
+	sys.exit("The response from {} isn't from an sps_read.py server.".format(
+		address if isinstance(address, str) else '{}:{}'.format(*address)))
+
+def runLocally(args):
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sps_read.py')
+	os.execv(sys.executable, [sys.executable, script] + args)
+
+def main():
+	args = sys.argv[1:]
+	address = ('127.0.0.1', 8641)
+
+	while args and args[0] in ('--port', '--socket'):
+		option = args.pop(0)
+		if not args or option == '--port' and not args[0].isdigit():
+			sys.exit("Please specify a {} after {}.".format(option[2:], option))
+		if option == '--port':
+			address = ('127.0.0.1', int(args.pop(0)))
+		else:
+			address = args.pop(0)
+
+	try:
+		status, result = post(address, '/run', {'args': args})
+	except (ConnectionRefusedError, FileNotFoundError):
+		print("No server is running, so running sps_read.py instead", file=sys.stderr)
+		runLocally(args)
+	except ConnectionError:
+		notServer(address)
+
+	if status != 200:
+		sys.exit(result.get('error', 'HTTP status {}'.format(status)))
+	if not all(key in result for key in ('stdout', 'stderr', 'status')):
+		notServer(address)
+
+	sys.stdout.write(result['stdout'])
+	sys.stderr.write(result['stderr'])
+	sys.exit(result['status'])
+
+if __name__ == '__main__':
+	main()
@@ -1,9 +1,10 @@
+import contextlib
+import hashlib
 import os
 import os.path
+import pickle
 import random
 import re
-import stat
-import subprocess
 import sys
 import time
 from html.parser import HTMLParser
@@ -22,6 +23,26 @@ def int2str(n):
 	return str(n) if n < 1000 else '{},{:03}'.format(*divmod(n, 1000))
 
 class TableParser(HTMLParser):
+	# Read the cells of the first numTables top-level tables after startTag. Each table is
+	# a list of rows, and each row a list of the cells' HTML (with only the href attributes
+	# of links). The HTML of the current cell is collected as a list of strings and joined
+	# when the cell ends, and parsing stops as soon as the last table has been read.
+
+	readSize = 65536
+
+	class Done(Exception):
+		pass
+
+	def endCol(self):
+		if self.currentCol is not None:
+			self.currentRow.append("".join(self.currentCol))
+			self.currentCol = None
+
+	def endRow(self):
+		self.endCol()
+		if self.currentRow:
+			self.tableRows.append(self.currentRow)
+
 	def handle_starttag(self, tag, attributes):
 		if self.tableDepth == 0:
 			if tag == self.startTag and (
@@ -34,79 +55,62 @@ class TableParser(HTMLParser):
 				self.tableRows = []
 				self.currentRow = None
 				self.currentCol = None
-		else:
+			return
+
+		if self.tableDepth == 1:
 			if tag == "td":
-				if self.tableDepth == 1:
-					if self.currentCol is not None:
-						self.currentRow.append(self.currentCol)
-					self.currentCol = ""
-					return
-			elif tag == "tr":
-				if self.tableDepth == 1:
-					if self.currentCol is not None:
-						self.currentRow.append(self.currentCol)
-						self.currentCol = None
-					if self.currentRow:
-						self.tableRows.append(self.currentRow)
-					self.currentRow = []
-					return
-			elif tag == "table":
-				self.tableDepth += 1
-
-			if self.currentCol is not None:
-				if tag == "a":
-					attributes = [(k, v) for k, v in attributes
-						if k == "href" and "/glossary" not in v]
-				else:
-					attributes = []
-				self.currentCol += "<{}{}>".format(tag,
-					"".join([" {}=\"{}\"".format(k, v) for k, v in attributes]))
+				self.endCol()
+				self.currentCol = []
+				return
+			if tag == "tr":
+				self.endRow()
+				self.currentRow = []
+				return
+		if tag == "table":
+			self.tableDepth += 1
+
+		if self.currentCol is not None:
+			if tag == "a":
+				self.currentCol.append("<a")
+				for k, v in attributes:
+					if k == "href" and "/glossary" not in v:
+						self.currentCol.append(" href=\"{}\"".format(v))
+				self.currentCol.append(">")
+			else:
+				self.currentCol.append("<" + tag + ">")
 
 	def handle_endtag(self, tag):
 		if self.tableDepth == 0:
 			return
-		if tag == "td":
-			if self.tableDepth == 1:
-				if self.currentCol is not None:
-					self.currentRow.append(self.currentCol)
-					self.currentCol = None
+		if self.tableDepth == 1:
+			if tag == "td":
+				self.endCol()
 				return
-		elif tag == "tr":
-			if self.tableDepth == 1:
-				if self.currentCol is not None:
-					self.currentRow.append(self.currentCol)
-					self.currentCol = None
-				if self.currentRow:
-					self.tableRows.append(self.currentRow)
+			if tag == "tr":
+				self.endRow()
 				self.currentRow = None
 				return
-		elif tag == "table":
+		if tag == "table":
 			self.tableDepth -= 1
 			if self.tableDepth == 0:
-				if self.currentCol is not None:
-					self.currentRow.append(self.currentCol)
-					self.currentCol = None
-				if self.currentRow:
-					self.tableRows.append(self.currentRow)
+				self.endRow()
 				self.currentRow = None
 				self.tables.append(self.tableRows)
 				self.numTables -= 1
+				if self.numTables == 0:
+					raise self.Done()
 				return
 
 		if self.currentCol is not None:
-			self.currentCol += "</{}>\n".format(tag)
+			self.currentCol.append("</" + tag + ">\n")
 
 	def handle_startendtag(self, tag, attributes):
-		if self.tableDepth > 0:
-			if self.currentCol is not None:
-				attributes = []
-				self.currentCol += "<{}{}/>".format(tag,
-					"".join([" {}=\"{}\"".format(k, v) for k, v in attributes]))
+		if self.tableDepth > 0 and self.currentCol is not None:
+			self.currentCol.append("<" + tag + "/>")
 
 	def handle_data(self, data):
-		if self.tableDepth > 0:
-			if self.currentCol is not None:
-				self.currentCol += data
+		if self.tableDepth > 0 and self.currentCol is not None:
+			self.currentCol.append(data)
 
 	def handle_entityref(self, name):
 		if name == 'ntilde':
@@ -122,10 +126,13 @@ class TableParser(HTMLParser):
 		self.tables = []
 
 		with open(fileName) as fileObj:
-			while self.numTables > 0:
-				bytes = fileObj.read(1000)
-				if not bytes: break
-				self.feed(bytes)
+			try:
+				while True:
+					data = fileObj.read(self.readSize)
+					if not data: break
+					self.feed(data)
+			except self.Done:
+				pass
 
 class TableReader(object):
 	def err(self, message, *args, **kwargs):
@@ -547,52 +554,14 @@ def formatTime(timestamp):
 	ymdhms = time.localtime(timestamp)[0:6]
 	return "{}-{:02}-{:02} {:02}:{:02}:{:02}".format(*ymdhms)
 
-def zipLongest(*iterables):
-	iterators = [iter(it) for it in iterables]
-	while True:
-		values = []
-		active = []
-		for it in iterators:
-			try:
-				value = next(it)
-			except StopIteration:
-				continue
-			values.append(value)
-			active.append(it)
-		if not active:
-			break
-		yield tuple(values)
-		iterators = active
-
-def loadURLs(loadLists):
+def loadURLs(loadLists, **fetchOptions):
+	import fetch
+
 	random.seed()
 	for loadList in loadLists:
 		random.shuffle(loadList)
 
-	listLengths = "/".join([str(len(loadList)) for loadList in loadLists])
-
-	mode444 = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
-	mode644 = stat.S_IWUSR | mode444
-
-	for i, loadList in enumerate(zipLongest(*loadLists)):
-		if i != 0:
-			sleepTime = int(random.random() * 7 + 7.5)
-			log("{}/{} Sleeping for {} seconds", i, listLengths, sleepTime)
-			time.sleep(sleepTime)
-
-		for url, filename in loadList:
-			if os.path.exists(filename):
-				os.chmod(filename, mode644)
-
-			command = ["/usr/local/opt/curl/bin/curl", "-o", filename, url]
-			print(*command)
-
-			rc = subprocess.call(command)
-			if rc != 0:
-				print("Exit code", rc)
-				return
-
-			os.chmod(filename, mode444)
+	fetch.Fetcher(**fetchOptions).fetch([item for loadList in loadLists for item in loadList])
 
 def getLoadLists(pl):
 	loadLists = []
@@ -607,9 +576,22 @@ def getLoadLists(pl):
 				loadList.append((peak.getPeakURL(peak.id), filename))
 	return loadLists
 
-def getLoadListsFromTable(pl):
+def getFetchTime(metadata, filename):
+	info = metadata.get(filename)
+	if info is None:
+		return os.stat(filename).st_mtime, "Last mod"
+	return info['fetchTime'], "Last fetch"
+
+def getLoadListsFromTable(pl, maxAge=180):
+	# A page that's been downloaded before is downloaded again if it was last fetched
+	# (or, if there's no metadata for it, last modified) more than maxAge days ago.
+	# Since the fetcher then asks for it only if it was modified, maxAge can be short.
+
+	import fetch
+
+	metadata = fetch.PageMetadata()
 	loadLists = []
-	cutoffTime = time.time() - 180 * 24 * 60 * 60
+	cutoffTime = time.time() - maxAge * 24 * 60 * 60
 	cutoffTimeStr = formatTime(cutoffTime)
 
 	for peakClass in (PeakLoJ, PeakPb):
@@ -623,19 +605,179 @@ def getLoadListsFromTable(pl):
 					continue
 				filename = peakClass.getPeakFileName(peakId)
 				if os.path.exists(filename):
-					modTime = os.stat(filename).st_mtime
+					modTime, label = getFetchTime(metadata, filename)
 					if modTime > cutoffTime:
 						continue
-					out("{:5} {:24} {} Last mod ({}) > 180 days ago ({})",
+					out("{:5} {:24} {} {} ({}) > {} days ago ({})",
 						peak.id,
 						peak.name.replace('&quot;', '"'),
 						peakClass.classId,
+						label,
 						formatTime(modTime),
+						maxAge,
 						cutoffTimeStr)
 
 				loadList.append((peakClass.getPeakURL(peakId), filename))
 	return loadLists
 
+class OutputRecorder(object):
+	# A file-like object that records what's written to it and, unless file is None,
+	# writes it to file, too
+
+	def __init__(self, file, isStderr, chunks):
+		self.file = file
+		self.isStderr = isStderr
+		self.chunks = chunks
+
+	def write(self, text):
+		self.chunks.append((self.isStderr, text))
+		if self.file is not None:
+			self.file.write(text)
+		return len(text)
+
+	def flush(self):
+		if self.file is not None:
+			self.file.flush()
+
+def fileStat(fileName):
+	stat = os.stat(fileName)
+	return (stat.st_size, stat.st_mtime_ns)
+
+def fileDigest(fileName):
+	with open(fileName, 'rb') as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+def parsePeakFile(className, peakId, fileName):
+	# This is run in a worker process by PeakFileCache.prefetch. It returns the cache
+	# entry, or None if parsing failed (so that it fails again, with the same messages
+	# in the same order, when the peak file is read in the parent process).
+
+	peak = globals()[className]()
+	peak.id = peakId
+	peak.fmtIdName = PeakFileCache.marker
+	try:
+		return PeakFileCache.parse(peak, fileName, peak.parsePeakFile, echo=False)
+	except SystemExit:
+		return None
+
+class PeakFileCache(object):
+	# The attributes parsed from the Peakbagger and Lists of John peak files (up to, but
+	# not including, looking up their land management areas), and what was printed while
+	# parsing them, so that a peak file is parsed only when it changes (or when this
+	# source file changes). An entry is reused if the size and mtime of the peak file are
+	# unchanged or, if they did change, its SHA-256 digest is unchanged. When the output
+	# is replayed, the peak's fmtIdName (which depends on the list) is put back in.
+	# If enabled is false, the cache is neither read from nor written to its file.
+
+	enabled = True
+	fileName = 'data/cache/peakfiles.pickle'
+	version = 1
+	marker = '\0'
+	cache = None
+
+	def __init__(self):
+		with open(__file__, 'rb') as f:
+			self.source = hashlib.sha256(f.read()).hexdigest()
+		self.entries = {}
+		self.modified = False
+		if not self.enabled:
+			return
+
+		try:
+			with open(self.fileName, 'rb') as f:
+				cache = pickle.load(f)
+			if cache.get('version') == self.version and cache.get('source') == self.source:
+				self.entries = cache['entries']
+		except FileNotFoundError:
+			pass
+		except Exception as e:
+			log("Ignoring corrupt peak file cache {}: {}", self.fileName, e)
+
+	@classmethod
+	def get(self):
+		if self.cache is None:
+			self.cache = PeakFileCache()
+		return self.cache
+
+	@classmethod
+	def saveIfModified(self):
+		if self.cache is not None:
+			self.cache.save()
+
+	def save(self):
+		if not self.enabled or not self.modified:
+			return
+
+		cache = {'version': self.version, 'source': self.source, 'entries': self.entries}
+		os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+		tmpName = self.fileName + '.tmp'
+		with open(tmpName, 'wb') as f:
+			pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmpName, self.fileName)
+		self.modified = False
+
+	def getEntry(self, fileName, stat):
+		entry = self.entries.get(fileName)
+		if entry is None:
+			return None
+		if entry['stat'] != stat:
+			if fileDigest(fileName) != entry['digest']:
+				return None
+			entry['stat'] = stat
+			self.modified = True
+		return entry
+
+	@classmethod
+	def parse(self, peak, fileName, parseFunction, echo=True):
+		stat = fileStat(fileName)
+		digest = fileDigest(fileName)
+
+		chunks = []
+		with contextlib.redirect_stdout(OutputRecorder(sys.stdout if echo else None, False, chunks)), \
+			contextlib.redirect_stderr(OutputRecorder(sys.stderr if echo else None, True, chunks)):
+			parseFunction(fileName)
+
+		state = {name: value for name, value in vars(peak).items() if name not in ('id', 'fmtIdName')}
+		chunks = [(isStderr, text.replace(peak.fmtIdName, self.marker)) for isStderr, text in chunks]
+		return {
+			'stat': stat,
+			'digest': digest,
+			'data': pickle.dumps((state, chunks), pickle.HIGHEST_PROTOCOL),
+		}
+
+	def read(self, peak, fileName, parseFunction):
+		entry = self.getEntry(fileName, fileStat(fileName))
+		if entry is None:
+			self.entries[fileName] = self.parse(peak, fileName, parseFunction)
+			self.modified = True
+			return
+
+		state, chunks = pickle.loads(entry['data'])
+		vars(peak).update(state)
+		for isStderr, text in chunks:
+			(sys.stderr if isStderr else sys.stdout).write(text.replace(self.marker, peak.fmtIdName))
+
+	def prefetch(self, files, jobs=None):
+		# Parse the given peak files (a list of (peak class, peak ID, file name)) that
+		# aren't in the cache in jobs worker processes. The messages are printed later,
+		# in the usual order, when the peak files are read.
+
+		pending = {fileName: (peakClass.__name__, peakId, fileName) for peakClass, peakId, fileName in files
+			if self.getEntry(fileName, fileStat(fileName)) is None}
+		pending = list(pending.values())
+		if jobs is None or jobs == 1 or len(pending) < 2:
+			return
+
+		import concurrent.futures
+
+		with concurrent.futures.ProcessPoolExecutor(min(jobs, len(pending))) as executor:
+			entries = executor.map(parsePeakFile, *zip(*pending),
+				chunksize=max(1, len(pending) // (jobs * 4)))
+			for (className, peakId, fileName), entry in zip(pending, entries):
+				if entry is not None:
+					self.entries[fileName] = entry
+					self.modified = True
+
 class TablePeak(object):
 	@classmethod
 	def getListFileName(self, peakListId, maxProm=False):
@@ -1363,6 +1505,10 @@ class PeakPb(TablePeak):
 			self.state.append(code)
 
 	def readPeakFile(self, fileName):
+		PeakFileCache.get().read(self, fileName, self.parsePeakFile)
+		LandMgmtAreaPb.addAll(self)
+
+	def parsePeakFile(self, fileName):
 		tables = TableParser(fileName, numTables=3, startTag="h1").tables
 		info = dict(row for row in tables[1] if len(row) == 2)
 
@@ -1383,7 +1529,6 @@ class PeakPb(TablePeak):
 		self.readLandManagement(info.get("Ownership"))
 
 		self.postProcess2(maxPeak)
-		LandMgmtAreaPb.addAll(self)
 
 	def compare(self, other):
 		for attr in ("id", "name", "elevation", "rangeId", "rangeName"):
@@ -1949,6 +2094,10 @@ class PeakLoJ(TablePeak):
 			self.counties.append(m.group(1))
 
 	def readPeakFile(self, fileName):
+		PeakFileCache.get().read(self, fileName, self.parsePeakFile)
+		LandMgmtAreaLoJ.addAll(self)
+
+	def parsePeakFile(self, fileName):
 		lines = (TableParser(fileName).tables[0][0][0] # First table, first row, first column
 				.replace("\r", "")
 				.replace("\n", "")
@@ -2025,7 +2174,6 @@ class PeakLoJ(TablePeak):
 				break
 
 		self.postProcess()
-		LandMgmtAreaLoJ.addAll(self)
 
 	def compare(self, other):
 		attrs = [
@@ -2559,6 +2707,7 @@ def checkProminence(pl, setProm=False):
 				if setProm:
 					out("Setting to {} [LoJ={}, Pb={}]", newProm, promLoJ, promPb)
 					peak.prominences = [newProm]
+					pl.dirtyPeaks.add(peak)
 				else:
 					out("Matches {}Pb and avgPb == LoJ", promType)
 
@@ -2586,12 +2735,26 @@ def checkThirteeners(pl, setVR=False):
 				if colVR is None:
 					if setVR:
 						peak.column12 = vr
+						pl.dirtyPeaks.add(peak)
 				else:
 					if vr.rank != colVR.rank or vr.linkName != colVR.name:
 						out("{} VR rank/link {}/{} doesn't match {}/{}",
 							peak.fmtIdName, colVR.rank, colVR.name, vr.rank, vr.linkName)
 
-def checkData(pl, setProm=False, setVR=False):
+def getPeakFiles(pl):
+	files = []
+	for peakClass in (PeakLoJ, PeakPb):
+		for section in pl.sections:
+			for peak in section.peaks:
+				peakId = getattr(peak, peakClass.classAttrId, None)
+				if peakId is None or peakId[0] == "-":
+					continue
+				fileName = peakClass.getPeakFileName(peakId)
+				if os.path.exists(fileName):
+					files.append((peakClass, peakId, fileName))
+	return files
+
+def checkData(pl, setProm=False, setVR=False, jobs=None):
 	verbose = pl.id not in ('HPS', 'LPC')
 
 	peakClasses = [PeakLoJ, PeakPb]
@@ -2600,6 +2763,9 @@ def checkData(pl, setProm=False, setVR=False):
 
 	peakMap = MatchByName(pl)
 
+	LandMgmtAreaLoJ.areaLookup.clear()
+	LandMgmtAreaPb.areaLookup.clear()
+
 	for peakClass in peakClasses:
 		printTitle("Getting Peaks - " + peakClass.classTitle)
 		verbose = verbose and peakClass is not PeakVR
@@ -2612,6 +2778,8 @@ def checkData(pl, setProm=False, setVR=False):
 				out("Cannot map '{}' ({})", peak.name, peak.elevation)
 		out("Mapped {}/{} peaks", numMapped, len(peaks))
 
+	PeakFileCache.get().prefetch(getPeakFiles(pl), jobs)
+
 	for peakClass in (PeakLoJ, PeakPb):
 		printTitle("Reading Peak Files - " + peakClass.classTitle)
 		haveList = pl.id in peakClass.numPeaks
@@ -2682,11 +2850,23 @@ def checkData(pl, setProm=False, setVR=False):
 	if PeakVR in peakClasses:
 		checkThirteeners(pl, setVR)
 
-def loadPeakFiles(pl):
-	loadURLs(getLoadListsFromTable(pl))
-#	loadURLs(getLoadLists(pl))
+	PeakFileCache.saveIfModified()
+
+def loadPeakFiles(pl, fetchOptions):
+	fetchOptions = dict(fetchOptions)
+	maxAge = fetchOptions.pop('maxAge', 180)
+	loadURLs(getLoadListsFromTable(pl, maxAge), **fetchOptions)
+#	loadURLs(getLoadLists(pl), **fetchOptions)
 
-def loadPeakListFiles(pl):
+def loadPeakListFiles(pl, fetchOptions):
+	# An existing list file is downloaded again only if --max-age was specified
+	# and it was last fetched more than that many days ago.
+
+	import fetch
+
+	fetchOptions = dict(fetchOptions)
+	maxAge = fetchOptions.pop('maxAge', None)
+	metadata = fetch.PageMetadata()
 	loadList_LoJ = []
 	loadList_Pb = []
 
@@ -2713,7 +2893,8 @@ def loadPeakListFiles(pl):
 	}
 
 	def add(loadList, url, filename):
-		if os.path.exists(filename):
+		if os.path.exists(filename) and (maxAge is None or
+			getFetchTime(metadata, filename)[0] > time.time() - maxAge * 24 * 60 * 60):
 			print(filename, 'already exists')
 		else:
 			loadList.append((url, filename))
@@ -2733,7 +2914,7 @@ def loadPeakListFiles(pl):
 	if loadList_LoJ: loadLists.append(loadList_LoJ)
 	if loadList_Pb:  loadLists.append(loadList_Pb)
 	if loadLists:
-		loadURLs(loadLists)
+		loadURLs(loadLists, **fetchOptions)
 
 PeakAttributes = {
 	"GBP": {
@@ -2868,13 +3049,18 @@ def printPeaks(pl):
 				peak.listsOfJohnPeak.counties[0],
 				peak.peakbaggerPeak.rangeList[-1][1])
 
-def createList(pl, peakLists, peakClass, sectionClass, setLandManagement, verbose=False):
+def createList(pl, peakLists, peakClass, sectionClass, setLandManagement, verbose=False, jobs=None):
 	sections = readListFile(pl.id)
 	peakAttributes = PeakAttributes.get(pl.id, {})
 
 	mapPb = {p.id: p for p in PeakPb.getPeaks(pl.id)}
 	mapLoJ = {p.id: p for p in PeakLoJ.getPeaks(pl.id)}
 
+	# Most of the peak files read by setPeak are those of the peaks in the lists.
+	PeakFileCache.get().prefetch([(peakClass2, peakId, peakClass2.getPeakFileName(peakId))
+		for peakClass2, idMap in ((PeakPb, mapPb), (PeakLoJ, mapLoJ)) for peakId in idMap
+		if os.path.exists(peakClass2.getPeakFileName(peakId))], jobs)
+
 	bbIdMap = createBBMap(peakLists)
 	bbNameMap = PeakBB.getPeaks(pl.id)
 
@@ -2985,3 +3171,5 @@ def createList(pl, peakLists, peakClass, sectionClass, setLandManagement, verbos
 		log("Pb peak {} ({}) not used!", peak.id, peak.name)
 	for peak in mapLoJ.values():
 		log("LoJ peak {} ({}) not used!", peak.id, peak.name)
+
+	PeakFileCache.saveIfModified()
@@ -0,0 +1,478 @@
+#
+# sps_db - Export the peak lists (as parsed by sps_read) to an SQLite database and query it
+#
+# The database is updated by "sps_read.py db" (and before each query). A peak list's
+# rows are rewritten only if one of the HTML files it depends on (the list itself and
+# the lists it's linked to via data-from and data-also) has changed. The land areas,
+# topos, and data sheets are rewritten if any HTML file has changed, and the whole
+# database is rebuilt if the schema or the source code of sps_read or sps_db changes.
+#
+# Every row of the peaks table is a peak in a list, keyed by its list ID (e.g. SPS.4.7).
+# The elevations, prominences, land areas, and climbs of a data-from peak are the same
+# as those of the peak it refers to, so they're only stored for the latter. Use
+# coalesce(dataFrom, key) to join a peak with them.
+#
+import os
+import sqlite3
+import sys
+import time
+
+# The sps_read module (which is __main__ when this is used by "sps_read.py db"),
+# set by dbCommand
+sps_read = None
+
+def log(message, *args, **kwargs):
+	print(message.format(*args, **kwargs), file=sys.stderr)
+
+def err(*args, **kwargs):
+	log(*args, **kwargs)
+	sys.exit()
+
+schema = '''
+CREATE TABLE meta (
+	key TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+CREATE TABLE lists (
+	id TEXT PRIMARY KEY,
+	name TEXT NOT NULL,
+	sortkey INTEGER NOT NULL,
+	inputs TEXT NOT NULL,
+	digest TEXT NOT NULL
+);
+CREATE TABLE peaks (
+	key TEXT PRIMARY KEY,
+	list TEXT NOT NULL REFERENCES lists(id),
+	id TEXT NOT NULL,
+	section INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	otherName TEXT,
+	latitude REAL NOT NULL,
+	longitude REAL NOT NULL,
+	elevation INTEGER NOT NULL,
+	prominence INTEGER NOT NULL,
+	grade TEXT,
+	minClass INTEGER,
+	maxClass INTEGER,
+	country TEXT NOT NULL,
+	state TEXT NOT NULL,
+	climbed INTEGER NOT NULL,
+	emblem INTEGER NOT NULL,
+	mtneer INTEGER NOT NULL,
+	delisted INTEGER NOT NULL,
+	suspended INTEGER NOT NULL,
+	dataFrom TEXT,
+	bobBurdId TEXT,
+	listsOfJohnId TEXT,
+	peakbaggerId TEXT,
+	summitpostId TEXT,
+	wikipedia TEXT
+);
+CREATE INDEX peaksByList ON peaks (list);
+CREATE INDEX peaksByElevation ON peaks (elevation);
+CREATE INDEX peaksByProminence ON peaks (prominence);
+CREATE INDEX peaksByName ON peaks (name);
+CREATE INDEX peaksByDataFrom ON peaks (dataFrom);
+CREATE TABLE elevations (
+	peak TEXT NOT NULL,
+	seq INTEGER NOT NULL,
+	feet INTEGER NOT NULL,
+	meters REAL,
+	isRange INTEGER NOT NULL,
+	topo TEXT,
+	dataSheet TEXT,
+	PRIMARY KEY (peak, seq)
+);
+CREATE INDEX elevationsByTopo ON elevations (topo);
+CREATE INDEX elevationsByDataSheet ON elevations (dataSheet);
+CREATE TABLE prominences (
+	peak TEXT NOT NULL,
+	seq INTEGER NOT NULL,
+	feet INTEGER NOT NULL,
+	source TEXT,
+	PRIMARY KEY (peak, seq)
+);
+CREATE TABLE peakLand (
+	peak TEXT NOT NULL,
+	seq INTEGER NOT NULL,
+	area TEXT NOT NULL,
+	PRIMARY KEY (peak, seq)
+);
+CREATE INDEX peakLandByArea ON peakLand (area);
+CREATE TABLE climbs (
+	peak TEXT NOT NULL,
+	seq INTEGER NOT NULL,
+	date TEXT NOT NULL,
+	photos TEXT,
+	climbedWith TEXT NOT NULL,
+	PRIMARY KEY (peak, seq)
+);
+CREATE INDEX climbsByDate ON climbs (date);
+CREATE TABLE landAreas (
+	name TEXT PRIMARY KEY,
+	landClass TEXT NOT NULL,
+	link TEXT,
+	highPoint TEXT
+);
+CREATE TABLE topos (
+	id TEXT PRIMARY KEY,
+	name TEXT NOT NULL,
+	state TEXT NOT NULL,
+	series TEXT NOT NULL,
+	scale TEXT NOT NULL,
+	year TEXT NOT NULL,
+	vdatum TEXT,
+	contourInterval INTEGER
+);
+CREATE INDEX toposByName ON topos (name);
+CREATE TABLE dataSheets (
+	id TEXT PRIMARY KEY,
+	name TEXT NOT NULL,
+	vdatum TEXT NOT NULL,
+	peak TEXT NOT NULL
+);
+'''
+
+peakTables = ('elevations', 'prominences', 'peakLand', 'climbs')
+globalTables = ('landAreas', 'topos', 'dataSheets')
+
+def isoDate(date):
+	month, day, year = map(int, date.split('/'))
+	return '{}-{:02}-{:02}'.format(year, month, day)
+
+def parseGrade(grade):
+	# E.g. '2s3' is class 2 or 3 (shown as 2-3), and '2+' is class 2 (plus some 3).
+	if grade is None:
+		return None, None
+	classes = [int(c) for c in grade if c.isdigit()]
+	return classes[0], classes[-1]
+
+def getLinkedLists(pl):
+	lists = [pl]
+	for pl in lists:
+		for listId in sorted(sps_read.getLinkedListIds(pl)):
+			linked = sps_read.peakLists.get(listId)
+			if linked is not None and linked not in lists:
+				lists.append(linked)
+	return lists
+
+class PeakDB(object):
+	fileName = 'data/cache/peaks.db'
+	version = 1
+
+	def __init__(self, fileName=None):
+		if fileName is not None:
+			self.fileName = fileName
+		self.source = ' '.join([sps_read.fileDigest(sps_read.__file__), sps_read.fileDigest(__file__)])
+		self.fileDigests = {}
+
+		os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+		self.db = sqlite3.connect(self.fileName)
+
+	def close(self):
+		self.db.close()
+
+	def digest(self, fileNames):
+		digests = []
+		for fileName in fileNames:
+			digest = self.fileDigests.get(fileName)
+			if digest is None:
+				try:
+					digest = sps_read.fileDigest(fileName)
+				except FileNotFoundError:
+					digest = '-'
+				self.fileDigests[fileName] = digest
+			digests.append(digest)
+		return ' '.join(digests)
+
+	def getMeta(self, key):
+		row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+		return None if row is None else row[0]
+
+	def setMeta(self, key, value):
+		self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+	def hasSchema(self):
+		try:
+			return self.getMeta('version') == str(self.version) and self.getMeta('source') == self.source
+		except sqlite3.DatabaseError:
+			return False
+
+	def isCurrent(self):
+		if not self.hasSchema():
+			return False
+
+		lists = self.db.execute('SELECT id, inputs, digest FROM lists').fetchall()
+		if sorted([listId for listId, inputs, digest in lists]) != sorted(
+			[pl.id for pl in sps_read.peakListsOrdered]):
+			return False
+
+		return all(self.digest(inputs.split()) == digest for listId, inputs, digest in lists)
+
+	def recreate(self):
+		tables = [name for name, in self.db.execute(
+			"SELECT name FROM sqlite_master WHERE type = 'table'")]
+		for name in tables:
+			self.db.execute('DROP TABLE {}'.format(name))
+		self.db.executescript(schema)
+		self.setMeta('version', str(self.version))
+		self.setMeta('source', self.source)
+
+	def update(self, rebuild=False):
+		# Return the number of peak lists that were written, or None if the
+		# database was already up to date.
+
+		if not rebuild and self.isCurrent():
+			return None
+
+		sps_read.readAllHTML()
+
+		with self.db:
+			if rebuild or not self.hasSchema():
+				self.recreate()
+
+			stored = dict(self.db.execute('SELECT id, digest FROM lists'))
+			numLists = 0
+			for pl in sps_read.peakListsOrdered:
+				inputs = [linked.htmlFilename for linked in getLinkedLists(pl)]
+				digest = self.digest(inputs)
+				if stored.pop(pl.id, None) == digest:
+					continue
+				self.deleteList(pl.id)
+				self.insertList(pl, inputs, digest)
+				numLists += 1
+			for listId in stored:
+				self.deleteList(listId)
+
+			self.writeGlobalTables()
+
+		return numLists
+
+	def deleteList(self, listId):
+		keys = 'SELECT key FROM peaks WHERE list = ?'
+		for table in peakTables:
+			self.db.execute('DELETE FROM {} WHERE peak IN ({})'.format(table, keys), (listId,))
+		self.db.execute('DELETE FROM peaks WHERE list = ?', (listId,))
+		self.db.execute('DELETE FROM lists WHERE id = ?', (listId,))
+
+	def insertList(self, pl, inputs, digest):
+		self.db.execute('INSERT INTO lists VALUES (?, ?, ?, ?, ?)',
+			(pl.id, pl.name, pl.sortkey, ' '.join(inputs), digest))
+
+		peaks = []
+		elevations = []
+		prominences = []
+		peakLand = []
+		climbs = []
+
+		for section in pl.sections:
+			for peak in section.peaks:
+				key = peak.listId()
+				minClass, maxClass = parseGrade(peak.grade)
+				peaks.append((key, pl.id, peak.id + peak.idSuffix(), int(peak.id.split('.')[0]),
+					peak.name.replace('&quot;', '"'), peak.otherName,
+					float(peak.latitude), float(peak.longitude),
+					peak.getElevForStats(), round(peak.getPromForStats()),
+					peak.grade, minClass, maxClass, '/'.join(peak.country), '/'.join(peak.state),
+					peak.isClimbed, peak.isEmblem, peak.isMtneer, peak.delisted, peak.suspended,
+					None if peak.dataFrom is None else peak.dataFromPeak.listId(),
+					peak.bobBurdId, peak.listsOfJohnId, peak.peakbaggerId,
+					None if peak.summitpostId is None else '{}/{}'.format(peak.summitpostName, peak.summitpostId),
+					peak.wikipediaLink))
+
+				if peak.dataFrom is not None:
+					continue
+
+				for i, e in enumerate(peak.elevations):
+					src = e.source
+					elevations.append((key, i, e.elevationFeet, getattr(e, 'elevationMeters', None),
+						e.isRange,
+						src.id if isinstance(src, sps_read.USGSTopo) else None,
+						src.id if isinstance(src, sps_read.NGSDataSheet) else None))
+
+				for i, prom in enumerate(peak.prominences):
+					if isinstance(prom, int):
+						prominences.append((key, i, prom, None))
+					else:
+						prominences.append((key, i, round(prom.avgFeet()),
+							None if prom.source is None else str(prom.source)))
+
+				for i, area in enumerate(peak.landManagement):
+					peakLand.append((key, i, area.name))
+
+				if peak.isClimbed:
+					for i, (date, climbedWith, tooltip) in enumerate(peak.climbed):
+						date, photos = (date, None) if isinstance(date, str) else date
+						climbs.append((key, i, isoDate(date), photos,
+							', '.join([name if isinstance(name, str) else name[0] for name in climbedWith])))
+
+		self.db.executemany('INSERT INTO peaks VALUES ({})'.format(','.join('?' * 26)), peaks)
+		self.db.executemany('INSERT INTO elevations VALUES (?, ?, ?, ?, ?, ?, ?)', elevations)
+		self.db.executemany('INSERT INTO prominences VALUES (?, ?, ?, ?)', prominences)
+		self.db.executemany('INSERT INTO peakLand VALUES (?, ?, ?)', peakLand)
+		self.db.executemany('INSERT INTO climbs VALUES (?, ?, ?, ?, ?)', climbs)
+
+	def writeGlobalTables(self):
+		for table in globalTables:
+			self.db.execute('DELETE FROM {}'.format(table))
+
+		self.db.executemany('INSERT INTO landAreas VALUES (?, ?, ?, ?)', [
+			(area.name, area.landClass, area.link,
+				None if area.highPoint is None else area.highPoint.listId())
+			for area in sps_read.LandMgmtArea.name2area.values()])
+
+		self.db.executemany('INSERT INTO topos VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+			(topo.id, topo.name, topo.state, topo.series, topo.scale, topo.year,
+				topo.vdatum, topo.contourInterval)
+			for topo in sps_read.USGSTopo.sources.values()])
+
+		self.db.executemany('INSERT INTO dataSheets VALUES (?, ?, ?, ?)', [
+			(src.id, src.name, src.vdatum, src.peak.listId())
+			for src in sps_read.NGSDataSheet.sources.values()])
+
+def printRows(cursor):
+	header = [column[0] for column in cursor.description]
+	rows = [['' if value is None else sps_read.int2str(value)
+		if isinstance(value, int) and not isinstance(value, bool) and value >= 1000
+		else str(value) for value in row] for row in cursor]
+
+	widths = [max([len(row[i]) for row in rows], default=0) for i in range(len(header))]
+	widths = [max(width, len(name)) for width, name in zip(widths, header)]
+
+	for row in [header] + rows:
+		print('  '.join([value.ljust(width) for value, width in zip(row, widths)]).rstrip())
+
+	return len(rows)
+
+# Each canned query has an SQL template, and a function that parses its arguments
+# and returns the extra WHERE conditions (if any) and the parameters.
+
+def peaksQuery(args):
+	conditions = ['p.dataFrom IS NULL']
+	params = []
+
+	while args:
+		option = args.pop(0)
+		if option in ('--climbed', '--unclimbed'):
+			conditions.append('p.climbed = ?')
+			params.append(option == '--climbed')
+			continue
+		if not args:
+			err("Please specify a value after {}.", option)
+		value = args.pop(0)
+		if option in ('--min-elev', '--max-elev', '--min-prom'):
+			try:
+				value = int(value)
+			except ValueError:
+				err("Please specify an integer number of feet after {}.", option)
+			column = 'p.prominence' if option == '--min-prom' else 'p.elevation'
+			conditions.append('{} {} ?'.format(column, '<=' if option == '--max-elev' else '>='))
+		elif option == '--class':
+			try:
+				value = int(value)
+			except ValueError:
+				err("Please specify an integer class after --class.")
+			conditions.append('? BETWEEN p.minClass AND p.maxClass')
+		elif option == '--land':
+			conditions.append('EXISTS (SELECT 1 FROM peakLand l WHERE l.peak = p.key AND l.area LIKE ?)')
+			value = '%{}%'.format(value)
+		elif option == '--list':
+			conditions.append('EXISTS (SELECT 1 FROM peaks m'
+				' WHERE coalesce(m.dataFrom, m.key) = p.key AND m.list = ?)')
+			value = value.upper()
+		else:
+			err("Unrecognized option for the peaks query: {}", option)
+		params.append(value)
+
+	return conditions, params
+
+def historyQuery(args):
+	if not args:
+		return [], []
+	if len(args) > 1 or not args[0].isdigit():
+		err("Please specify a year (or nothing) after history.")
+	return ['c.date LIKE ?'], [args[0] + '-%']
+
+def landQuery(args):
+	if len(args) > 1:
+		err("Please specify a name pattern (or nothing) after land.")
+	if not args:
+		return [], []
+	return ['a.name LIKE ?'], ['%{}%'.format(args[0])]
+
+def topoQuery(args):
+	if len(args) != 1:
+		err("Please specify a topo name pattern after topo.")
+	return ['t.name LIKE ?'], ['%{}%'.format(args[0])]
+
+canned = {
+	'peaks': (peaksQuery, '''
+		SELECT p.key AS id, p.name, p.elevation, p.prominence AS prom,
+			replace(p.grade, 's', '-') AS class,
+			p.climbed, (SELECT group_concat(m.key, ' ') FROM peaks m
+				WHERE coalesce(m.dataFrom, m.key) = p.key AND m.key != p.key) AS also
+		FROM peaks p
+		WHERE {}
+		ORDER BY p.elevation DESC, p.key'''),
+	'history': (historyQuery, '''
+		SELECT c.date, p.key AS id, p.name, c.climbedWith AS "with"
+		FROM climbs c JOIN peaks p ON p.key = c.peak
+		WHERE {}
+		ORDER BY c.date, p.key'''),
+	'land': (landQuery, '''
+		SELECT a.name, a.landClass AS class, count(l.peak) AS peaks,
+			sum(p.climbed) AS climbed, a.highPoint
+		FROM landAreas a
+			LEFT JOIN peakLand l ON l.area = a.name
+			LEFT JOIN peaks p ON p.key = l.peak
+		WHERE {}
+		GROUP BY a.name
+		ORDER BY count(l.peak) DESC, a.name'''),
+	'topo': (topoQuery, '''
+		SELECT t.name AS topo, t.state, t.series, t.year, p.key AS id, p.name, e.feet
+		FROM topos t
+			JOIN elevations e ON e.topo = t.id
+			JOIN peaks p ON p.key = e.peak
+		WHERE {}
+		ORDER BY t.name, t.year, e.feet DESC'''),
+}
+
+def runQuery(peakDB, name, args):
+	startTime = time.perf_counter()
+
+	if name == 'sql':
+		if len(args) != 1:
+			err("Please specify the SQL query as one argument.")
+		sql, params = args[0], []
+	else:
+		parseArgs, sql = canned[name]
+		conditions, params = parseArgs(args)
+		sql = sql.format(' AND '.join(conditions) or '1')
+
+	try:
+		numRows = printRows(peakDB.db.execute(sql, params))
+	except sqlite3.Error as e:
+		err("SQLite error: {}", e)
+
+	log("{} row{} in {:.1f} ms", numRows, '' if numRows == 1 else 's',
+		(time.perf_counter() - startTime) * 1000)
+
+commands = ['update', 'rebuild', 'sql'] + sorted(canned)
+
+def dbCommand(module, command, args):
+	global sps_read
+	sps_read = module
+
+	startTime = time.perf_counter()
+	peakDB = PeakDB()
+	try:
+		numLists = peakDB.update(command == 'rebuild')
+		if numLists is not None or command in ('update', 'rebuild'):
+			log("{} {} ({} peak list{} written) in {:.1f} ms", peakDB.fileName,
+				'is up to date' if numLists is None else 'updated',
+				numLists or 0, '' if numLists == 1 else 's',
+				(time.perf_counter() - startTime) * 1000)
+		if command not in ('update', 'rebuild'):
+			runQuery(peakDB, command, args)
+	finally:
+		peakDB.close()
@@ -1,5 +1,17 @@
+import copyreg
+import geo
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import operator
+import os
+import pickle
 import re
 import sys
+import time
 import vertcon
 
 def log(message, *args, **kwargs):
@@ -17,6 +29,7 @@ class InputFile(object):
 	def __init__(self, fileName):
 		self.lineNumber = 0
 		self.fileObject = open(fileName)
+		self.lines = self.fileObject
 
 	def close(self):
 		self.fileObject.close()
@@ -25,12 +38,16 @@ class InputFile(object):
 		return self
 
 	def __next__(self):
-		line = self.fileObject.__next__()
+		line = self.lines.__next__()
 		self.lineNumber += 1
 		return line
 
 	next = __next__
 
+	def unread(self, lines):
+		self.lines = itertools.chain(lines, self.lines)
+		self.lineNumber -= len(lines)
+
 def int2str(n):
 	return str(n) if n < 1000 else '{},{:03}'.format(*divmod(n, 1000))
 
@@ -48,6 +65,7 @@ peakListsOrdered = [
 	('ocap','Other California Peaks', 124, 17),
 	('owp', 'Other Western Peaks', 21, 10),
 ]
+peakListParams = peakListsOrdered[:]
 
 def html2ListId(htmlId):
 	if htmlId[0] == 'x':
@@ -77,6 +95,11 @@ class PeakList(object):
 		self.country = ['US']
 		self.state = ['CA']
 		self.flags = set()
+		self.links = []
+		self.lineNumber = 0
+		self.prologue = ''
+		self.epilogue = ''
+		self.dirtyPeaks = set()
 
 		peakLists[lowerCaseId] = self
 
@@ -86,12 +109,28 @@ class PeakList(object):
 		except FormatError as e:
 			err("[{}:{}] {}!", self.htmlFilename, self.htmlFile.lineNumber, e.message)
 
+	def linkHTML(self):
+		try:
+			linkHTML(self)
+		except FormatError as e:
+			err("[{}:{}] {}!", self.htmlFilename, self.lineNumber, e.message)
+
 def initPeakLists():
 	for i, params in enumerate(peakListsOrdered):
 		pl = PeakList(*params)
 		pl.sortkey = i
 		peakListsOrdered[i] = pl
 
+def resetPeakLists():
+	# Forget the peak lists (and what linkHTML registered) so that they can be read again.
+
+	LandMgmtArea.name2area.clear()
+	USGSTopo.sources.clear()
+	NGSDataSheet.sources.clear()
+	peakLists.clear()
+	peakListsOrdered[:] = peakListParams
+	initPeakLists()
+
 def allPeaksGenerator():
 	for pl in peakListsOrdered:
 		for section in pl.sections:
@@ -99,11 +138,270 @@ def allPeaksGenerator():
 				if peak.dataFrom is None:
 					yield peak
 
-def readAllHTML():
+def getPeakList(listId):
+	return peakLists[listId]
+
+def reducePeakList(pl):
+	return getPeakList, (pl.id.lower(),)
+
+def fileDigest(fileName):
+	with open(fileName, 'rb') as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+class SnapshotUnpickler(pickle.Unpickler):
+	def __init__(self, data, module):
+		super().__init__(io.BytesIO(data))
+		self.module = module
+
+	def find_class(self, module, name):
+		if module == self.module:
+			return globals()[name]
+		return super().find_class(module, name)
+
+class Snapshot(object):
+	# The snapshot caches the result of readHTML (i.e. before linkHTML) for each peak list.
+	# An entry is reused as long as the size and mtime of the HTML file are unchanged or,
+	# if they did change, the SHA-256 digest of its contents is unchanged. The whole snapshot
+	# is discarded if the version or the digest of this source file changes.
+
+	enabled = True
+	fileName = 'data/cache/peaklists.pickle'
+	version = 4
+	parsedAttributes = ('country', 'state', 'flags', 'sections', 'links', 'lineNumber',
+		'prologue', 'epilogue')
+
+	def __init__(self):
+		self.source = fileDigest(__file__)
+		self.lists = {}
+		self.status = 'disabled'
+		self.modified = False
+		if self.enabled:
+			self.status = self.load()
+
+	def load(self):
+		try:
+			with open(self.fileName, 'rb') as f:
+				snapshot = pickle.load(f)
+		except FileNotFoundError:
+			return 'missing'
+		except Exception as e:
+			log("Ignoring corrupt snapshot {}: {}", self.fileName, e)
+			return 'corrupt'
+
+		if not isinstance(snapshot, dict) or not isinstance(snapshot.get('lists'), dict):
+			log("Ignoring corrupt snapshot {}", self.fileName)
+			return 'corrupt'
+		if snapshot.get('version') != self.version or snapshot.get('source') != self.source:
+			return 'stale'
+
+		self.lists = snapshot['lists']
+		return 'ok'
+
+	def save(self):
+		if not self.modified:
+			return
+
+		snapshot = {
+			'version': self.version,
+			'source': self.source,
+			'lists': self.lists,
+		}
+		os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+		tmpName = self.fileName + '.tmp'
+		with open(tmpName, 'wb') as f:
+			pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmpName, self.fileName)
+		self.modified = False
+
+	def getStatus(self, pl):
+		entry = self.lists.get(pl.id)
+		if entry is None:
+			return 'missing'
+
+		stat = os.stat(pl.htmlFilename)
+		if (stat.st_size, stat.st_mtime_ns) == entry['stat']:
+			return 'fresh'
+		if fileDigest(pl.htmlFilename) == entry['digest']:
+			entry['stat'] = (stat.st_size, stat.st_mtime_ns)
+			self.modified = True
+			return 'fresh'
+		return 'stale'
+
+	def restore(self, pl):
+		if not self.enabled or self.getStatus(pl) != 'fresh':
+			return False
+
+		entry = self.lists[pl.id]
+		data = entry['data']
+		try:
+			if hashlib.sha256(data).hexdigest() != entry['dataDigest']:
+				raise ValueError("Digest mismatch")
+			self.loads(pl, data, entry['module'])
+		except Exception as e:
+			log("Ignoring corrupt snapshot entry for {}: {}", pl.id, e)
+			return False
+		return True
+
+	def getSignature(self, pl):
+		if not self.enabled:
+			return None
+
+		stat = os.stat(pl.htmlFilename)
+		return (stat.st_size, stat.st_mtime_ns), fileDigest(pl.htmlFilename)
+
+	def store(self, pl, signature, data=None, module=__name__):
+		if signature is None:
+			return
+		if data is None:
+			data = self.dumps(pl)
+
+		self.lists[pl.id] = {
+			'stat': signature[0],
+			'digest': signature[1],
+			'module': module,
+			'data': data,
+			'dataDigest': hashlib.sha256(data).hexdigest(),
+		}
+		self.modified = True
+
+	@classmethod
+	def dumps(self, pl):
+		f = io.BytesIO()
+		pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+		pickler.dispatch_table = copyreg.dispatch_table.copy()
+		pickler.dispatch_table[PeakList] = reducePeakList
+		pickler.dump(tuple([getattr(pl, name) for name in self.parsedAttributes]))
+		return f.getvalue()
+
+	@classmethod
+	def loads(self, pl, data, module):
+		state = SnapshotUnpickler(data, module).load()
+		for name, value in zip(self.parsedAttributes, state):
+			setattr(pl, name, value)
+
+def parseHTML(listId):
+	# This is run in a worker process when reading peak lists in parallel. It returns
+	# the pickled state and the module name, or the line number and message of the
+	# format error.
+
+	if not peakLists:
+		initPeakLists()
+
+	pl = peakLists[listId]
+	try:
+		readHTML(pl)
+	except FormatError as e:
+		return None, None, pl.htmlFile.lineNumber, e.message
+
+	return Snapshot.dumps(pl), __name__, None, None
+
+def readPeakLists(snapshot, lists, jobs=None):
+	startTime = time.perf_counter()
+	pending = [pl for pl in lists if not snapshot.restore(pl)]
+	signatures = [snapshot.getSignature(pl) for pl in pending]
+
+	if jobs is None or jobs == 1 or len(pending) < 2:
+		for pl, signature in zip(pending, signatures):
+			pl.readHTML()
+			snapshot.store(pl, signature)
+	else:
+		import concurrent.futures
+
+		with concurrent.futures.ProcessPoolExecutor(min(jobs, len(pending))) as executor:
+			results = list(executor.map(parseHTML, [pl.id.lower() for pl in pending]))
+
+		for pl, signature, (data, module, lineNumber, message) in zip(pending, signatures, results):
+			if data is None:
+				err("[{}:{}] {}!", pl.htmlFilename, lineNumber, message)
+			snapshot.loads(pl, data, module)
+			snapshot.store(pl, signature, data, module)
+
+	if jobs is not None:
+		log("Read {} peak list{} ({} parsed) in {:.1f} ms with {} job{}",
+			len(lists), '' if len(lists) == 1 else 's', len(pending),
+			(time.perf_counter() - startTime) * 1000, jobs, '' if jobs == 1 else 's')
+
+def linkPeakLists(lists, jobs=None):
+	startTime = time.perf_counter()
+
+	for pl in peakListsOrdered:
+		if pl in lists:
+			pl.linkHTML()
+
+	if jobs is not None:
+		log("Linked {} peak list{} in {:.1f} ms", len(lists), '' if len(lists) == 1 else 's',
+			(time.perf_counter() - startTime) * 1000)
+
+def readAllHTML(jobs=None):
+	snapshot = Snapshot()
+	readPeakLists(snapshot, peakListsOrdered, jobs)
+	linkPeakLists(peakListsOrdered, jobs)
+	snapshot.save()
+
+def getLinkedListIds(pl):
+	listIds = set()
+	for section in pl.sections:
+		for peak in section.peaks:
+			if peak.dataFrom is not None:
+				listIds.add(peak.dataFromInfo[0])
+			for fromId in peak.dataAlso:
+				listIds.add(html2ListId(RE.dataFrom.match(fromId).group(1)))
+	return listIds
+
+def readLinkedHTML(lists, jobs=None):
+	# Read only the given peak lists and the peak lists that they're linked to
+	# (directly or indirectly) via data-from and data-also attributes.
+
+	snapshot = Snapshot()
+	pending = [pl for pl in peakListsOrdered if pl in lists]
+	loaded = []
+
+	while pending:
+		readPeakLists(snapshot, pending, jobs)
+		loaded.extend(pending)
+		linked = set()
+		for pl in pending:
+			for listId in getLinkedListIds(pl):
+				pl = peakLists.get(listId)
+				if pl is not None and pl not in loaded:
+					linked.add(pl)
+		pending = [pl for pl in peakListsOrdered if pl in linked]
+
+	linkPeakLists(loaded, jobs)
+	snapshot.save()
+
+def readPeakListHTML(pl, jobs=None):
+	readLinkedHTML([pl], jobs)
+
+def snapshotCommand(action):
+	if action == 'clear':
+		try:
+			os.remove(Snapshot.fileName)
+		except FileNotFoundError:
+			pass
+		return
+
+	Snapshot.enabled = True
+	snapshot = Snapshot()
+	if snapshot.status != 'ok':
+		print("Snapshot {} is {}".format(snapshot.fileName, snapshot.status))
+		return
+
+	print("{}: {} bytes, version {}".format(snapshot.fileName,
+		int2str(os.path.getsize(snapshot.fileName)), snapshot.version))
+
 	for pl in peakListsOrdered:
-		pl.readHTML()
+		status = snapshot.getStatus(pl)
+		if status == 'missing':
+			print("{:4} {}".format(pl.id, status))
+		else:
+			print("{:4} {:5} {:>9} bytes".format(pl.id, status,
+				int2str(len(snapshot.lists[pl.id]['data']))))
+	snapshot.save()
 
 class Section(object):
+	__slots__ = ('name', 'peaks', 'id2Peak', 'peakList', 'country', 'state', 'flags')
+
 	def __init__(self, peakList, name):
 		self.name = name
 		self.peaks = []
@@ -136,6 +434,20 @@ class Section(object):
 		setmax("state", stateCount)
 
 class Peak(object):
+	__slots__ = (
+		'id', 'name', 'otherName', 'peakList', 'quad', 'latitude', 'longitude', 'zoom',
+		'elevations', 'prominences', 'grade', 'summitpostId', 'summitpostName', 'wikipediaLink',
+		'bobBurdId', 'listsOfJohnId', 'peakbaggerId', 'column12', 'climbed', 'extraRow',
+		'dataFrom', 'dataFromInfo', 'dataFromPeak', 'dataAlso', 'dataAlsoPeaks',
+		'country', 'countryUS', 'state', 'flags', 'hasHtmlId', 'idTuple',
+		'isClimbed', 'isEmblem', 'isMtneer', 'landClass', 'landManagement',
+		'delisted', 'suspended', 'lineSpan',
+
+		# Set by sps_create
+		'fmtIdName', 'matchName', 'bobBurdPeak', 'listsOfJohnPeak', 'peakbaggerPeak',
+		'vulgarianRamblersPeak',
+	)
+
 	def __init__(self, section):
 		self.id = ''
 		self.name = ''
@@ -172,6 +484,7 @@ class Peak(object):
 		self.landManagement = []
 		self.delisted = False
 		self.suspended = False
+		self.lineSpan = None
 
 	def idSuffix(self):
 		if self.delisted:
@@ -183,10 +496,7 @@ class Peak(object):
 	def fromId(self):
 		return self.peakList.htmlId + self.id + self.idSuffix()
 
-	def jsonId(self):
-		if not self.dataAlsoPeaks:
-			return '"{}{}"'.format(self.id, self.idSuffix())
-
+	def memberPeaks(self):
 		peaks = self.dataAlsoPeaks[:]
 		if self.dataFrom is None:
 			peaks.insert(0, self)
@@ -194,15 +504,24 @@ class Peak(object):
 			peaks.insert(0, self.dataFromPeak)
 
 		peaks.sort(key=lambda p: p.peakList.sortkey)
+		return peaks
 
-		return '[{}]'.format(','.join(['"{}.{}{}"'.format(p.peakList.id, p.id, p.idSuffix())
-			for p in peaks]))
+	def listId(self):
+		return '{}.{}{}'.format(self.peakList.id, self.id, self.idSuffix())
+
+	def jsonId(self, allLists=False):
+		if not (self.dataAlsoPeaks or allLists):
+			return self.id + self.idSuffix()
+
+		return [p.listId() for p in self.memberPeaks()]
 
 	def elevationHTML(self):
 		return '<br>'.join([e.html() for e in self.elevations])
 
 	def elevationJSON(self):
-		return '[{}]'.format(','.join([e.json() for e in self.elevations]))
+		if len(self.elevations) == 1 and self.elevations[0].source is None:
+			return self.elevations[0].json()
+		return [e.json() for e in self.elevations]
 
 	def prominenceHTML(self):
 		return '<br>'.join([int2str(prom) if isinstance(prom, int) else prom.html()
@@ -253,7 +572,7 @@ class Peak(object):
 
 	def copyFrom(self, other):
 		doNotCopy = {'id', 'peakList', 'column12', 'dataFrom', 'dataAlso',
-			'hasHtmlId', 'isEmblem', 'isMtneer', 'delisted', 'suspended'}
+			'hasHtmlId', 'isEmblem', 'isMtneer', 'delisted', 'suspended', 'lineSpan'}
 
 		if other.dataFrom is not None:
 			err("{} should not have the data-from attribute!", self.dataFrom)
@@ -263,9 +582,9 @@ class Peak(object):
 				err('{} {} ({}) and {} ({}) should not both have data-from="{}"!',
 					p.peakList.id, p.id, p.name, self.id, self.name, self.dataFrom)
 
-		for k, v in vars(other).items():
-			if not (k[0] == '_' or k in doNotCopy):
-				setattr(self, k, v)
+		for k in self.__slots__:
+			if k not in doNotCopy and hasattr(other, k):
+				setattr(self, k, getattr(other, k))
 
 		if other.column12 is not None:
 			self.column12 = other.column12
@@ -326,6 +645,8 @@ def parseClasses(peak, classNames):
 	return False
 
 class LandMgmtArea(object):
+	__slots__ = ('name', 'peaks', 'landClass', 'link', 'highPoint', 'highestPoint')
+
 	name2area = {}
 	name2link = {
 	}
@@ -585,7 +906,7 @@ def parseLandManagement(htmlFile, peak):
 			return
 		raise FormatError("Empty land management column")
 
-	landList = peak.landManagement
+	landList = []
 
 	while True:
 		m = landMgmtPattern.match(line)
@@ -601,7 +922,7 @@ def parseLandManagement(htmlFile, peak):
 				landHP = landName[-3:]
 				landName = landName[:-3]
 
-		landList.append(LandMgmtArea.add(peak, landName, landLink, landHP is not None))
+		landList.append((landName, landLink, landHP is not None))
 
 		if line == '':
 			break
@@ -609,7 +930,13 @@ def parseLandManagement(htmlFile, peak):
 			badLine()
 		line = line[4:]
 
-	if peak.landClass != getLandClass(landList):
+	peak.peakList.links.append((htmlFile.lineNumber, peak, landList))
+
+def linkLandManagement(peak, landList):
+	for name, link, isHighPoint in landList:
+		peak.landManagement.append(LandMgmtArea.add(peak, name, link, isHighPoint))
+
+	if peak.landClass != getLandClass(peak.landManagement):
 		raise FormatError("Land management column doesn't match class")
 
 class LandMgmtSummary(object):
@@ -697,6 +1024,8 @@ def toMeters(feet, delta=0.5):
 	return int(feet * 12/39.37 + delta)
 
 class NGSDataSheet(object):
+	__slots__ = ('id', 'name', 'vdatum', 'linkSuffix', 'inMeters', 'peak')
+
 	sources = {}
 	linkPrefix = 'https://www.ngs.noaa.gov/cgi-bin/ds_mark.prl?PidBox='
 	tooltipPattern = re.compile(
@@ -724,15 +1053,18 @@ class NGSDataSheet(object):
 		src = self.sources.setdefault(self.id, self)
 		if src is self:
 			self.peak = peak
-			return
+			return self
 
 		raise FormatError("NGS Data Sheet ID {} referenced {} peak", self.id,
 			"more than once by the same" if src.peak is peak else "by more than one")
 
 	def elevJSON(self, elev):
-		return '[2,{},"{}","{}"]'.format(elev.elevationMeters, self.id, self.name)
+		return [2, elev.elevationMeters, self.id, self.name]
 
 class USGSTopo(object):
+	__slots__ = ('id', 'vdatum', 'series', 'seriesID', 'scale', 'name', 'state', 'year',
+		'linkSuffix', 'contourInterval', 'inMeters', 'peaks', 'scanId')
+
 	sources = {}
 	sourcesJSON = set()
 	linkPrefix = 'https://ngmdb.usgs.gov/ht-bin/tv_browse.pl?id='
@@ -832,7 +1164,7 @@ class USGSTopo(object):
 		src = self.sources.setdefault(self.id, self)
 		if src is self:
 			self.peaks = [peak]
-			return
+			return self
 
 		if src.contourInterval is None:
 			if self.contourInterval is not None:
@@ -841,26 +1173,26 @@ class USGSTopo(object):
 			self.contourInterval = src.contourInterval
 		self.peaks = src.peaks
 
-		if vars(self) != vars(src):
+		if any(getattr(self, k, None) != getattr(src, k, None) for k in self.__slots__):
 			raise FormatError("Topos with ID {} don't match", self.id)
 
-		peak.elevations[-1].source = src
 		src.peaks.append(peak)
+		return src
 
 	def elevJSON(self, elev):
 		self.sourcesJSON.add(self)
 
 		args = [1, elev.elevationMeters] if self.inMeters else [0, elev.elevationFeet]
 		args.append(self.contourInterval if elev.isRange else 0)
-		args.append(self.id)
+		args.append(JSONRaw(self.scanId))
 
-		return '[{}]'.format(','.join(map(str, args)))
+		return args
 
 	def json(self):
 		vdatumID = 2 if self.vdatum is None else 1 if self.vdatum == 'MSL' else 0
 
-		return '"{}":[{},{},"{}, {}","{}","{}"]'.format(self.id, self.seriesID, vdatumID,
-			self.name, self.state, self.year, self.linkSuffix)
+		return [self.seriesID, vdatumID, '{}, {}'.format(self.name, self.state),
+			self.year, self.linkSuffix]
 
 def parseElevationTooltip(e, link, tooltip):
 	for sourceClass in (NGSDataSheet, USGSTopo):
@@ -880,6 +1212,8 @@ def parseElevationTooltip(e, link, tooltip):
 	raise FormatError("Unrecognized elevation link")
 
 class Elevation(object):
+	__slots__ = ('isRange', 'elevationFeet', 'elevationMeters', 'source', 'latlng', 'extraLines')
+
 	pattern1 = re.compile('^([1-9](?:[0-9]?,[0-9])?[0-9]{2}\\+?)')
 	pattern2 = re.compile(
 		'^<span><a href="([^"]+)">' + pattern1.pattern[1:] + '</a>'
@@ -944,15 +1278,14 @@ class Elevation(object):
 
 	def json(self):
 		if self.source is None:
-			return '"{}"'.format(self.getElevation())
+			return self.getElevation()
 
-		jstr = self.source.elevJSON(self)
+		value = self.source.elevJSON(self)
 
 		if self.extraLines:
-			return '[{},"{}"]'.format(jstr[1:-1],
-				self.extraLines.replace('"', '\\"').replace('\n', '\\n'))
+			value.append(self.extraLines)
 
-		return jstr
+		return value
 
 	def checkTooltipElevation(self, elevation):
 		inMeters = elevation[-1] == 'm'
@@ -1150,7 +1483,7 @@ def parseElevation(htmlFile, peak):
 			parseElevationTooltip(e, m.group(1), m.group(3))
 			peak.elevations.append(e)
 			if peak.dataFrom is None:
-				e.source.addPeak(peak)
+				peak.peakList.links.append((htmlFile.lineNumber, peak, e))
 
 			if m.group(4) is None:
 				e.extraLines = '\n'
@@ -1175,19 +1508,18 @@ def parseElevation(htmlFile, peak):
 def printElevationStats():
 	print('====== Number of peaks with some/all elevations sourced\n')
 
+	table = PeakTable.get()
+	listRows = table.groupBy('list', range(len(table.peaks)))
+
 	for pl in peakListsOrdered:
+		rows = listRows.get(pl.id, [])
 		numAllSourced = 0
 		numSomeSourced = 0
-		for section in pl.sections:
-			for peak in section.peaks:
-				numSources = 0
-				for e in peak.elevations:
-					if e.source is not None:
-						numSources += 1
-				if numSources == len(peak.elevations):
-					numAllSourced += 1
-				elif numSources > 0:
-					numSomeSourced += 1
+		for numSources, numElevs in zip(table.values('numSourced', rows), table.values('numElevs', rows)):
+			if numSources == numElevs:
+				numAllSourced += 1
+			elif numSources > 0:
+				numSomeSourced += 1
 		print('{:4}: {:3}/{:3}/{:3}'.format(pl.id, numSomeSourced, numAllSourced, pl.numPeaks))
 
 	print('\n====== {} NGS Data Sheets\n'.format(len(NGSDataSheet.sources)))
@@ -1234,6 +1566,8 @@ def toRegExp(spec, *args):
 	return re.compile('^' + RE_Escape.sub('\\\\\\g<0>', spec[:-1]).format(*args) + '$')
 
 class SimpleColumn(object):
+	__slots__ = ('id',)
+
 	def __init__(self, urlPart):
 		self.id = urlPart
 
@@ -1257,16 +1591,20 @@ class SimpleColumn(object):
 		return self(m.group())
 
 class ColumnHPS(SimpleColumn):
+	__slots__ = ()
 	prefix = '<td><a href="https://hundredpeaks.org/guides/'
 	suffix = '.htm">HPS</a></td>\n'
 	pattern = re.compile('^[0-9]{2}[a-z]$')
 
 class ColumnPY(SimpleColumn):
+	__slots__ = ()
 	prefix = '<td><a href="https://www.petesthousandpeaks.com/Captions/nspg/'
 	suffix = '.html">PY</a></td>\n'
 	pattern = re.compile('^[a-z]+$')
 
 class ColumnVR(object):
+	__slots__ = ('name', 'rank')
+
 	spec = '<td><a href="https://vulgarianramblers.org/peak_detail.php?peak_name={}">{}</a></td>\n'
 	pattern = toRegExp(spec, '([-%0-9A-Za-z]+)', '((?:#[1-9][0-9]{0,2})|VR)')
 
@@ -1404,16 +1742,17 @@ class RE(object):
 		'([- #&\'()+.0-9;A-Za-z]+)</a>( \\*{1,2})?'
 		'(?:<br>\\(([A-Z][a-z]+(?: [A-Z][a-z]+)*(?: (?:HP|[1-9][0-9]+|VOR))?)\\))?</td>$'
 	)
-	peakName = (
-		re.compile('^(?:Mc)?[A-Z][a-z]+(?:\'s)?(?: (?:Mc|Le)?[A-Z][&;a-z]+)*(?: #[1-9])?$'),
-		re.compile('^(?:[A-Z][a-z]+ )+(?:Mountains|Range|Wilderness) HP$'),
-		re.compile('^(?:[A-Z][a-z]+ )+\\([A-Z][a-z]+(?: [A-Z][a-z]+)*\\)$'),
-		re.compile('^(?:[A-Z][a-z]+ )+(?:[A-Z]\\.|St\\.|del|in the|of the|and)(?: [A-Z][a-z]+)+$'),
-		re.compile('^[A-Z][a-z]+(?:-[a-z]{2,})?(?: [A-Z][a-z]+(?:-[a-z]{2,})?)+$'),
-		re.compile('^Mount [A-Z][a-z]+-[A-Z][a-z]+$'),
-		re.compile('^&quot;[A-Z][a-z]+(?: [A-Z][a-z]+)*&quot;$'),
-		re.compile('^Peak [1-9][0-9]{2,4}m?\\+?$'),
+	peakNames = (
+		'(?:Mc)?[A-Z][a-z]+(?:\'s)?(?: (?:Mc|Le)?[A-Z][&;a-z]+)*(?: #[1-9])?',
+		'(?:[A-Z][a-z]+ )+(?:Mountains|Range|Wilderness) HP',
+		'(?:[A-Z][a-z]+ )+\\([A-Z][a-z]+(?: [A-Z][a-z]+)*\\)',
+		'(?:[A-Z][a-z]+ )+(?:[A-Z]\\.|St\\.|del|in the|of the|and)(?: [A-Z][a-z]+)+',
+		'[A-Z][a-z]+(?:-[a-z]{2,})?(?: [A-Z][a-z]+(?:-[a-z]{2,})?)+',
+		'Mount [A-Z][a-z]+-[A-Z][a-z]+',
+		'&quot;[A-Z][a-z]+(?: [A-Z][a-z]+)*&quot;',
+		'Peak [1-9][0-9]{2,4}m?\\+?',
 	)
+	peakName = re.compile('^(?:' + '|'.join(peakNames) + ')$')
 	grade = re.compile(
 		'^<td>Class ([123456](?:s[23456])?\\+?)</td>$'
 	)
@@ -1446,6 +1785,13 @@ class RE(object):
 		'^<td><a href="https://forecast\\.weather\\.gov/MapClick\\.php\\?'
 		'lon=(-[0-9]{1,3}\\.[0-9]{1,6})&lat=([0-9]{1,2}\\.[0-9]{1,6})">WX</a></td>$'
 	)
+	linkColumns = re.compile(
+		'^(?:<td>&nbsp;</td>|' + summitpost.pattern[1:-1] + ')\n'
+		'(?:<td>&nbsp;</td>|' + wikipedia.pattern[1:-1] + ')\n' +
+		bobBurd.pattern[1:-1] + '\n' +
+		listsOfJohn.pattern[1:-1] + '\n' +
+		peakbagger.pattern[1:-1] + '\n$'
+	)
 	climbedDate = re.compile('^[0-9]{1,2}/[0-9]{1,2}/[0-9]{4}')
 	climbedLink = re.compile('^/photos/((?:[0-9A-Za-z]+/){1,2}(?:index[0-9]{2}\\.html)?)">')
 	climbedWithLink = re.compile('^(https?://[-\\./0-9A-Za-z]+)">')
@@ -1656,6 +2002,8 @@ def elevStr2Int(e):
 	return str2int(e), False
 
 class SimpleElevation(object):
+	__slots__ = ('minElev', 'maxElev', 'inMeters', 'saddle')
+
 	def __init__(self, baseElevation, contourInterval=0, inMeters=False, saddle=False):
 		assert contourInterval in (0, 10, 20, 25, 40, 50, 80)
 		assert contourInterval == 0 and inMeters or isinstance(baseElevation, int)
@@ -1702,6 +2050,8 @@ class SimpleElevation(object):
 		return "({} {} {}/2)".format(int2str(elev), sign, contour)
 
 class Prominence(object):
+	__slots__ = ('peakElev', 'saddleElev', 'source', 'extraInfo')
+
 	def __init__(self, peakElev, saddleElev, source, extraInfo=None):
 		self.peakElev = peakElev
 		self.saddleElev = saddleElev
@@ -1907,16 +2257,86 @@ def getCommonDataAttributes(row, parent):
 
 	return attr
 
+def parseLinkColumns(htmlFile, pl, peak):
+	emptyCell = '<td>&nbsp;</td>\n'
+
+	line = htmlFile.next()
+	if line != emptyCell:
+		m = RE.summitpost.match(line)
+		if m is None:
+			badLine()
+		peak.summitpostName = m.group(1)
+		peak.summitpostId = int(m.group(2))
+
+	line = htmlFile.next()
+	if line != emptyCell:
+		m = RE.wikipedia.match(line)
+		if m is None:
+			badLine()
+		peak.wikipediaLink = m.group(1)
+
+	line = htmlFile.next()
+	m = RE.bobBurd.match(line)
+	if m:
+		peak.bobBurdId = m.group(1)
+	elif line != emptyCell or (pl.id, peak.id) not in (
+		('OCAP', '6.4'), # Mount Saint Helena Southeast
+		('OCAP','16.1'), # Peak 2440+
+		('OCAP','17.3'), # Elliott Mountain
+		('OCAP','17.8'), # Angel Vista
+		('OCAP','17.10'),# Pop Top
+		('OSP', '17.4'), # Ruby Mesa
+		('OSP', '27.2'), # Snow Valley Peak East
+		('OSP', '27.3'), # Herlan Peak South
+		('OSP', '27.5'), # Peak 7136
+		('OWP',  '1.1'), # Sourdough Mountain Lookout
+	):
+		badLine()
+
+	line = htmlFile.next()
+	m = RE.listsOfJohn.match(line)
+	if m:
+		peak.listsOfJohnId = m.group(1)
+	elif line != emptyCell or peak.countryUS and (pl.id, peak.id) not in (
+		('OCAP', '6.4'), # Mount Saint Helena Southeast
+		('OCAP','16.1'), # Peak 2440+
+		('OCAP','17.3'), # Elliott Mountain
+		('OCAP','17.4'), # Lizard Rock
+		('OCAP','17.8'), # Angel Vista
+		('OCAP','17.10'),# Pop Top
+		('OSP', '17.4'), # Ruby Mesa
+		('OSP', '27.2'), # Snow Valley Peak East
+		('OSP', '27.3'), # Herlan Peak South
+		('OSP', '27.5'), # Peak 7136
+		('OWP',  '1.1'), # Sourdough Mountain Lookout
+	):
+		badLine()
+
+	line = htmlFile.next()
+	m = RE.peakbagger.match(line)
+	if m:
+		peak.peakbaggerId = m.group(1)
+	elif line != emptyCell or (pl.id, peak.id) not in (
+		('OCAP', '3.5'), # Peak 7905
+		('OCAP','16.1'), # Peak 2440+
+		('OSP', '17.4'), # Ruby Mesa
+		('OSP', '19.2'), # Peak 3113m
+		('OSP', '19.5'), # Volcanic Ridge East
+		('OSP', '27.5'), # Peak 7136
+	):
+		badLine()
+
 tableLine = '<p><table id="peakTable" class="land landColumn">\n'
 
 def readHTML(pl):
 	emptyCell = '<td>&nbsp;</td>\n'
 	extraRowFirstLine = '<tr><td colspan="{}"><ul>\n'.format(pl.numColumns - 1)
 	extraRowLastLine = '</ul></td></tr>\n'
-	dataFromList = []
 
 	pl.htmlFile = htmlFile = InputFile(pl.htmlFilename)
+	prologue = []
 	for line in htmlFile:
+		prologue.append(line)
 		if line == tableLine:
 			break
 	else:
@@ -1927,24 +2347,27 @@ def readHTML(pl):
 	if m is None:
 		raise FormatError("First row of peak table doesn't match expected pattern")
 	parseDataAttributes(pl, m.group(1))
+	prologue.append(line)
 
 	for line in htmlFile:
 		m = RE.sectionRow.match(line)
 		if m is not None:
 			section = addSection(pl, m)
 			break
+		prologue.append(line)
 	else:
 		raise FormatError("Cannot find first section row")
 
+	pl.prologue = ''.join(prologue)
+
 	for line in htmlFile:
 		m = RE.peakRow.match(line)
 		if m is not None:
 			peak = Peak(section)
+			firstLine = htmlFile.lineNumber
 			if not parseClasses(peak, m.group(1)):
 				raise FormatError("Bad class names")
 			parseDataAttributes(peak, m.group(2))
-			if peak.dataFrom is not None:
-				dataFromList.append(peak)
 
 			line = htmlFile.next()
 			m = RE.column1.match(line)
@@ -1979,10 +2402,7 @@ def readHTML(pl):
 			else:
 				badSuffix()
 
-			for pattern in RE.peakName:
-				if pattern.match(peak.name):
-					break
-			else:
+			if not RE.peakName.match(peak.name):
 				raise FormatError("Peak name doesn't match expected pattern")
 
 			parseLandManagement(htmlFile, peak)
@@ -2005,71 +2425,20 @@ def readHTML(pl):
 			line = htmlFile.next()
 			peak.prominences = parseProminence(line)
 
-			line = htmlFile.next()
-			if line != emptyCell:
-				m = RE.summitpost.match(line)
-				if m is None:
-					badLine()
-				peak.summitpostName = m.group(1)
-				peak.summitpostId = int(m.group(2))
-
-			line = htmlFile.next()
-			if line != emptyCell:
-				m = RE.wikipedia.match(line)
-				if m is None:
-					badLine()
-				peak.wikipediaLink = m.group(1)
+			# Match the SP, W, BB, LoJ, and Pb columns in one go. If that fails (or
+			# one of the last three is empty), go back and match them one at a time.
 
-			line = htmlFile.next()
-			m = RE.bobBurd.match(line)
-			if m:
-				peak.bobBurdId = m.group(1)
-			elif line != emptyCell or (pl.id, peak.id) not in (
-				('OCAP', '6.4'), # Mount Saint Helena Southeast
-				('OCAP','16.1'), # Peak 2440+
-				('OCAP','17.3'), # Elliott Mountain
-				('OCAP','17.8'), # Angel Vista
-				('OCAP','17.10'),# Pop Top
-				('OSP', '17.4'), # Ruby Mesa
-				('OSP', '27.2'), # Snow Valley Peak East
-				('OSP', '27.3'), # Herlan Peak South
-				('OSP', '27.5'), # Peak 7136
-				('OWP',  '1.1'), # Sourdough Mountain Lookout
-			):
-				badLine()
-
-			line = htmlFile.next()
-			m = RE.listsOfJohn.match(line)
-			if m:
-				peak.listsOfJohnId = m.group(1)
-			elif line != emptyCell or peak.countryUS and (pl.id, peak.id) not in (
-				('OCAP', '6.4'), # Mount Saint Helena Southeast
-				('OCAP','16.1'), # Peak 2440+
-				('OCAP','17.3'), # Elliott Mountain
-				('OCAP','17.4'), # Lizard Rock
-				('OCAP','17.8'), # Angel Vista
-				('OCAP','17.10'),# Pop Top
-				('OSP', '17.4'), # Ruby Mesa
-				('OSP', '27.2'), # Snow Valley Peak East
-				('OSP', '27.3'), # Herlan Peak South
-				('OSP', '27.5'), # Peak 7136
-				('OWP',  '1.1'), # Sourdough Mountain Lookout
-			):
-				badLine()
-
-			line = htmlFile.next()
-			m = RE.peakbagger.match(line)
-			if m:
-				peak.peakbaggerId = m.group(1)
-			elif line != emptyCell or (pl.id, peak.id) not in (
-				('OCAP', '3.5'), # Peak 7905
-				('OCAP','16.1'), # Peak 2440+
-				('OSP', '17.4'), # Ruby Mesa
-				('OSP', '19.2'), # Peak 3113m
-				('OSP', '19.5'), # Volcanic Ridge East
-				('OSP', '27.5'), # Peak 7136
-			):
-				badLine()
+			lines = [htmlFile.next() for i in range(5)]
+			m = RE.linkColumns.match(''.join(lines))
+			if m is not None:
+				(summitpostName, summitpostId, peak.wikipediaLink,
+					peak.bobBurdId, peak.listsOfJohnId, peak.peakbaggerId) = m.groups()
+				if summitpostName is not None:
+					peak.summitpostName = summitpostName
+					peak.summitpostId = int(summitpostId)
+			else:
+				htmlFile.unread(lines)
+				parseLinkColumns(htmlFile, pl, peak)
 
 			if pl.column12 is not None:
 				line = htmlFile.next()
@@ -2112,12 +2481,14 @@ def readHTML(pl):
 						break
 					peak.extraRow += line
 
+			peak.lineSpan = (firstLine, htmlFile.lineNumber)
 			section.peaks.append(peak)
 		else:
 			m = RE.sectionRow.match(line)
 			if m is not None:
 				section = addSection(pl, m)
 			elif line == '</table>\n':
+				pl.epilogue = line + htmlFile.fileObject.read()
 				break
 			else:
 				badLine()
@@ -2127,18 +2498,50 @@ def readHTML(pl):
 	if len(pl.sections) != pl.numSections:
 		raise FormatError("Number of sections is not {}", pl.numSections)
 
-	for peak in dataFromList:
-		pl2Id, sectionNumber, peakNumber = peak.dataFromInfo
-		pl2 = peakLists.get(pl2Id)
-		if pl2 is None:
-			raise FormatError("Peak list '{}' doesn't exist", pl2Id)
-		section = pl2.sections[sectionNumber - 1]
-		if section.id2Peak is None:
-			section.id2Peak = {p.id[p.id.find(".")+1:]: p for p in section.peaks}
-		peak.copyFrom(section.id2Peak[peakNumber])
-
-def writeHTML(pl):
+	pl.lineNumber = htmlFile.lineNumber
+
+def linkHTML(pl):
+	lineNumber = pl.lineNumber
+
+	for pl.lineNumber, peak, item in pl.links:
+		if isinstance(item, Elevation):
+			item.source = item.source.addPeak(peak)
+		else:
+			linkLandManagement(peak, item)
+
+	pl.lineNumber = lineNumber
+
+	for section in pl.sections:
+		for peak in section.peaks:
+			if peak.dataFrom is None:
+				continue
+			pl2Id, sectionNumber, peakNumber = peak.dataFromInfo
+			pl2 = peakLists.get(pl2Id)
+			if pl2 is None:
+				raise FormatError("Peak list '{}' doesn't exist", pl2Id)
+			section2 = pl2.sections[sectionNumber - 1]
+			if section2.id2Peak is None:
+				section2.id2Peak = {p.id[p.id.find(".")+1:]: p for p in section2.peaks}
+			peak.copyFrom(section2.id2Peak[peakNumber])
+
+def writeHTML(pl, file=None):
 	sectionFormat = '<tr class="section"{4}><td id="{0}{1}" colspan="{2}">{1}. {3}</td></tr>'
+
+	def out(*args, end='\n'):
+		print(*args, end=end, file=file)
+
+	out(pl.prologue, end='')
+
+	for sectionNumber, section in enumerate(pl.sections, start=1):
+		out(sectionFormat.format(pl.htmlId, sectionNumber, pl.numColumns, section.name,
+			getCommonDataAttributes(section, pl)))
+
+		for peak in section.peaks:
+			writePeakHTML(pl, section, peak, file)
+
+	out(pl.epilogue, end='')
+
+def writePeakHTML(pl, section, peak, file=None):
 	column2Format = '<td><a href="https://caltopo.com/map.html#ll={},{}&z={}&b=t">{}</a>{}{}</td>'
 	summitpostFormat = '<td><a href="https://www.summitpost.org/{0}/{1}">SP</a></td>'
 	wikipediaFormat = '<td><a href="https://en.wikipedia.org/wiki/{0}">W</a></td>'
@@ -2151,246 +2554,495 @@ def writeHTML(pl):
 	extraRowFirstLine = '<tr><td colspan="{}"><ul>'.format(pl.numColumns - 1)
 	extraRowLastLine = '</ul></td></tr>'
 
-	htmlFile = open(pl.htmlFilename)
-	for line in htmlFile:
-		print(line, end='')
-		if line == tableLine:
-			break
-	for line in htmlFile:
-		m = RE.sectionRow.match(line)
-		if m is not None:
-			break
-		print(line, end='')
+	def out(*args, end='\n'):
+		print(*args, end=end, file=file)
 
-	for sectionNumber, section in enumerate(pl.sections, start=1):
-		print(sectionFormat.format(pl.htmlId, sectionNumber, pl.numColumns, section.name,
-			getCommonDataAttributes(section, pl)))
+	suffix = ''
+	classNames = []
 
-		for peak in section.peaks:
-			suffix = ''
-			classNames = []
-
-			if peak.isClimbed:
-				classNames.append('climbed')
-			if peak.isMtneer:
-				suffix = ' *'
-				classNames.append('mtneer')
-			elif peak.isEmblem:
-				suffix = ' **'
-				classNames.append('emblem')
-			if peak.landClass is not None:
-				classNames.append(peak.landClass)
-			if peak.delisted:
-				classNames.append('delisted')
-			elif peak.suspended:
-				classNames.append('suspended')
-
-			attr = ''
-			if classNames:
-				attr += ' class="{}"'.format(' '.join(classNames))
-			if peak.dataFrom is not None:
-				attr += ' data-from="{}"'.format(peak.dataFrom)
-				peak.dataAlsoPeaks.remove(peak)
-			if peak.dataAlsoPeaks:
-				peak.dataAlsoPeaks.sort(key=lambda p: p.peakList.sortkey)
-				attr += ' data-also="{}"'.format(" ".join([p.fromId() for p in peak.dataAlsoPeaks]))
-			print('<tr{}{}>'.format(attr, getCommonDataAttributes(peak, section)))
-
-			attr = ''
-			if peak.hasHtmlId:
-				attr += ' id="{}{}"'.format(pl.htmlId, peak.id)
-			if peak.extraRow is not None:
-				attr += ' rowspan="2"'
-			print('<td{}>{}</td>'.format(attr, peak.id))
-
-			otherName = '' if peak.otherName is None else '<br>({})'.format(peak.otherName)
-
-			print(column2Format.format(peak.latitude, peak.longitude, peak.zoom,
-				peak.name, suffix, otherName))
-
-			if peak.landManagement:
-				print('<td>{}</td>'.format(peak.landManagementHTML()))
-			else:
-				print(emptyCell)
-
-			print('<td>{}</td>'.format(peak.elevationHTML()))
-
-			if peak.grade is None:
-				print(emptyCell)
-			else:
-				print('<td>Class {}</td>'.format(peak.grade))
+	if peak.isClimbed:
+		classNames.append('climbed')
+	if peak.isMtneer:
+		suffix = ' *'
+		classNames.append('mtneer')
+	elif peak.isEmblem:
+		suffix = ' **'
+		classNames.append('emblem')
+	if peak.landClass is not None:
+		classNames.append(peak.landClass)
+	if peak.delisted:
+		classNames.append('delisted')
+	elif peak.suspended:
+		classNames.append('suspended')
+
+	attr = ''
+	if classNames:
+		attr += ' class="{}"'.format(' '.join(classNames))
+	if peak.dataFrom is not None:
+		attr += ' data-from="{}"'.format(peak.dataFrom)
+	dataAlsoPeaks = [p for p in peak.dataAlsoPeaks if p is not peak]
+	if dataAlsoPeaks:
+		dataAlsoPeaks.sort(key=lambda p: p.peakList.sortkey)
+		attr += ' data-also="{}"'.format(" ".join([p.fromId() for p in dataAlsoPeaks]))
+	out('<tr{}{}>'.format(attr, getCommonDataAttributes(peak, section)))
+
+	attr = ''
+	if peak.hasHtmlId:
+		attr += ' id="{}{}"'.format(pl.htmlId, peak.id)
+	if peak.extraRow is not None:
+		attr += ' rowspan="2"'
+	out('<td{}>{}</td>'.format(attr, peak.id))
+
+	otherName = '' if peak.otherName is None else '<br>({})'.format(peak.otherName)
+
+	out(column2Format.format(peak.latitude, peak.longitude, peak.zoom,
+		peak.name, suffix, otherName))
+
+	if peak.landManagement:
+		out('<td>{}</td>'.format(peak.landManagementHTML()))
+	else:
+		out(emptyCell)
 
-			print('<td>{}</td>'.format(peak.prominenceHTML()))
+	out('<td>{}</td>'.format(peak.elevationHTML()))
 
-			if peak.summitpostId is None:
-				print(emptyCell)
-			else:
-				print(summitpostFormat.format(peak.summitpostName, peak.summitpostId))
+	if peak.grade is None:
+		out(emptyCell)
+	else:
+		out('<td>Class {}</td>'.format(peak.grade))
 
-			if peak.wikipediaLink is None:
-				print(emptyCell)
-			else:
-				print(wikipediaFormat.format(peak.wikipediaLink))
+	out('<td>{}</td>'.format(peak.prominenceHTML()))
 
-			if peak.bobBurdId is None:
-				print(emptyCell)
-			else:
-				print(bobBurdFormat.format(peak.bobBurdId))
+	if peak.summitpostId is None:
+		out(emptyCell)
+	else:
+		out(summitpostFormat.format(peak.summitpostName, peak.summitpostId))
 
-			if peak.listsOfJohnId is None:
-				print(emptyCell)
-			else:
-				print(listsOfJohnFormat.format(peak.listsOfJohnId))
+	if peak.wikipediaLink is None:
+		out(emptyCell)
+	else:
+		out(wikipediaFormat.format(peak.wikipediaLink))
 
-			if peak.peakbaggerId is None:
-				print(emptyCell)
-			else:
-				print(peakbaggerFormat.format(peak.peakbaggerId))
+	if peak.bobBurdId is None:
+		out(emptyCell)
+	else:
+		out(bobBurdFormat.format(peak.bobBurdId))
 
-			if pl.column12 is not None:
-				if peak.column12 is None:
-					print(emptyCell)
-				else:
-					print(str(peak.column12), end='')
+	if peak.listsOfJohnId is None:
+		out(emptyCell)
+	else:
+		out(listsOfJohnFormat.format(peak.listsOfJohnId))
 
-			if peak.countryUS:
-				print(weatherFormat.format(peak.longitude, peak.latitude))
-			else:
-				print(emptyCell)
+	if peak.peakbaggerId is None:
+		out(emptyCell)
+	else:
+		out(peakbaggerFormat.format(peak.peakbaggerId))
 
-			if peak.isClimbed:
-				print('<td>{}</td>'.format(climbed2Html(peak.climbed)))
-			else:
-				print(emptyCell)
+	if pl.column12 is not None:
+		if peak.column12 is None:
+			out(emptyCell)
+		else:
+			out(str(peak.column12), end='')
 
-			print('</tr>')
-			if peak.extraRow is not None:
-				print(extraRowFirstLine)
-				print(peak.extraRow, end='')
-				print(extraRowLastLine)
+	if peak.countryUS:
+		out(weatherFormat.format(peak.longitude, peak.latitude))
+	else:
+		out(emptyCell)
 
-	for line in htmlFile:
-		if line == '</table>\n':
-			print(line, end='')
-			break
-	for line in htmlFile:
-		print(line, end='')
-	htmlFile.close()
+	if peak.isClimbed:
+		out('<td>{}</td>'.format(climbed2Html(peak.climbed)))
+	else:
+		out(emptyCell)
+
+	out('</tr>')
+	if peak.extraRow is not None:
+		out(extraRowFirstLine)
+		out(peak.extraRow, end='')
+		out(extraRowLastLine)
+
+class JSONRaw(str):
+	pass
+
+encodeJSONString = json.encoder.encode_basestring
+
+def encodeJSON(value, append):
+	# Like json.dumps(value, separators=(',', ':'), ensure_ascii=False), except that the
+	# pieces are passed to append, and a JSONRaw value (e.g. a latitude as written in
+	# the HTML) is copied as is.
+
+	valueType = type(value)
+	if valueType is str:
+		append(encodeJSONString(value))
+	elif valueType is JSONRaw:
+		append(value)
+	elif valueType is dict:
+		separator = '{'
+		for k, v in value.items():
+			append(separator)
+			append(encodeJSONString(k))
+			append(':')
+			encodeJSON(v, append)
+			separator = ','
+		append('}' if value else '{}')
+	elif valueType is list:
+		separator = '['
+		for v in value:
+			append(separator)
+			encodeJSON(v, append)
+			separator = ','
+		append(']' if value else '[]')
+	elif valueType is bool:
+		append('true' if value else 'false')
+	elif valueType is int or valueType is float:
+		append(repr(value))
+	elif value is None:
+		append('null')
+	else:
+		raise TypeError("Cannot convert {} to JSON".format(valueType.__name__))
 
-def writePeakJSON(f, peak):
-	f('{\n"type":"Feature",\n"geometry":{"type":"Point","coordinates":')
-	f('[{},{}]'.format(peak.longitude, peak.latitude))
-	f('},\n"properties":{\n')
-	f('"id":{},\n'.format(peak.jsonId()))
+def toJSON(value):
+	parts = []
+	encodeJSON(value, parts.append)
+	return ''.join(parts)
 
-	p = [('name', peak.name)]
+def peakJSON(peak, allLists=False, isolation=None):
+	p = {'id': peak.jsonId(allLists), 'name': peak.name}
 	if peak.otherName is not None:
-		p.append(('name2', peak.otherName))
+		p['name2'] = peak.otherName
 
-	p.append(('prom', peak.prominenceHTML().replace('"', '\\"')))
+	p['prom'] = peak.prominenceHTML()
 	if peak.grade is not None:
-		p.append(('YDS', peak.grade))
+		p['YDS'] = peak.grade
 	if peak.bobBurdId is not None:
-		p.append(('BB', peak.bobBurdId))
+		p['BB'] = peak.bobBurdId
 	if peak.listsOfJohnId is not None:
-		p.append(('LoJ', peak.listsOfJohnId))
+		p['LoJ'] = peak.listsOfJohnId
 	if peak.peakbaggerId is not None:
-		p.append(('Pb', peak.peakbaggerId))
+		p['Pb'] = peak.peakbaggerId
 	if peak.summitpostId is not None:
-		p.append(('SP', '{}/{}'.format(peak.summitpostName, peak.summitpostId)))
+		p['SP'] = '{}/{}'.format(peak.summitpostName, peak.summitpostId)
 	if peak.wikipediaLink is not None:
-		p.append(('W', peak.wikipediaLink))
+		p['W'] = peak.wikipediaLink
 	if peak.isClimbed:
-		p.append(('climbed', '<br>'.join([date if isinstance(date, str) else
-			'<a href=\\"https://nightjuggler.com/photos/{1}\\">{0}</a>'.format(*date)
-			for date, climbedWith, tooltip in peak.climbed])))
-
-	for k, v in p:
-		f('"{}":"{}",\n'.format(k, v))
+		p['climbed'] = '<br>'.join([date if isinstance(date, str) else
+			'<a href="https://nightjuggler.com/photos/{1}">{0}</a>'.format(*date)
+			for date, climbedWith, tooltip in peak.climbed])
 
 	if peak.zoom != '15':
-		f('"z":{},\n'.format(peak.zoom))
-	if peak.isEmblem:
-		f('"emblem":true,\n')
-	elif peak.isMtneer:
-		f('"mtneer":true,\n')
+		p['z'] = int(peak.zoom)
+	if not allLists:
+		# Whether a peak is an emblem or mountaineers peak depends on the list,
+		# so for all.json that's in the index files instead.
+		if peak.isEmblem:
+			p['emblem'] = True
+		elif peak.isMtneer:
+			p['mtneer'] = True
 	if not peak.countryUS:
-		f('"noWX":true,\n')
+		p['noWX'] = True
 
-	f('"elev":')
-	if len(peak.elevations) == 1 and peak.elevations[0].source is None:
-		f(peak.elevations[0].json())
-	else:
-		f(peak.elevationJSON())
-	f('\n}}')
+	p['elev'] = peak.elevationJSON()
+
+	if isolation is not None:
+		iso = getIsolation(isolation, peak)
+		if iso is not None:
+			# The distance in km to the nearest higher peak, and its ID in its first list
+			p['iso'] = [round(iso[0] / 1000, 2), iso[1].listId()]
 
-def writeJSON(pl):
+	return {
+		'type': 'Feature',
+		'geometry': {'type': 'Point', 'coordinates': [JSONRaw(peak.longitude), JSONRaw(peak.latitude)]},
+		'properties': p,
+	}
+
+def featureCollection(listId, name, peaks, allLists=False, isolation=None):
 	import topoview
 	topos = topoview.read_csv()
 
 	for topo in USGSTopo.sources.values():
-		topo.id = topos[topo.id].scan_id
+		topo.scanId = topos[topo.id].scan_id
+	USGSTopo.sourcesJSON.clear()
+
+	features = [peakJSON(peak, allLists, isolation) for peak in peaks]
+
+	return {
+		'id': listId,
+		'name': name,
+		'type': 'FeatureCollection',
+		'features': features,
+		'topomaps': {topo.scanId: topo.json()
+			for topo in sorted(USGSTopo.sourcesJSON, key=lambda topo: topo.scanId)},
+	}
 
-	f = sys.stdout.write
-	firstPeak = True
+def isListed(peak):
+	return not (peak.delisted or peak.suspended)
+
+def peakListJSON(pl, isolation=None):
+	return featureCollection(pl.id, pl.name, [peak for section in pl.sections
+		for peak in section.peaks if isListed(peak)], isolation=isolation)
+
+def allPeaksJSON(isolation=None):
+	# Each peak is included once, even if it's in more than one list, and its id
+	# is the array of its IDs in all the lists (like the id of a data-from peak).
+
+	return featureCollection('ALL', 'All Peaks', [peak for peak in allPeaksGenerator()
+		if any(map(isListed, peak.memberPeaks()))], allLists=True, isolation=isolation)
+
+def writeFeatureJSON(f, feature):
+	f('{\n"type":"Feature",\n"geometry":')
+	encodeJSON(feature['geometry'], f)
+	separator = ',\n"properties":{\n'
+	for k, v in feature['properties'].items():
+		f(separator)
+		f(encodeJSONString(k))
+		f(':')
+		encodeJSON(v, f)
+		separator = ',\n'
+	f('\n}}')
+
+def writeCollectionJSON(collection, mode='pretty'):
+	# The pretty layout puts each property of a peak on its own line. The minified
+	# layout is all on one line, and the ndjson layout has a line with the id, name,
+	# and topomaps of the peak list, followed by one line for each peak (feature).
+
+	output = []
+	f = output.append
+
+	if mode == 'minify':
+		encodeJSON(collection, f)
+		f('\n')
+	elif mode == 'ndjson':
+		features = collection.pop('features')
+		del collection['type']
+		encodeJSON(collection, f)
+		f('\n')
+		for feature in features:
+			encodeJSON(feature, f)
+			f('\n')
+	else:
+		f('{\n')
+		f('"id":{},\n'.format(toJSON(collection['id'])))
+		f('"name":{},\n'.format(toJSON(collection['name'])))
+		f('"type":"FeatureCollection",\n')
+		f('"features":[')
+		for i, feature in enumerate(collection['features']):
+			if i:
+				f(',')
+			writeFeatureJSON(f, feature)
+		f('],\n"topomaps":{\n')
+		separator = ''
+		for k, v in collection['topomaps'].items():
+			f(separator)
+			f(encodeJSONString(k))
+			f(':')
+			encodeJSON(v, f)
+			separator = ',\n'
+		f('\n}}\n')
+
+	sys.stdout.write(''.join(output))
+
+def writeJSON(pl, mode='pretty', isolation=False):
+	writeCollectionJSON(peakListJSON(pl, computeIsolation() if isolation else None), mode)
+
+def writeAllJSON(mode='pretty', isolation=False):
+	writeCollectionJSON(allPeaksJSON(computeIsolation() if isolation else None), mode)
+
+def writeJSONIndex(pl):
+	# The index of a peak list for json/peaks/all.json: the IDs (as they appear in
+	# the id arrays there) of the peaks in the list, and which ones are emblem or
+	# mountaineers peaks.
+
+	index = {'id': pl.id, 'name': pl.name, 'peaks': []}
+	for flag in ('emblem', 'mtneer'):
+		index[flag] = []
 
-	f('{\n')
-	f('"id":"{}",\n'.format(pl.id))
-	f('"name":"{}",\n'.format(pl.name))
-	f('"type":"FeatureCollection",\n')
-	f('"features":[')
 	for section in pl.sections:
 		for peak in section.peaks:
-			if not (peak.delisted or peak.suspended):
-				if firstPeak:
-					firstPeak = False
-				else:
-					f(',')
-				writePeakJSON(f, peak)
+			if isListed(peak):
+				peakId = peak.listId()
+				index['peaks'].append(peakId)
+				if peak.isEmblem:
+					index['emblem'].append(peakId)
+				elif peak.isMtneer:
+					index['mtneer'].append(peakId)
+
+	print(toJSON(index))
 
-	f('],\n"topomaps":{\n')
-	f(',\n'.join([topo.json() for topo in sorted(USGSTopo.sourcesJSON, key=lambda topo: topo.id)]))
-	f('\n}}\n')
+# The number of worker processes for parsing peak files (set by --jobs)
+peakFileJobs = None
 
 def checkData(pl):
 	import sps_create
-	sps_create.checkData(pl)
+	sps_create.PeakFileCache.enabled = Snapshot.enabled
+	sps_create.checkData(pl, jobs=peakFileJobs)
+
+def writeIfChanged(fileName, content):
+	if isinstance(content, str):
+		content = content.encode()
+	try:
+		with open(fileName, 'rb') as f:
+			if f.read() == content:
+				return 'unchanged'
+		mode = os.stat(fileName).st_mode & 0o7777
+		status = 'updated'
+	except FileNotFoundError:
+		mode = None
+		status = 'created'
+
+	dirName = os.path.dirname(fileName)
+	if dirName:
+		os.makedirs(dirName, exist_ok=True)
+
+	tmpName = fileName + '.tmp'
+	with open(tmpName, 'wb') as f:
+		f.write(content)
+	if mode is not None:
+		os.chmod(tmpName, mode)
+	os.replace(tmpName, fileName)
+	return status
+
+buildTargets = (
+	('html', '{}.html', writeHTML),
+	('json', 'json/peaks/{}.json', writeJSON),
+	('index', 'json/peaks/index/{}.json', writeJSONIndex),
+	('check', 'data/check/{}.out', checkData),
+)
+
+def captureOutput(writeFunction, *args):
+	import contextlib
+
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		writeFunction(*args)
+	return output.getvalue()
+
+def buildOutput(fileName, writeFunction, *args):
+	try:
+		output = captureOutput(writeFunction, *args)
+	except (Exception, SystemExit) as e:
+		return 'failed', str(e) or type(e).__name__
+
+	return writeIfChanged(fileName, output), int2str(len(output)) + ' bytes'
+
+def buildOutputs(lists, targets):
+	startTime = time.perf_counter()
+	summary = {}
+
+	for pl in lists:
+		for target, fileNameFormat, writeFunction in buildTargets:
+			if target in targets:
+				fileName = fileNameFormat.format(pl.id.lower())
+				status, info = buildOutput(fileName, writeFunction, pl)
+				summary[status] = summary.get(status, 0) + 1
+				print("{:28} {:9} {}".format(fileName, status, info))
+
+	print("Built {} files in {:.2f} seconds ({})".format(sum(summary.values()),
+		time.perf_counter() - startTime,
+		", ".join(["{} {}".format(n, status) for status, n in sorted(summary.items())])))
+
+	if 'failed' in summary:
+		sys.exit(1)
+
+def readBuildHTML(args, jobs=None):
+	lists, targets = args
+	try:
+		readLinkedHTML(lists, jobs)
+	except SystemExit:
+		# The error was already logged, but err() exits with status 0, and build's
+		# status should be nonzero if any output can't be built.
+		sys.exit(1)
+
+def readJSONHTML(args, jobs=None):
+	pl, mode, isolation = args
+	if isolation:
+		readAllHTML(jobs)
+	else:
+		readLinkedHTML([pl], jobs)
+
+def readPatchHTML(args, jobs=None):
+	pl, dryRun = args
+	readLinkedHTML([pl], jobs)
 
 def compareTopoMetadata():
 	import topoview
 	topoview.compare(USGSTopo.sources)
 
-def setProm(pl):
+def patchHTML(pl, dryRun=False):
+	# Rewrite only the rows of the peaks in pl.dirtyPeaks, using the line spans
+	# recorded by readHTML, and leave the rest of the file as is.
+
+	import difflib
+
+	with open(pl.htmlFilename) as f:
+		lines = f.readlines()
+
+	prologue = pl.prologue.splitlines(keepends=True)
+	epilogue = pl.epilogue.splitlines(keepends=True)
+	if lines[:len(prologue)] != prologue or lines[len(lines) - len(epilogue):] != epilogue:
+		err("{} has changed since it was read!", pl.htmlFilename)
+
+	dirtyPeaks = [(section, peak) for section in pl.sections
+		for peak in section.peaks if peak in pl.dirtyPeaks]
+
+	newLines = lines[:]
+	for section, peak in reversed(dirtyPeaks):
+		firstLine, lastLine = peak.lineSpan
+		row = io.StringIO()
+		writePeakHTML(pl, section, peak, row)
+		newLines[firstLine - 1:lastLine] = row.getvalue().splitlines(keepends=True)
+
+	if dryRun:
+		sys.stdout.writelines(difflib.unified_diff(lines, newLines,
+			'a/' + pl.htmlFilename, 'b/' + pl.htmlFilename))
+		return
+
+	status = writeIfChanged(pl.htmlFilename, ''.join(newLines))
+	log("{} {} ({} rows rewritten)", pl.htmlFilename, status, len(dirtyPeaks))
+
+def setProm(pl, dryRun=False):
 	import sps_create
-	sps_create.checkData(pl, setProm=True)
-	writeHTML(pl)
+	sps_create.PeakFileCache.enabled = Snapshot.enabled
+	sps_create.checkData(pl, setProm=True, jobs=peakFileJobs)
+	patchHTML(pl, dryRun)
 
-def setVR(pl):
+def setVR(pl, dryRun=False):
 	import sps_create
-	sps_create.checkData(pl, setVR=True)
-	writeHTML(pl)
+	sps_create.PeakFileCache.enabled = Snapshot.enabled
+	sps_create.checkData(pl, setVR=True, jobs=peakFileJobs)
+	patchHTML(pl, dryRun)
+
+def readLoadHTML(args, jobs=None):
+	pl, fetchOptions = args
+	readLinkedHTML([pl], jobs)
 
-def loadPeakFiles(pl):
+def loadPeakFiles(pl, fetchOptions):
 	import sps_create
-	sps_create.loadPeakFiles(pl)
+	sps_create.loadPeakFiles(pl, fetchOptions)
 
-def loadPeakListFiles(pl):
+def loadPeakListFiles(pl, fetchOptions):
 	import sps_create
-	sps_create.loadPeakListFiles(pl)
+	sps_create.loadPeakListFiles(pl, fetchOptions)
 
 def loadTopoMetadata():
 	import topoview
 	topoview.load(USGSTopo.sources)
 
-def newTopoLink(pl):
+def newTopoLink(pl, dryRun=False):
 	import topoview
 	old_topos = topoview.read_csv()
 	new_topos = topoview.read_new()
 
+	changedPeaks = set()
 	for topo in USGSTopo.sources.values():
-		topo.linkSuffix = new_topos[old_topos[topo.id].scan_id].md5
+		linkSuffix = new_topos[old_topos[topo.id].scan_id].md5
+		if linkSuffix != topo.linkSuffix:
+			topo.linkSuffix = linkSuffix
+			changedPeaks.update(topo.peaks)
 
-	writeHTML(pl)
+	for section in pl.sections:
+		for peak in section.peaks:
+			if peak in changedPeaks or peak.dataFrom is not None and peak.dataFromPeak in changedPeaks:
+				pl.dirtyPeaks.add(peak)
+
+	patchHTML(pl, dryRun)
 
 def setLandManagement(peak):
 	peakPb = peak.peakbaggerPeak
@@ -2407,25 +3059,202 @@ def createList(pl):
 	import sps_create
 
 	try:
-		sps_create.createList(pl, peakLists, Peak, Section, setLandManagement)
+		sps_create.PeakFileCache.enabled = Snapshot.enabled
+		sps_create.createList(pl, peakLists, Peak, Section, setLandManagement, jobs=peakFileJobs)
 	except FormatError as e:
 		sys.exit(e.message)
 
 	writeHTML(pl)
 
+def serveCommands(address, verbose):
+	import sps_serve
+
+	sps_serve.serve(sys.modules[__name__], address, verbose)
+
+def watchCommand(lists, targets, interval):
+	import sps_watch
+
+	sps_watch.watch(sys.modules[__name__], lists, targets, interval)
+
+def dbCommand(command, args):
+	import sps_db
+
+	sps_db.dbCommand(sys.modules[__name__], command, args)
+
+class PeakTable(object):
+	# A columnar table of the per-peak fields used by the stats commands, built once
+	# after the peak lists are read. There's a row for every peak in every list, so a
+	# peak that's in more than one list has more than one row, but only one of them
+	# (the row that isn't data-from) is primary. If NumPy can be imported (and useNumPy
+	# is true), it's used for selecting rows and for the stats of large groups of rows,
+	# where it's faster than going through lists despite the per-call overhead.
+
+	useNumPy = True
+	numPyMinRows = 20000
+	numericColumns = ('elevFeet', 'elevMeters', 'promFeet', 'promMeters',
+		'latitude', 'longitude', 'primary', 'climbed', 'numElevs', 'numSourced')
+	groupColumns = ('country', 'state', 'region', 'list', 'section', 'land')
+	cached = None
+
+	def __init__(self):
+		self.lists = peakListsOrdered[:]
+		self.peaks = []
+		columns = {name: [] for name in self.numericColumns + self.groupColumns}
+		append = {name: column.append for name, column in columns.items()}
+
+		for pl in self.lists:
+			for section in pl.sections:
+				for peak in section.peaks:
+					self.peaks.append(peak)
+					elev = peak.getElevForStats()
+					prom = peak.getPromForStats()
+					append['elevFeet'](elev)
+					append['elevMeters'](toMeters(elev))
+					append['promFeet'](prom)
+					append['promMeters'](toMeters(prom))
+					append['latitude'](float(peak.latitude))
+					append['longitude'](float(peak.longitude))
+					append['primary'](peak.dataFrom is None)
+					append['climbed'](peak.isClimbed)
+					append['numElevs'](len(peak.elevations))
+					append['numSourced'](sum([e.source is not None for e in peak.elevations]))
+					append['country'](peak.country[0])
+					append['state'](peak.state[0])
+					append['region']('{}/{}'.format(peak.country[0], peak.state[0]))
+					append['list'](pl.id)
+					append['section']('{}.{}'.format(pl.id, peak.id.split('.')[0]))
+					append['land'](peak.landClass or 'none')
+
+		for name, column in columns.items():
+			setattr(self, name, column)
+
+		self.numpy = None
+		self.arrays = {}
+		if self.useNumPy and len(self.peaks) >= self.numPyMinRows:
+			try:
+				import numpy
+				self.numpy = numpy
+			except ImportError:
+				pass
+
+	@classmethod
+	def get(self):
+		table = self.cached
+		if table is None or table.useNumPy != self.useNumPy or len(table.lists) != len(peakListsOrdered) or \
+			any(pl is not other for pl, other in zip(table.lists, peakListsOrdered)):
+			table = self.cached = PeakTable()
+		return table
+
+	def select(self, *conditions):
+		# Return the indices of the rows for which all the conditions are true.
+		# Each condition is a tuple (numeric column name, operator, value), where
+		# the operator is '==' or '>='.
+
+		if self.numpy is not None:
+			mask = self.numpy.ones(len(self.peaks), dtype=bool)
+			for name, op, value in conditions:
+				column = self.array(name)
+				mask &= (column == value) if op == '==' else (column >= value)
+			return self.numpy.flatnonzero(mask).tolist()
+
+		rows = range(len(self.peaks))
+		for name, op, value in conditions:
+			column = getattr(self, name)
+			if op == '==':
+				rows = [i for i in rows if column[i] == value]
+			else:
+				rows = [i for i in rows if column[i] >= value]
+		return list(rows)
+
+	def groupBy(self, name, rows):
+		column = getattr(self, name)
+		groups = {}
+		for i in rows:
+			groups.setdefault(column[i], []).append(i)
+		return groups
+
+	def array(self, name):
+		array = self.arrays.get(name)
+		if array is None:
+			array = self.arrays[name] = self.numpy.array(getattr(self, name))
+		return array
+
+	def values(self, name, rows):
+		column = getattr(self, name)
+		return [column[i] for i in rows]
+
+	def stats(self, name, rows):
+		if self.numpy is not None and len(rows) >= self.numPyMinRows:
+			return ColumnStats(self, self.array(name)[rows], rows, self.numpy)
+		return ColumnStats(self, self.values(name, rows), rows)
+
+class ColumnStats(object):
+	# Statistics of the values of one column for a (non-empty) set of rows
+
+	def __init__(self, table, values, rows, numpy=None):
+		self.table = table
+		self.numpy = numpy
+		self.values = values
+		self.rows = rows
+		self.count = len(rows)
+		if self.numpy is not None:
+			self.sorted = self.numpy.sort(values)
+			self.min = self.sorted[0].item()
+			self.max = self.sorted[-1].item()
+			self.sum = values.sum().item()
+		else:
+			self.sorted = sorted(values)
+			self.min = self.sorted[0]
+			self.max = self.sorted[-1]
+			self.sum = sum(values)
+
+	def peaksWith(self, value):
+		if self.numpy is not None:
+			return [self.table.peaks[self.rows[i]] for i in self.numpy.flatnonzero(self.values == value)]
+		return [self.table.peaks[i] for i, v in zip(self.rows, self.values) if v == value]
+
+	def mean(self):
+		return float(self.sum) / self.count
+
+	def percentile(self, p):
+		# Linear interpolation between the closest ranks (like numpy.percentile)
+
+		if self.numpy is not None:
+			return self.numpy.percentile(self.sorted, p).item()
+
+		position = (self.count - 1) * p / 100.0
+		i = int(position)
+		if i + 1 >= self.count:
+			return self.sorted[-1]
+		return self.sorted[i] + (self.sorted[i + 1] - self.sorted[i]) * (position - i)
+
+	def median(self):
+		return self.percentile(50)
+
+	def histogram(self, binSize):
+		# Return a list of (lower bound, count) for the bins from the one with the
+		# minimum value to the one with the maximum value.
+
+		first = self.min // binSize
+		if self.numpy is not None:
+			counts = self.numpy.bincount(self.values // binSize - first).tolist()
+		else:
+			counts = [0] * (self.max // binSize - first + 1)
+			for value in self.values:
+				counts[value // binSize - first] += 1
+
+		return [((first + i) * binSize, n) for i, n in enumerate(counts)]
+
 def printStats():
+	table = PeakTable.get()
 	climbedElevs = []
 	climbedProms = []
-	for peak in allPeaksGenerator():
-		if peak.isClimbed:
-			name = peak.name.replace('&quot;', '"')
-
-			prom = toMeters(peak.getPromForStats())
-			climbedProms.append((prom, name))
-
-			if prom >= 100:
-				elev = toMeters(peak.getElevForStats())
-				climbedElevs.append((elev, name))
+	for i in table.select(('primary', '==', True), ('climbed', '==', True)):
+		name = table.peaks[i].name.replace('&quot;', '"')
+		prom = table.promMeters[i]
+		climbedProms.append((prom, name))
+		if prom >= 100:
+			climbedElevs.append((table.elevMeters[i], name))
 
 	n = len(climbedElevs)
 	eIndex = 0
@@ -2448,74 +3277,15 @@ def printStats():
 
 	print("P-Index:", pIndex)
 
-class RegionInfo(object):
-	def __init__(self, peak, elev, prom):
-		self.elevs = [elev]
-		self.minElev = elev
-		self.maxElev = elev
-		self.proms = [prom]
-		self.minProm = prom
-		self.maxProm = prom
-		self.minElevPeaks = [peak]
-		self.maxElevPeaks = [peak]
-		self.minPromPeaks = [peak]
-		self.maxPromPeaks = [peak]
-
-	def update(self, peak, elev, prom):
-		self.elevs.append(elev)
-		self.proms.append(prom)
-
-		if elev < self.minElev:
-			self.minElev = elev
-			self.minElevPeaks[:] = [peak]
-		elif elev == self.minElev:
-			self.minElevPeaks.append(peak)
-		if elev > self.maxElev:
-			self.maxElev = elev
-			self.maxElevPeaks[:] = [peak]
-		elif elev == self.maxElev:
-			self.maxElevPeaks.append(peak)
-
-		if prom < self.minProm:
-			self.minProm = prom
-			self.minPromPeaks[:] = [peak]
-		elif prom == self.minProm:
-			self.minPromPeaks.append(peak)
-		if prom > self.maxProm:
-			self.maxProm = prom
-			self.maxPromPeaks[:] = [peak]
-		elif prom == self.maxProm:
-			self.maxPromPeaks.append(peak)
-
 def printSummary(elevThreshold=3000, elevInMeters=True, promThreshold=100, promInMeters=True, allPeaks=False):
-	regionInfoMap = {}
-	total = None
-
-	for peak in allPeaksGenerator():
-		if allPeaks or peak.isClimbed:
-			prom = peak.getPromForStats()
-			if promInMeters:
-				prom = toMeters(prom)
-			if prom < promThreshold:
-				continue
-
-			elev = peak.getElevForStats()
-			if elevInMeters:
-				elev = toMeters(elev)
-			if elev < elevThreshold:
-				continue
+	table = PeakTable.get()
+	elevColumn = 'elevMeters' if elevInMeters else 'elevFeet'
+	promColumn = 'promMeters' if promInMeters else 'promFeet'
 
-			region = (peak.country[0], peak.state[0])
-			info = regionInfoMap.get(region)
-			if info is None:
-				regionInfoMap[region] = RegionInfo(peak, elev, prom)
-			else:
-				info.update(peak, elev, prom)
-
-			if total is None:
-				total = RegionInfo(peak, elev, prom)
-			else:
-				total.update(peak, elev, prom)
+	conditions = [('primary', '==', True), (promColumn, '>=', promThreshold), (elevColumn, '>=', elevThreshold)]
+	if not allPeaks:
+		conditions.append(('climbed', '==', True))
+	rows = table.select(*conditions)
 
 	def peakNames(peaks):
 		return "({})".format(", ".join([peak.name.replace('&quot;', '"') for peak in peaks]))
@@ -2525,36 +3295,68 @@ def printSummary(elevThreshold=3000, elevInMeters=True, promThreshold=100, promI
 	elev2Str = int2StrMeters if elevInMeters else int2StrFeet
 	prom2Str = int2StrMeters if promInMeters else int2StrFeet
 
-	def average(values):
-		return int(round(float(sum(values)) / len(values)))
-
-	def median(values):
-		values.sort()
-		i, j = divmod(len(values), 2)
-		if j == 0:
-			return int(round((values[i] + values[i-1]) / 2.0))
-		return values[i]
-
 	def align(label):
 		return "{:>16}:".format(label)
 
-	def printInfo(info, label):
-		print("{}: {}".format(label, len(info.elevs)))
+	def printInfo(rows, label):
+		elevs = table.stats(elevColumn, rows)
+		proms = table.stats(promColumn, rows)
+
+		print("{}: {}".format(label, len(rows)))
+
+		print(align("Min Elev"), elev2Str(elevs.min), peakNames(elevs.peaksWith(elevs.min)))
+		print(align("Max Elev"), elev2Str(elevs.max), peakNames(elevs.peaksWith(elevs.max)))
+		print(align("Mean Elev"), elev2Str(int(round(elevs.mean()))))
+		print(align("Median Elev"), elev2Str(int(round(elevs.median()))))
+
+		print(align("Min Prom"), prom2Str(proms.min), peakNames(proms.peaksWith(proms.min)))
+		print(align("Max Prom"), prom2Str(proms.max), peakNames(proms.peaksWith(proms.max)))
+		print(align("Mean Prom"), prom2Str(int(round(proms.mean()))))
+		print(align("Median Prom"), prom2Str(int(round(proms.median()))))
+
+	for region, regionRows in sorted(table.groupBy('region', rows).items()):
+		printInfo(regionRows, region)
+
+	printInfo(rows, "Total")
+
+def printGroupStats(groupBy='region', climbedOnly=False, inMeters=False, percentiles=(10, 25, 50, 75, 90),
+	binSize=None):
+
+	table = PeakTable.get()
+	unit = 'm' if inMeters else "'"
+
+	# Each peak is counted once, except when grouping by list or section.
+	conditions = [] if groupBy in ('list', 'section') else [('primary', '==', True)]
+	if climbedOnly:
+		conditions.append(('climbed', '==', True))
+	rows = table.select(*conditions)
+	if not rows:
+		return
+
+	labels = ['Min'] + ['P{:g}'.format(p) for p in percentiles] + ['Max', 'Mean']
+	row2Str = lambda label, values: "{:>6} ".format(label) + "".join(["{:>9}".format(v) for v in values])
 
-		print(align("Min Elev"), elev2Str(info.minElev), peakNames(info.minElevPeaks))
-		print(align("Max Elev"), elev2Str(info.maxElev), peakNames(info.maxElevPeaks))
-		print(align("Mean Elev"), elev2Str(average(info.elevs)))
-		print(align("Median Elev"), elev2Str(median(info.elevs)))
+	def printGroup(label, rows):
+		print("{} ({} peaks, {} climbed)".format(label, len(rows), sum(table.values('climbed', rows))))
+		print(row2Str('', labels))
 
-		print(align("Min Prom"), prom2Str(info.minProm), peakNames(info.minPromPeaks))
-		print(align("Max Prom"), prom2Str(info.maxProm), peakNames(info.maxPromPeaks))
-		print(align("Mean Prom"), prom2Str(average(info.proms)))
-		print(align("Median Prom"), prom2Str(median(info.proms)))
+		for name, column in (('Elev', 'elevMeters' if inMeters else 'elevFeet'),
+			('Prom', 'promMeters' if inMeters else 'promFeet')):
+			stats = table.stats(column, rows)
+			values = [stats.min] + [stats.percentile(p) for p in percentiles] + [stats.max, stats.mean()]
+			print(row2Str(name, [int2str(int(round(v))) + unit for v in values]))
 
-	for region, info in sorted(regionInfoMap.items()):
-		printInfo(info, "/".join(region))
+			if binSize is not None:
+				bins = stats.histogram(binSize)
+				scale = min(1, 50 / max([n for lower, n in bins]))
+				for lower, n in bins:
+					print("{:>16}  {:4}  {}".format(int2str(lower) + unit, n, '#' * round(n * scale)).rstrip())
+		print()
+
+	for label, groupRows in sorted(table.groupBy(groupBy, rows).items()):
+		printGroup(label, groupRows)
 
-	printInfo(total, "Total")
+	printGroup("Total", rows)
 
 def printHistory():
 	history = []
@@ -2570,6 +3372,386 @@ def printHistory():
 	for date, name in sorted(history):
 		print("{}-{:02}-{:02}".format(*date), name)
 
+class PeakIndex(object):
+	# A k-d tree over the peaks, using the (x, y, z) coordinates of each peak on the
+	# unit sphere, so that the distance between two points in the tree (the chord)
+	# grows with the great-circle distance, and there's no special case for the
+	# antimeridian. Candidates are found with the spherical distance, and then the
+	# distance on the WGS 84 ellipsoid (in meters) is computed for the closest ones.
+	# Each node also has the highest elevation (from getElevForStats) of its peaks,
+	# so that a search for the nearest higher peak can skip the nodes without one.
+
+	spheroid = geo.WGS_84_Ellipsoid
+	leafSize = 8
+
+	# The ratio of the spherical distance (using the mean radius) to the distance on
+	# the ellipsoid is between the mean radius divided by the largest and smallest
+	# radii of curvature of the ellipsoid, i.e. between about 0.9955 and 1.0056.
+	minSphericalRatio = 0.995
+	maxSphericalRatio = 1.006
+
+	def __init__(self, peaks):
+		points = []
+		for peak in peaks:
+			lat, lng = float(peak.latitude), float(peak.longitude)
+			points.append(self.toXYZ(lat, lng) + (lat, lng, peak, peak.getElevForStats()))
+
+		self.points = points
+		self.root = self.build(points[:]) if points else None
+
+	@staticmethod
+	def toXYZ(lat, lng):
+		lat *= geo.radiansPerDegree
+		lng *= geo.radiansPerDegree
+		cosLat = math.cos(lat)
+		return (cosLat * math.cos(lng), cosLat * math.sin(lng), math.sin(lat))
+
+	def build(self, points):
+		# A node is a tuple (bounds, maxElev, below, above), where bounds is the bounding
+		# box (minX, minY, minZ, maxX, maxY, maxZ) of the points in the node. A leaf has
+		# the list of its points (x, y, z, lat, lng, peak, elev) instead of below and
+		# None instead of above.
+
+		mins = [min(map(operator.itemgetter(axis), points)) for axis in range(3)]
+		maxs = [max(map(operator.itemgetter(axis), points)) for axis in range(3)]
+		bounds = tuple(mins + maxs)
+		maxElev = max(map(operator.itemgetter(6), points))
+
+		if len(points) <= self.leafSize:
+			return (bounds, maxElev, points, None)
+
+		axis = max(range(3), key=lambda axis: maxs[axis] - mins[axis])
+		points.sort(key=operator.itemgetter(axis))
+		middle = len(points) // 2
+
+		return (bounds, maxElev, self.build(points[:middle]), self.build(points[middle:]))
+
+	@staticmethod
+	def boundsDistance(xyz, bounds):
+		# The squared distance from xyz to the nearest point of the bounding box
+
+		x, y, z = xyz
+		minX, minY, minZ, maxX, maxY, maxZ = bounds
+		dx = minX - x if x < minX else x - maxX if x > maxX else 0
+		dy = minY - y if y < minY else y - maxY if y > maxY else 0
+		dz = minZ - z if z < minZ else z - maxZ if z > maxZ else 0
+		return dx*dx + dy*dy + dz*dz
+
+	def chordLimit(self, meters):
+		# The chord on the unit sphere for a spherical distance of meters
+
+		angle = meters / self.spheroid.meanRadius
+		return 2 * math.sin(min(angle, math.pi) / 2)
+
+	def distance(self, lat1, lng1, lat2, lng2):
+		return self.spheroid.distance(lat1, lng1, lat2, lng2)
+
+	def withinChord(self, xyz, chord, minElev=-math.inf):
+		# Return a list of (chord squared, point) for the points within chord of xyz
+		# that are higher than minElev.
+
+		x, y, z = xyz
+		maxSquared = chord * chord
+		boundsDistance = self.boundsDistance
+		found = []
+		nodes = [] if self.root is None else [self.root]
+
+		while nodes:
+			bounds, maxElev, below, above = nodes.pop()
+			if maxElev <= minElev or boundsDistance(xyz, bounds) > maxSquared:
+				continue
+			if above is not None:
+				nodes.append(below)
+				nodes.append(above)
+				continue
+			for point in below:
+				dx = point[0] - x
+				dy = point[1] - y
+				dz = point[2] - z
+				d = dx*dx + dy*dy + dz*dz
+				if d <= maxSquared and point[6] > minElev:
+					found.append((d, point))
+
+		return found
+
+	def near(self, lat, lng, radius):
+		# Return a sorted list of (distance, peak) for the peaks within radius meters.
+
+		chord = self.chordLimit(radius * self.maxSphericalRatio)
+		peaks = []
+
+		for d, point in self.withinChord(self.toXYZ(lat, lng), chord):
+			d = self.distance(lat, lng, point[3], point[4])
+			if d <= radius:
+				peaks.append((d, point[5]))
+
+		peaks.sort(key=lambda item: item[0])
+		return peaks
+
+	def nearestChord(self, xyz, accept, minElev):
+		# Best-first search: visit the nodes in order of the distance to their bounding
+		# boxes, until that's farther than the nearest point found so far.
+
+		x, y, z = xyz
+		boundsDistance = self.boundsDistance
+		bestSquared = math.inf
+		best = None
+		heap = [(0, 0, self.root)]
+		counter = 1
+
+		while heap:
+			d, i, (bounds, maxElev, below, above) = heapq.heappop(heap)
+			if d >= bestSquared:
+				break
+			if above is not None:
+				for node in (below, above):
+					if node[1] <= minElev:
+						continue
+					d = boundsDistance(xyz, node[0])
+					if d < bestSquared:
+						heapq.heappush(heap, (d, counter, node))
+						counter += 1
+				continue
+			for point in below:
+				dx = point[0] - x
+				dy = point[1] - y
+				dz = point[2] - z
+				d = dx*dx + dy*dy + dz*dz
+				if d < bestSquared and point[6] > minElev and (accept is None or accept(point[5])):
+					bestSquared = d
+					best = point
+
+		return best
+
+	def nearest(self, lat, lng, accept=None, minElev=-math.inf):
+		# Return (distance, peak) for the nearest peak higher than minElev for which
+		# accept(peak) is true (or for which accept is None), or None if there's no such peak.
+
+		if self.root is None or self.root[1] <= minElev:
+			return None
+
+		xyz = self.toXYZ(lat, lng)
+		point = self.nearestChord(xyz, accept, minElev)
+		if point is None:
+			return None
+
+		# Any peak that's closer on the ellipsoid is within this spherical distance:
+		d = self.spheroid.sphericalDistance(lat, lng, point[3], point[4])
+		d *= self.maxSphericalRatio / self.minSphericalRatio
+
+		candidates = self.withinChord(xyz, self.chordLimit(d), minElev)
+		candidates.sort(key=operator.itemgetter(0))
+		best = None
+		maxChordSquared = math.inf
+
+		for d, point in candidates:
+			if d > maxChordSquared:
+				break
+			if accept is None or accept(point[5]):
+				d = self.distance(lat, lng, point[3], point[4])
+				if best is None or d < best[0]:
+					best = (d, point[5])
+					maxChordSquared = self.chordLimit(d * self.maxSphericalRatio) ** 2
+
+		return best
+
+	def isolation(self):
+		# Return a dict mapping each peak to (distance, peak) for the nearest higher
+		# peak, or to None if there's no higher peak.
+
+		return {peak: self.nearest(lat, lng, minElev=elev)
+			for x, y, z, lat, lng, peak, elev in self.points}
+
+def printNearbyPeaks(lat, lng, radius, inMiles):
+	unit, metersPerUnit = ('mi', 1609.344) if inMiles else ('km', 1000)
+
+	def printPeak(distance, peak):
+		print("{:8.2f} {} {:>7}' {} ({})".format(distance / metersPerUnit, unit,
+			int2str(peak.getElevForStats()), peak.name.replace('&quot;', '"'),
+			', '.join([p.listId() for p in peak.memberPeaks()])))
+
+	# Like all.json, only include the peaks that are listed in at least one list.
+	index = PeakIndex([peak for peak in allPeaksGenerator()
+		if any(map(isListed, peak.memberPeaks()))])
+	peaks = index.near(lat, lng, radius * metersPerUnit)
+	if peaks:
+		for distance, peak in peaks:
+			printPeak(distance, peak)
+		return
+
+	print("No listed peaks within {:g} {}. The nearest one is:".format(radius, unit))
+	nearest = index.nearest(lat, lng)
+	if nearest is not None:
+		printPeak(*nearest)
+
+def computeIsolation():
+	# The isolation of each peak across all the lists. A data-from peak has the same
+	# isolation as the peak it refers to, so it isn't in the dict.
+
+	return PeakIndex(allPeaksGenerator()).isolation()
+
+def getIsolation(isolation, peak):
+	return isolation[peak if peak.dataFrom is None else peak.dataFromPeak]
+
+def printIsolation(pl=None):
+	isolation = computeIsolation()
+
+	if pl is None:
+		peaks = allPeaksGenerator()
+	else:
+		peaks = [peak for section in pl.sections for peak in section.peaks]
+
+	for peak in peaks:
+		iso = getIsolation(isolation, peak)
+		if iso is None:
+			distance, higher = '-', ''
+		else:
+			distance, higher = iso
+			distance = '{:.2f} km'.format(distance / 1000)
+			higher = "{} ({}, {}')".format(higher.name, higher.listId(), int2str(higher.getElevForStats()))
+		print("{:10} {:>7}' {:30} {:>10}  {}".format(peak.listId(), int2str(peak.getElevForStats()),
+			peak.name.replace('&quot;', '"'), distance, higher.replace('&quot;', '"')).rstrip())
+
+class CountingPattern(object):
+	def __init__(self, pattern, profiler):
+		self.compiledPattern = pattern
+		self.pattern = pattern.pattern
+		self.profiler = profiler
+
+	def match(self, *args):
+		self.profiler.count(0)
+		return self.compiledPattern.match(*args)
+
+	def search(self, *args):
+		self.profiler.count(0)
+		return self.compiledPattern.search(*args)
+
+class Profiler(object):
+	# The profiler replaces the functions and methods below (and the compiled
+	# patterns in RE and the other classes) with wrappers that time or count
+	# the calls. Nothing is replaced unless --profile is specified.
+
+	phases = (
+		('read', None, 'readPeakLists'),
+		('restore', 'Snapshot', 'restore'),
+		('parse', None, 'readHTML'),
+		('land', None, 'parseLandManagement'),
+		('elevation', None, 'parseElevation'),
+		('prominence', None, 'parseProminence'),
+		('climbed', None, 'parseClimbed'),
+		('link', None, 'linkHTML'),
+		('dataFrom', 'Peak', 'copyFrom'),
+		('writeHTML', None, 'writeHTML'),
+		('writeJSON', None, 'writeJSON'),
+	)
+	checks = (
+		(None, 'checkPeakNumber'),
+		(None, 'checkElevationOrder'),
+		(None, 'checkElevationTypes'),
+		('Elevation', 'checkTooltipElevation'),
+	)
+
+	def __init__(self):
+		self.phaseStats = {}
+		self.listStats = {}
+		self.currentList = None
+		self.wrappers = {}
+
+	def install(self):
+		module = globals()
+
+		for phase, className, name in self.phases:
+			owner = module if className is None else vars(module[className])
+			self.replace(owner, className, name, self.timed(phase, owner[name]))
+		for className, name in self.checks:
+			owner = module if className is None else vars(module[className])
+			self.replace(owner, className, name, self.counted(owner[name]))
+
+		for value in list(module.values()):
+			if isinstance(value, type) and value.__module__ == __name__:
+				for name, pattern in list(vars(value).items()):
+					if isinstance(pattern, re.Pattern):
+						setattr(value, name, CountingPattern(pattern, self))
+
+	def replace(self, owner, className, name, function):
+		if className is None:
+			owner[name] = function
+		else:
+			setattr(globals()[className], name, function)
+
+	def count(self, i):
+		stats = self.listStats.get(self.currentList)
+		if stats is None:
+			self.listStats[self.currentList] = stats = [0, 0]
+		stats[i] += 1
+
+	def wrapCommand(self, function):
+		wrapper = self.wrappers.get(function)
+		if wrapper is None:
+			wrapper = self.timed('command', function)
+		return wrapper
+
+	def timed(self, phase, function):
+		self.phaseStats[phase] = stats = [0, 0.0]
+
+		def wrapper(*args, **kwargs):
+			currentList = self.currentList
+			if args and isinstance(args[0], PeakList):
+				self.currentList = args[0].id
+			startTime = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				stats[0] += 1
+				stats[1] += time.perf_counter() - startTime
+				self.currentList = currentList
+
+		self.wrappers[function] = wrapper
+		return wrapper
+
+	def counted(self, function):
+		def wrapper(*args, **kwargs):
+			self.count(1)
+			return function(*args, **kwargs)
+		return wrapper
+
+	def report(self, command, totalSeconds, jsonFileName=None, extra=None):
+		lists = {}
+		for pl in peakListsOrdered:
+			stats = self.listStats.get(pl.id, [0, 0])
+			rows = sum([len(section.peaks) for section in pl.sections])
+			if rows or any(stats):
+				lists[pl.id] = {'rows': rows, 'matches': stats[0], 'checks': stats[1]}
+		stats = self.listStats.get(None)
+		if stats is not None:
+			lists['(none)'] = {'rows': 0, 'matches': stats[0], 'checks': stats[1]}
+
+		phases = {phase: {'calls': calls, 'seconds': round(seconds, 6)}
+			for phase, (calls, seconds) in self.phaseStats.items() if calls}
+
+		log("{:12} {:>7} {:>10}", "Phase", "Calls", "ms")
+		for phase, stats in phases.items():
+			log("{:12} {:7} {:10.2f}", phase, stats['calls'], stats['seconds'] * 1000)
+		log("{:12} {:7} {:10.2f}", "total", "", totalSeconds * 1000)
+		log("")
+		log("{:12} {:>7} {:>10} {:>10}", "List", "Rows", "Matches", "Checks")
+		for listId, stats in lists.items():
+			log("{:12} {:7} {:10} {:10}", listId, stats['rows'], stats['matches'], stats['checks'])
+
+		if jsonFileName is not None:
+			profile = {
+				'command': command,
+				'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+				'seconds': round(totalSeconds, 6),
+				'phases': phases,
+				'lists': lists,
+			}
+			if extra:
+				profile.update(extra)
+			with open(jsonFileName, 'w') as f:
+				json.dump(profile, f, indent='\t')
+				f.write('\n')
+
 def checkPeakListArg(args):
 	if len(args) < 1:
 		err("Please specify the peak list abbreviation after the command.")
@@ -2580,11 +3762,193 @@ def checkPeakListArg(args):
 		err("Please specify a valid peak list abbreviation.")
 	return pl
 
+def checkJSONOptions(args):
+	mode = 'pretty'
+	isolation = False
+	while args and args[0] in ('--minify', '--ndjson', '--isolation'):
+		option = args.pop(0)[2:]
+		if option == 'isolation':
+			isolation = True
+		else:
+			mode = option
+	return mode, isolation
+
+def checkJSONArgs(args):
+	mode, isolation = checkJSONOptions(args)
+	return checkPeakListArg(args), mode, isolation
+
+def checkJSONAllArgs(args):
+	mode, isolation = checkJSONOptions(args)
+	checkNoArgs(args)
+	return mode, isolation
+
+def checkDBArgs(args):
+	import sps_db
+
+	if not args:
+		return ('update', [])
+	command = args.pop(0)
+	if command not in sps_db.commands:
+		err("Please specify one of these after db: {}", ', '.join(sps_db.commands))
+	return (command, args)
+
+def checkServeArgs(args):
+	address = ('127.0.0.1', 8641)
+	verbose = False
+
+	while args:
+		option = args.pop(0)
+		if option == '--verbose':
+			verbose = True
+		elif option == '--port' and args and args[0].isdigit():
+			address = ('127.0.0.1', int(args.pop(0)))
+		elif option == '--socket' and args:
+			address = args.pop(0)
+		else:
+			err("Please specify --port <number>, --socket <path>, and/or --verbose after serve.")
+
+	return (address, verbose)
+
+def checkIsolationArgs(args):
+	return checkPeakListArg(args) if args else None
+
+def checkLoadArgs(args):
+	options = {
+		'--connections': ('connections', int, 1),
+		'--interval': ('interval', float, 0.1),
+		'--max-age': ('maxAge', float, 0),
+	}
+	fetchOptions = {}
+	while args and args[0] in options:
+		option = args.pop(0)
+		name, valueType, minValue = options[option]
+		try:
+			value = valueType(args.pop(0))
+		except (IndexError, ValueError):
+			value = minValue - 1
+		if not math.isfinite(value) or value < minValue:
+			err("Please specify a number (at least {}) after {}.", minValue, option)
+		fetchOptions[name] = value
+	return checkPeakListArg(args), fetchOptions
+
+def checkPatchArgs(args):
+	dryRun = len(args) > 0 and args[0] == '--dry-run'
+	if dryRun:
+		args.pop(0)
+	return checkPeakListArg(args), dryRun
+
+def checkWatchArgs(args):
+	interval = 0.5
+	if args and args[0] == '--interval':
+		args.pop(0)
+		try:
+			interval = float(args.pop(0))
+		except (IndexError, ValueError):
+			interval = 0
+		if not math.isfinite(interval) or interval <= 0:
+			err("Please specify a positive number of seconds after --interval.")
+
+	lists, targets = checkBuildArgs(args)
+	return lists, targets, interval
+
+def checkSnapshotArgs(args):
+	if len(args) != 1 or args[0] not in ('clear', 'stats'):
+		err("Please specify either 'stats' or 'clear' after the command.")
+	return args[0]
+
+def checkBuildArgs(args):
+	targets = []
+	while args and args[0].startswith('--'):
+		target = args.pop(0)[2:]
+		if target not in [t[0] for t in buildTargets]:
+			err("Please specify --html, --json, --index, and/or --check before the peak lists.")
+		if target not in targets:
+			targets.append(target)
+	if not targets:
+		targets = [t[0] for t in buildTargets]
+
+	if not args:
+		err("Please specify 'all' or one or more peak list abbreviations.")
+	if args == ['all']:
+		return peakListsOrdered, targets
+
+	lists = []
+	for arg in args:
+		pl = peakLists.get(arg)
+		if pl is None:
+			err("Please specify a valid peak list abbreviation ({}).", arg)
+		if pl not in lists:
+			lists.append(pl)
+
+	return lists, targets
+
 def checkNoArgs(args):
 	if len(args) != 0:
 		err("Too many command-line arguments!")
 	return None
 
+def checkNearArgs(args):
+	if len(args) < 1 or len(args) > 2:
+		err("Please specify a latitude,longitude and optionally a radius (e.g. 10km or 5mi).")
+	try:
+		lat, lng = map(float, args[0].split(','))
+	except ValueError:
+		err("Please specify the latitude and longitude as <lat>,<lng>.")
+	if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+		err("Please specify a valid latitude and longitude.")
+
+	radius, inMiles = '10', False
+	if len(args) > 1:
+		radius = args[1]
+		if radius.endswith('mi'):
+			radius, inMiles = radius[:-2], True
+		elif radius.endswith('km'):
+			radius = radius[:-2]
+	try:
+		radius = float(radius)
+	except ValueError:
+		radius = -1
+	if not math.isfinite(radius) or radius < 0:
+		err("Please specify a non-negative radius in km or mi.")
+
+	return (lat, lng, radius, inMiles)
+
+def checkGroupStatsArgs(args):
+	groupBy = 'region'
+	climbedOnly = False
+	inMeters = False
+	percentiles = (10, 25, 50, 75, 90)
+	binSize = None
+
+	while args:
+		option = args.pop(0)
+		if option == '--climbed':
+			climbedOnly = True
+		elif option == '--meters':
+			inMeters = True
+		elif option == '--by':
+			if not args or args[0] not in PeakTable.groupColumns:
+				err("Please specify one of {} after --by.", ", ".join(PeakTable.groupColumns))
+			groupBy = args.pop(0)
+		elif option == '--percentiles':
+			try:
+				percentiles = [float(p) for p in args.pop(0).split(',')]
+			except (IndexError, ValueError):
+				percentiles = [-1]
+			if not all(0 <= p <= 100 for p in percentiles):
+				err("Please specify comma-separated percentiles between 0 and 100 after --percentiles.")
+		elif option == '--histogram':
+			try:
+				binSize = int(args.pop(0))
+			except (IndexError, ValueError):
+				binSize = 0
+			if binSize < 1:
+				err("Please specify a positive bin size after --histogram.")
+		else:
+			err("Unrecognized option: {}", option)
+
+	return (groupBy, climbedOnly, inMeters, percentiles, binSize)
+
 def checkSumArgs(args):
 	elev, elevInMeters = 3000, True
 	prom, promInMeters =  100, True
@@ -2621,46 +3985,135 @@ def checkSumArgs(args):
 
 	return (elev, elevInMeters, prom, promInMeters, allPeaks)
 
+def getCommandMap():
+	return {
+		'build': (buildOutputs, checkBuildArgs, readBuildHTML),
+		'cache': (snapshotCommand, checkSnapshotArgs, None),
+		'check': (checkData, checkPeakListArg, readPeakListHTML),
+		'cmptopo': (compareTopoMetadata, checkNoArgs, readAllHTML),
+		'create': (createList, checkPeakListArg, readAllHTML),
+		'db': (dbCommand, checkDBArgs, None),
+		'elev': (printElevationStats, checkNoArgs, readAllHTML),
+		'groupstats': (printGroupStats, checkGroupStatsArgs, readAllHTML),
+		'history': (printHistory, checkNoArgs, readAllHTML),
+		'html': (writeHTML, checkPeakListArg, readPeakListHTML),
+		'json': (writeJSON, checkJSONArgs, readJSONHTML),
+		'jsonall': (writeAllJSON, checkJSONAllArgs, readAllHTML),
+		'jsonindex': (writeJSONIndex, checkPeakListArg, readPeakListHTML),
+		'isolation': (printIsolation, checkIsolationArgs, readAllHTML),
+		'land': (printLandManagementAreas, checkNoArgs, readAllHTML),
+		'load': (loadPeakFiles, checkLoadArgs, readLoadHTML),
+		'loadlist': (loadPeakListFiles, checkLoadArgs, None),
+		'loadtopo': (loadTopoMetadata, checkNoArgs, readAllHTML),
+		'near': (printNearbyPeaks, checkNearArgs, readAllHTML),
+		'newtopo': (newTopoLink, checkPatchArgs, readPatchHTML),
+		'setprom': (setProm, checkPatchArgs, readPatchHTML),
+		'serve': (serveCommands, checkServeArgs, None),
+		'setvr': (setVR, checkPatchArgs, readPatchHTML),
+		'stats': (printStats, checkNoArgs, readAllHTML),
+		'sum': (printSummary, checkSumArgs, readAllHTML),
+		'watch': (watchCommand, checkWatchArgs, None),
+	}
+
+def callCommand(commandFunction, args):
+	if args is None:
+		commandFunction()
+	elif isinstance(args, tuple):
+		commandFunction(*args)
+	else:
+		commandFunction(args)
+
 def main():
-	initPeakLists()
+	global peakFileJobs
 
-	commandMap = {
-		'check': (checkData, checkPeakListArg),
-		'cmptopo': (compareTopoMetadata, checkNoArgs),
-		'create': (createList, checkPeakListArg),
-		'elev': (printElevationStats, checkNoArgs),
-		'history': (printHistory, checkNoArgs),
-		'html': (writeHTML, checkPeakListArg),
-		'json': (writeJSON, checkPeakListArg),
-		'land': (printLandManagementAreas, checkNoArgs),
-		'load': (loadPeakFiles, checkPeakListArg),
-		'loadlist': (loadPeakListFiles, checkPeakListArg),
-		'loadtopo': (loadTopoMetadata, checkNoArgs),
-		'newtopo': (newTopoLink, checkPeakListArg),
-		'stats': (printStats, checkNoArgs),
-		'sum': (printSummary, checkSumArgs),
-	}
+	initPeakLists()
+	commandMap = getCommandMap()
+
+	args = sys.argv[1:]
+	jobs = None
+	profile = False
+	profileJSON = None
+	cProfileFile = None
+	traceMemory = False
+	while args and args[0].startswith('--'):
+		option = args.pop(0)
+		if option == '--no-cache':
+			Snapshot.enabled = False
+		elif option == '--jobs':
+			try:
+				jobs = int(args.pop(0))
+			except (IndexError, ValueError):
+				jobs = 0
+			if jobs < 1:
+				err("Please specify a positive number of jobs after --jobs.")
+		elif option == '--profile':
+			profile = True
+		elif option in ('--profile-json', '--cprofile'):
+			if not args:
+				err("Please specify a file name after {}.", option)
+			if option == '--cprofile':
+				cProfileFile = args.pop(0)
+			else:
+				profile = True
+				profileJSON = args.pop(0)
+		elif option == '--tracemalloc':
+			traceMemory = True
+		else:
+			err("Unrecognized option: {}", option)
 
-	if len(sys.argv) < 2:
+	if len(args) < 1:
 		err("Please specify a command, e.g. 'html' or 'json'.")
 
-	command, args = sys.argv[1], sys.argv[2:]
+	command = args.pop(0)
 
 	info = commandMap.get(command)
 	if info is None:
 		err("Please specify a valid command, e.g. 'html' or 'json'.")
 
-	commandFunction, checkArgs = info
+	commandFunction, checkArgs, readFunction = info
 	args = checkArgs(args)
 
-	readAllHTML()
-
-	if args is None:
-		commandFunction()
-	elif isinstance(args, tuple):
-		commandFunction(*args)
-	else:
-		commandFunction(args)
+	profiler = None
+	if profile:
+		profiler = Profiler()
+		profiler.install()
+		commandFunction = profiler.wrapCommand(commandFunction)
+		if jobs is not None:
+			log("Reading the peak lists in this process since worker processes aren't profiled")
+			jobs = None
+	peakFileJobs = jobs
+	if cProfileFile is not None:
+		import cProfile
+		cProfiler = cProfile.Profile()
+		cProfiler.enable()
+	if traceMemory:
+		import tracemalloc
+		tracemalloc.start()
+	startTime = time.perf_counter()
+
+	if readFunction is readAllHTML:
+		readAllHTML(jobs)
+	elif readFunction is not None:
+		readFunction(args, jobs)
+
+	callCommand(commandFunction, args)
+
+	totalSeconds = time.perf_counter() - startTime
+	extra = {}
+	if cProfileFile is not None:
+		cProfiler.disable()
+		cProfiler.dump_stats(cProfileFile)
+		log("Wrote cProfile stats to {}", cProfileFile)
+	if traceMemory:
+		current, peak = tracemalloc.get_traced_memory()
+		topStats = tracemalloc.take_snapshot().statistics('lineno')[:10]
+		tracemalloc.stop()
+		log("Traced memory: {:.2f} MB (peak {:.2f} MB)", current / 1048576, peak / 1048576)
+		for stat in topStats:
+			log("{}", stat)
+		extra['memory'] = {'current': current, 'peak': peak}
+	if profiler is not None:
+		profiler.report(command, totalSeconds, profileJSON, extra)
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,294 @@
+#
+# sps_serve - Keep the parsed peak lists in memory and run sps_read commands for clients
+#
+# Started by "sps_read.py serve [--port N | --socket path] [--verbose]". The server
+# listens on 127.0.0.1 (port 8641 by default) or on a Unix socket. Before each request,
+# it checks the size and mtime of every peak list's HTML file, and if any of them has
+# changed, it reads the peak lists again (using the snapshot cache for the others).
+#
+# POST /run     {"args": ["sum", "all"]} runs a command and returns
+#               {"status": 0, "stdout": "...", "stderr": "..."}
+# GET /peak/ID  returns the peak with the given list ID (e.g. SPS.4.7)
+# GET /find?q=  returns the peaks whose name contains the given text
+# GET /status   returns the number of peaks, reloads, and requests
+#
+# Besides the sps_read commands listed in servedCommands, /run also accepts "peak ID" and
+# "find text", which print the same lookups as text. sps_client.py is a thin client for /run.
+#
+import contextlib
+import http.server
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import time
+import traceback
+import urllib.parse
+
+# The sps_read module (which is __main__ when this is used by "sps_read.py serve"),
+# set by serve
+sps_read = None
+
+def log(message, *args, **kwargs):
+	# The server's own messages go to its stderr even while a command's is captured.
+	print(message.format(*args, **kwargs), file=sys.__stderr__)
+
+# The commands that run on the resident model. The other commands either change the HTML
+# files (e.g. create and setprom), read the peak lists themselves (db), or don't need them.
+servedCommands = ('build', 'check', 'cmptopo', 'elev', 'groupstats', 'history', 'html',
+	'isolation', 'json', 'jsonall', 'jsonindex', 'land', 'near', 'stats', 'sum')
+
+# The served commands that change the model: check (and build --check) sets attributes
+# like listsOfJohnPeak and peakbaggerPeak on the peaks. After one of these, the peak
+# lists are read again (from the snapshot cache) before the next request, so that each
+# command sees the same model as a fresh "sps_read.py" run.
+modelChangingCommands = ('build', 'check')
+
+class Model(object):
+	def __init__(self):
+		self.fileStats = None
+		self.changedBy = None
+		self.peaksById = {}
+		self.numReloads = 0
+		self.numRequests = 0
+		self.loadTime = None
+
+	def getFileStats(self):
+		stats = {}
+		for params in sps_read.peakListParams:
+			fileName = params[0] + '.html'
+			try:
+				stat = os.stat(fileName)
+				stats[fileName] = (stat.st_size, stat.st_mtime_ns)
+			except FileNotFoundError:
+				stats[fileName] = None
+		return stats
+
+	def refresh(self):
+		fileStats = self.getFileStats()
+		if fileStats == self.fileStats and self.changedBy is None:
+			return
+
+		if self.fileStats is not None:
+			changed = [fileName for fileName, stat in sorted(fileStats.items())
+				if self.fileStats.get(fileName) != stat]
+			if changed:
+				log("Reloading the peak lists ({} changed)", ", ".join(changed))
+			else:
+				log("Reloading the peak lists (after {})", self.changedBy)
+			self.numReloads += 1
+
+		# If reading fails (e.g. because of a format error in an HTML file that's
+		# being edited), try again on the next request.
+		self.fileStats = None
+		startTime = time.perf_counter()
+
+		sps_read.resetPeakLists()
+		sps_read.readAllHTML()
+
+		self.peaksById = {peak.listId().upper(): peak for pl in sps_read.peakListsOrdered
+			for section in pl.sections for peak in section.peaks}
+		self.fileStats = fileStats
+		self.changedBy = None
+		self.loadTime = time.perf_counter() - startTime
+
+	def findPeaks(self, text):
+		text = text.lower()
+		return [peak for peak in sps_read.allPeaksGenerator()
+			if text in peak.name.replace('&quot;', '"').lower()
+			or peak.otherName is not None and text in peak.otherName.lower()]
+
+	def getPeak(self, peakId):
+		peak = self.peaksById.get(peakId.upper())
+		if peak is not None and peak.dataFrom is not None:
+			peak = peak.dataFromPeak
+		return peak
+
+def peakInfo(peak):
+	info = {
+		'id': [p.listId() for p in peak.memberPeaks()],
+		'name': peak.name.replace('&quot;', '"'),
+	}
+	if peak.otherName is not None:
+		info['otherName'] = peak.otherName
+	info['latitude'] = float(peak.latitude)
+	info['longitude'] = float(peak.longitude)
+	info['elevation'] = peak.getElevForStats()
+	info['prominence'] = peak.getPromForStats()
+	if peak.grade is not None:
+		info['class'] = peak.grade.replace('s', '-')
+	info['land'] = [area.name for area in peak.landManagement]
+	if peak.isClimbed:
+		info['climbed'] = [date if isinstance(date, str) else date[0]
+			for date, climbedWith, tooltip in peak.climbed]
+	return info
+
+def printPeaks(peaks):
+	for peak in peaks:
+		info = peakInfo(peak)
+		print("{:>7}' {} ({}){}".format(sps_read.int2str(info['elevation']), info['name'],
+			', '.join(info['id']), '' if peak.isClimbed else ' (not climbed)'))
+
+def runCommand(model, args):
+	if not args:
+		sps_read.err("Please specify a command, e.g. 'sum' or 'peak SPS.4.7'.")
+
+	command = args.pop(0)
+	if command == 'peak':
+		if len(args) != 1:
+			sps_read.err("Please specify a peak ID (e.g. SPS.4.7) after peak.")
+		peak = model.getPeak(args[0])
+		if peak is None:
+			sps_read.err("There's no peak with ID {}.", args[0])
+		print(json.dumps(peakInfo(peak), indent='\t', ensure_ascii=False))
+		return
+	if command == 'find':
+		if len(args) != 1:
+			sps_read.err("Please specify the text to look for in the peak names after find.")
+		printPeaks(model.findPeaks(args[0]))
+		return
+
+	if command not in servedCommands:
+		sps_read.err("The server doesn't run '{}'. Please run it with sps_read.py.", command)
+
+	commandFunction, checkArgs, readFunction = sps_read.getCommandMap()[command]
+	if command in modelChangingCommands:
+		model.changedBy = command
+	sps_read.callCommand(commandFunction, checkArgs(args))
+
+def captureCommand(model, args):
+	stdout = io.StringIO()
+	stderr = io.StringIO()
+	status = 0
+
+	with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+		try:
+			model.refresh()
+			# runCommand pops the arguments it reads, and the caller may still log them.
+			runCommand(model, list(args))
+		except SystemExit as e:
+			if isinstance(e.code, int):
+				status = e.code
+			elif e.code is not None:
+				print(e.code, file=sys.stderr)
+				status = 1
+		except Exception:
+			traceback.print_exc()
+			status = 1
+
+	return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+	model = None
+	verbose = False
+
+	def sendJSON(self, value, status=200):
+		content = json.dumps(value, ensure_ascii=False).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json; charset=utf-8')
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def sendError(self, status, message):
+		self.sendJSON({'error': message}, status)
+
+	def do_GET(self):
+		model = self.model
+		model.numRequests += 1
+		url = urllib.parse.urlsplit(self.path)
+
+		try:
+			model.refresh()
+		except SystemExit:
+			self.sendError(500, "The peak lists couldn't be read")
+			return
+
+		if url.path.startswith('/peak/'):
+			peak = model.getPeak(urllib.parse.unquote(url.path[6:]))
+			if peak is None:
+				self.sendError(404, "No such peak")
+			else:
+				self.sendJSON(peakInfo(peak))
+		elif url.path == '/find':
+			text = urllib.parse.parse_qs(url.query).get('q', [''])[0]
+			self.sendJSON([peakInfo(peak) for peak in model.findPeaks(text)])
+		elif url.path == '/status':
+			self.sendJSON({
+				'lists': len(sps_read.peakListsOrdered),
+				'peaks': len(model.peaksById),
+				'loadTime': round(model.loadTime, 3),
+				'reloads': model.numReloads,
+				'requests': model.numRequests,
+			})
+		else:
+			self.sendError(404, "Not found")
+
+	def do_POST(self):
+		model = self.model
+		model.numRequests += 1
+
+		if self.path != '/run':
+			self.sendError(404, "Not found")
+			return
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			args = request['args']
+			if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+				raise ValueError("args must be a list of strings")
+		except (ValueError, KeyError, TypeError) as e:
+			self.sendError(400, "Bad request: {}".format(e))
+			return
+
+		startTime = time.perf_counter()
+		result = captureCommand(model, args)
+		if self.verbose:
+			log("{} -> {} ({:.1f} ms)", ' '.join(args), result['status'],
+				(time.perf_counter() - startTime) * 1000)
+		self.sendJSON(result)
+
+	def address_string(self):
+		return self.client_address[0] if self.client_address else 'unix'
+
+	def log_message(self, format, *args):
+		if self.verbose:
+			super().log_message(format, *args)
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+	def get_request(self):
+		request, clientAddress = super().get_request()
+		return request, ('unix', 0)
+
+def serve(module, address, verbose=False):
+	global sps_read
+	sps_read = module
+
+	model = Model()
+	model.refresh()
+	log("Read {} peaks in {:.0f} ms", len(model.peaksById), model.loadTime * 1000)
+
+	RequestHandler.model = model
+	RequestHandler.verbose = verbose
+
+	if isinstance(address, str):
+		if os.path.exists(address):
+			os.remove(address)
+		server = UnixHTTPServer(address, RequestHandler)
+		log("Listening on {}", address)
+	else:
+		server = http.server.HTTPServer(address, RequestHandler)
+		log("Listening on http://{}:{}/", *address)
+
+	# Clean up (i.e. remove the socket) when terminated, too.
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if isinstance(address, str) and os.path.exists(address):
+			os.remove(address)
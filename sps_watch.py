@@ -0,0 +1,214 @@
+#
+# sps_watch - Rebuild the outputs of the peak lists whenever their input files change
+#
+# Started by "sps_read.py watch [--interval seconds] [--html] [--json] [--index] [--check]
+# all|list ...". The watcher polls the size and mtime of the input files of each output
+# (the HTML files of the peak list and the lists it's linked to, topoview.txt for the
+# JSON, and the data/peaklists and data/peakfiles files read by the check), and after a
+# burst of changes has settled, it reads the changed peak lists again (the snapshot cache
+# restores the others) and rebuilds only the outputs whose inputs changed.
+#
+# The JSON, index, and check outputs are written like "sps_read.py build" writes them.
+# The HTML output isn't written back to the HTML file that's being edited. Instead, the
+# watcher reports the first line where the file differs from the regenerated HTML.
+#
+import glob
+import os
+import time
+
+# The sps_read module (which is __main__ when this is used by "sps_read.py watch"),
+# set by watch
+sps_read = None
+
+def log(message, *args, **kwargs):
+	sps_read.log(message, *args, **kwargs)
+
+def compareHTML(pl):
+	output = sps_read.captureOutput(sps_read.writeHTML, pl)
+	with open(pl.htmlFilename) as f:
+		content = f.read()
+	if content == output:
+		return 'unchanged', sps_read.int2str(len(output)) + ' bytes'
+
+	lines = content.splitlines()
+	for lineNumber, (line1, line2) in enumerate(zip(lines, output.splitlines()), start=1):
+		if line1 != line2:
+			break
+	else:
+		lineNumber = min(len(lines), len(output.splitlines())) + 1
+	return 'differs', 'at line {}'.format(lineNumber)
+
+class Watcher(object):
+	def __init__(self, listIds, targets, interval, settleTime=0.3):
+		self.listIds = listIds
+		self.targets = [target for target in sps_read.buildTargets if target[0] in targets]
+		self.interval = interval
+		self.settleTime = settleTime
+		self.htmlFiles = [params[0] + '.html' for params in sps_read.peakListParams]
+		self.inputs = {}
+		self.fileStats = {}
+		self.loaded = False
+		self.checked = False
+
+	def statFile(self, fileName):
+		try:
+			stat = os.stat(fileName)
+		except FileNotFoundError:
+			return None
+		return (stat.st_size, stat.st_mtime_ns)
+
+	def poll(self):
+		# Return the set of watched files whose size or mtime changed since the last poll.
+
+		changed = set()
+		for fileName, stat in self.fileStats.items():
+			newStat = self.statFile(fileName)
+			if newStat != stat:
+				self.fileStats[fileName] = newStat
+				changed.add(fileName)
+		return changed
+
+	def waitForChanges(self):
+		changed = set()
+		while not changed:
+			time.sleep(self.interval)
+			changed = self.poll()
+
+		# Editors often write a file more than once when saving (and several files may
+		# be saved at once), so wait until nothing has changed for settleTime seconds.
+		while True:
+			time.sleep(self.settleTime)
+			more = self.poll()
+			if not more:
+				return changed
+			changed |= more
+
+	def load(self):
+		sps_read.resetPeakLists()
+		try:
+			sps_read.readLinkedHTML([sps_read.peakLists[listId] for listId in self.listIds], 1)
+		except SystemExit:
+			# The FormatError (with the file name and line number) was already logged.
+			log("Waiting for the next change")
+			self.loaded = False
+			return False
+
+		self.loaded = True
+		self.checked = False
+		return True
+
+	def getLinkedLists(self, pl):
+		lists = [pl]
+		for pl in lists:
+			for listId in sorted(sps_read.getLinkedListIds(pl)):
+				linked = sps_read.peakLists.get(listId)
+				if linked is not None and linked not in lists:
+					lists.append(linked)
+		return lists
+
+	def getCheckInputs(self, pl):
+		import sps_create
+
+		inputs = []
+		listDirs = [pl.id.lower()]
+		if pl.id in ('SPS', 'OSP'):
+			listDirs.append('vr')
+		for listDir in listDirs:
+			inputs.extend(glob.glob('data/peaklists/{}/*'.format(listDir)))
+
+		for peakClass in (sps_create.PeakLoJ, sps_create.PeakPb):
+			for section in pl.sections:
+				for peak in section.peaks:
+					peakId = getattr(peak, peakClass.classAttrId, None)
+					if peakId is not None and peakId[0] != '-':
+						inputs.append(peakClass.getPeakFileName(peakId))
+		return inputs
+
+	def updateInputs(self):
+		# Map each output (list ID, target) to the set of its input files, and start
+		# watching any new input files.
+
+		inputs = {}
+		for listId in self.listIds:
+			pl = sps_read.peakLists[listId]
+			htmlFiles = [linked.htmlFilename for linked in self.getLinkedLists(pl)]
+			for target, fileNameFormat, writeFunction in self.targets:
+				files = set(htmlFiles)
+				if target == 'index':
+					files = {pl.htmlFilename}
+				elif target == 'json':
+					files.add('topoview.txt')
+				elif target == 'check':
+					files.update(self.getCheckInputs(pl))
+				inputs[listId, target] = files
+
+		self.inputs = inputs
+		for fileName in set(self.htmlFiles).union(*inputs.values()):
+			if fileName not in self.fileStats:
+				self.fileStats[fileName] = self.statFile(fileName)
+
+	def build(self, outputs):
+		startTime = time.perf_counter()
+		summary = {}
+
+		for listId in self.listIds:
+			pl = sps_read.peakLists[listId]
+			for target, fileNameFormat, writeFunction in self.targets:
+				if (listId, target) not in outputs:
+					continue
+				fileName = fileNameFormat.format(listId)
+				if target == 'check':
+					self.checked = True
+				if target == 'html':
+					status, info = compareHTML(pl)
+				else:
+					status, info = sps_read.buildOutput(fileName, writeFunction, pl)
+				summary[status] = summary.get(status, 0) + 1
+				log("{:28} {:9} {}", fileName, status, info)
+
+		log("Built {} files in {:.0f} ms ({})", sum(summary.values()),
+			(time.perf_counter() - startTime) * 1000,
+			", ".join(["{} {}".format(n, status) for status, n in sorted(summary.items())]))
+
+	def update(self, changed):
+		log("Changed: {}", ", ".join(sorted(changed)))
+
+		outputs = {output for output, files in self.inputs.items() if files & changed}
+		if not self.loaded or not changed.isdisjoint(self.htmlFiles) or self.checked and outputs:
+			# The check sets attributes (like listsOfJohnPeak) on the peaks, so after a
+			# check, the peak lists are read again (like after an HTML file changed)
+			# before any output is rebuilt. If the previous attempt failed, changes
+			# made since then weren't handled, so rebuild all the outputs.
+			wasLoaded = self.loaded
+			if not self.load():
+				return
+			self.updateInputs()
+			if wasLoaded:
+				outputs.update([output for output, files in self.inputs.items() if files & changed])
+			else:
+				outputs = set(self.inputs)
+
+		if outputs:
+			self.build(outputs)
+		else:
+			log("No outputs to rebuild")
+
+	def run(self):
+		self.fileStats = {fileName: self.statFile(fileName) for fileName in self.htmlFiles}
+		if self.load():
+			self.updateInputs()
+			self.build(set(self.inputs))
+
+		log("Watching {} files (press Ctrl-C to stop)", len(self.fileStats))
+		while True:
+			self.update(self.waitForChanges())
+
+def watch(module, lists, targets, interval=0.5):
+	global sps_read
+	sps_read = module
+
+	watcher = Watcher([pl.id.lower() for pl in lists], targets, interval)
+	try:
+		watcher.run()
+	except KeyboardInterrupt:
+		pass